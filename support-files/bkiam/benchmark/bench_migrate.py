@@ -0,0 +1,607 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+# do_migrate.py 的性能基准测试
+#
+# 在进程内启动一个模拟的权限中心模型接口, 生成不同规模的迁移文件, 统计端到端的耗时, 调用次数及发送的数据量
+#
+# usage:
+#     python bench_migrate.py
+#     python bench_migrate.py --scales 10,1000 --latency 5 --batch-size 100 --workers 8
+#     python bench_migrate.py --scales 1000 --async --concurrency 20 --error-rate 0.01
+
+import argparse
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import do_migrate  # noqa: E402
+
+BENCH_SYSTEM_ID = "bk-repo-bench"
+BENCH_SCALES = (10, 1000, 10000)
+
+# the kinds in the path => the kinds in the query response
+MODEL_KINDS = {
+    "resource-types": "resource_types",
+    "instance-selections": "instance_selections",
+    "actions": "actions",
+}
+
+MODEL_PATH_PATTERN = re.compile(r"^/api/v1/model/systems(?:/(?P<system_id>[^/]+))?(?:/(?P<rest>.*))?$")
+
+
+# =================== fake iam ===================
+
+
+class FakeIAMState(object):
+    """
+    模拟的权限中心模型数据, 以及请求统计
+    """
+
+    def __init__(self, latency=0, error_rate=0, error_status=503, seed=None, max_body_bytes=0, quota=0):
+        # seconds
+        self.latency = latency
+        # the request bodies larger than this are rejected with 413, like the body limit of a gateway
+        self.max_body_bytes = max_body_bytes
+        # the requests per second allowed, the others are answered with 429 and `Retry-After`, like a gateway
+        self.quota = quota
+        self._quota_second = 0
+        self._quota_used = 0
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.systems = {}
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.throttled = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+    def new_system(self, base_info):
+        self.systems[base_info["id"]] = {
+            "base_info": base_info,
+            "resource_types": {},
+            "instance_selections": {},
+            "actions": {},
+            "configs": {},
+        }
+
+    def over_quota(self):
+        """
+        return: the seconds until the quota is available again, 0 if the request is allowed
+        """
+        if not self.quota:
+            return 0
+        now = time.time()
+        if int(now) != self._quota_second:
+            self._quota_second, self._quota_used = int(now), 0
+        self._quota_used += 1
+        if self._quota_used <= self.quota:
+            return 0
+        self.throttled += 1
+        return int(now) + 1 - now
+
+    def inject_error(self):
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def __call__(self, method, path, body):
+        """
+        处理 /ping 及模型接口的请求, 返回 status, response; 也可直接作为 do_migrate.MemoryTransport 的handler
+        """
+        path = urlsplit(path).path
+        if path == "/ping":
+            return 200, {"code": 0, "message": "pong"}
+
+        match = MODEL_PATH_PATTERN.match(path)
+        if not match:
+            return 404, {"code": 1901404, "message": "not found: %s" % path}
+
+        with self.lock:
+            code, message, data = self.handle_model(method, match.group("system_id"), match.group("rest"), body)
+        return 200, {"code": code, "message": message, "data": data}
+
+    def handle_model(self, method, system_id, rest, body):
+        """
+        返回 code, message, data
+        """
+        systems = self.systems
+        if system_id is None:
+            if method != "POST":
+                return 1901405, "method not allowed", None
+            if body["id"] in systems:
+                return 1902409, "conflict: system(%s) already exists" % body["id"], None
+            self.new_system(dict(body))
+            return 0, "ok", {}
+
+        system = systems.get(system_id)
+        if system is None:
+            return 1901404, "not found: system(%s) not exists" % system_id, None
+
+        if rest is None:
+            system["base_info"].update(body)
+            return 0, "ok", {}
+
+        if rest == "query":
+            data = {"base_info": system["base_info"]}
+            for kind in MODEL_KINDS.values():
+                data[kind] = list(system[kind].values())
+            data.update(system["configs"])
+            return 0, "ok", data
+
+        parts = rest.split("/")
+        if parts[0] == "configs" and len(parts) == 2:
+            system["configs"][parts[1]] = body
+            return 0, "ok", {}
+
+        if parts[0] not in MODEL_KINDS:
+            return 1901404, "not found: %s" % rest, None
+
+        models = system[MODEL_KINDS[parts[0]]]
+        if len(parts) == 2:
+            if parts[1] not in models:
+                return 1901404, "not found: %s(%s) not exists" % (parts[0], parts[1]), None
+            if method == "DELETE":
+                models.pop(parts[1])
+            else:
+                models[parts[1]].update(body)
+            return 0, "ok", {}
+
+        if method == "POST":
+            for item in body:
+                if item["id"] in models:
+                    return 1902409, "conflict: %s(%s) already exists" % (parts[0], item["id"]), None
+            for item in body:
+                models[item["id"]] = dict(item)
+        elif method == "DELETE":
+            for item in body:
+                models.pop(item["id"], None)
+        return 0, "ok", {}
+
+
+class FakeIAMHandler(BaseHTTPRequestHandler):
+    """
+    模拟 /ping 及 /api/v1/model/systems/... 的模型接口, 返回格式与权限中心一致
+    """
+
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are written separately, avoid the delayed ack of the client
+    disable_nagle_algorithm = True
+
+    # set by FakeIAMServer
+    state = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        content = gzip.decompress(raw) if self.headers.get("Content-Encoding") == "gzip" else raw
+        return raw, json.loads(content.decode("utf-8")) if content else None
+
+    def _send(self, status, data, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with self.state.lock:
+            self.state.bytes_sent += len(body)
+
+    def _handle(self, method):
+        state = self.state
+        raw, body = self._read_body()
+        with state.lock:
+            state.calls += 1
+            state.bytes_received += len(raw)
+            inject_error = state.inject_error()
+            if inject_error:
+                state.errors += 1
+            too_large = state.max_body_bytes and len(raw) > state.max_body_bytes
+            if too_large:
+                state.rejected += 1
+            retry_after = state.over_quota()
+
+        if retry_after:
+            self._send(429, {"code": 1, "message": "too many requests"}, {"Retry-After": "%.3f" % retry_after})
+            return
+
+        if state.latency:
+            time.sleep(state.latency)
+        if too_large:
+            self._send(413, {"code": 1, "message": "request entity too large"})
+            return
+        if inject_error:
+            self._send(state.error_status, {"code": 1, "message": "injected error"})
+            return
+
+        self._send(*state(method, self.path, body))
+
+
+class FakeIAMServer(object):
+    """
+    在后台线程中运行的模拟权限中心
+    """
+
+    def __init__(self, state):
+        self.state = state
+        handler = type(str("BoundFakeIAMHandler"), (FakeIAMHandler,), {"state": state})
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def host(self):
+        return "http://%s:%d" % self.httpd.server_address[:2]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# =================== synthetic data ===================
+
+
+def gen_migration_data(action_count, system_id=BENCH_SYSTEM_ID):
+    """
+    生成包含 action_count 个操作的迁移数据, 资源类型为 project => repo => node 形式的层级,
+    操作关联一个资源类型及对应的实例视图, 并按资源类型组成操作组
+    """
+    resource_type_count = max(3, min(100, action_count // 10))
+    chain_depth = 3
+
+    operations = [
+        {
+            "operation": "upsert_system",
+            "data": {
+                "id": system_id,
+                "name": "制品库-benchmark",
+                "name_en": "bkrepo benchmark",
+                "clients": system_id,
+                "provider_config": {
+                    "host": "https://bkrepo.example.com",
+                    "auth": "basic",
+                    "healthz": "/external/bkiam/callback/health",
+                },
+            },
+        }
+    ]
+
+    # every chain_depth resource types make a parent chain
+    chains = []
+    for i in range(resource_type_count):
+        resource_type_id = "resource_%d" % i
+        parent = [] if i % chain_depth == 0 else [{"system_id": system_id, "id": chains[-1][-1]}]
+        if i % chain_depth == 0:
+            chains.append([])
+        chains[-1].append(resource_type_id)
+        operations.append(
+            {
+                "operation": "upsert_resource_type",
+                "data": {
+                    "id": resource_type_id,
+                    "name": "资源%d" % i,
+                    "name_en": "resource %d" % i,
+                    "description": "资源%d" % i,
+                    "description_en": "resource %d" % i,
+                    "parent": parent,
+                    "provider_config": {"path": "/external/bkiam/callback/resource_%d" % i},
+                    "version": 1,
+                },
+            }
+        )
+
+    # one instance selection for every resource type, with the chain from the root
+    for chain in chains:
+        for depth, resource_type_id in enumerate(chain):
+            operations.append(
+                {
+                    "operation": "upsert_instance_selection",
+                    "data": {
+                        "id": "%s_instance" % resource_type_id,
+                        "name": "%s视图" % resource_type_id,
+                        "name_en": "%s instance" % resource_type_id,
+                        "resource_type_chain": [
+                            {"system_id": system_id, "id": chain_id} for chain_id in chain[: depth + 1]
+                        ],
+                    },
+                }
+            )
+
+    action_types = ("view", "create", "edit", "delete", "manage")
+    groups = {}
+    view_actions = {}
+    for i in range(action_count):
+        resource_type_id = "resource_%d" % (i % resource_type_count)
+        action_type = action_types[i % len(action_types)]
+        action_id = "%s_%s_%d" % (resource_type_id, action_type, i)
+        data = {
+            "id": action_id,
+            "name": "操作%d" % i,
+            "name_en": "action %d" % i,
+            "type": action_type,
+            "auth_type": "rbac",
+            "related_resource_types": [
+                {
+                    "system_id": system_id,
+                    "id": resource_type_id,
+                    "related_instance_selections": [
+                        {"system_id": system_id, "id": "%s_instance" % resource_type_id, "ignore_iam_path": True}
+                    ],
+                }
+            ],
+            "version": 1,
+        }
+        # the non view actions depend on the first view action of the resource type
+        if action_type == "view":
+            view_actions.setdefault(resource_type_id, action_id)
+        elif resource_type_id in view_actions:
+            data["related_actions"] = [view_actions[resource_type_id]]
+        operations.append({"operation": "upsert_action", "data": data})
+        groups.setdefault(resource_type_id, []).append(action_id)
+
+    operations.append(
+        {
+            "operation": "upsert_action_groups",
+            "data": [
+                {
+                    "name": "资源组%s" % resource_type_id,
+                    "name_en": "group of %s" % resource_type_id,
+                    "actions": [{"id": action_id} for action_id in action_ids],
+                }
+                for resource_type_id, action_ids in sorted(groups.items())
+            ],
+        }
+    )
+    return {"system_id": system_id, "operations": operations}
+
+
+def write_migration_file(data_dir, action_count, system_id=BENCH_SYSTEM_ID):
+    filename = os.path.join(data_dir, "%04d_bench_%d_actions_iam.json" % (0, action_count))
+    with open(filename, "w") as f:
+        json.dump(gen_migration_data(action_count, system_id=system_id), f, ensure_ascii=False)
+    return filename
+
+
+# =================== benchmark ===================
+
+
+def run_migrate(host, data_list, args):
+    """
+    执行迁移, 与 do_migrate.py 的命令行执行流程一致, 不使用迁移记录及操作日志
+    """
+    metrics = do_migrate.CallMetrics()
+    rate_limiter = do_migrate.RateLimiter(args.rate_limit)
+    retry_policy = do_migrate.RetryPolicy(max_retries=args.max_retries, retry_budget=args.retry_budget)
+    if args.use_async:
+        ok = asyncio.run(
+            do_migrate.async_migrate_files(
+                data_list,
+                host,
+                "bench",
+                "bench",
+                args.concurrency,
+                journal_path=None,
+                retry_policy=retry_policy,
+                metrics=metrics,
+                gzip=args.gzip,
+                rate_limiter=rate_limiter,
+            )
+        )
+    else:
+        client = do_migrate.Client(
+            "bench",
+            "bench",
+            host,
+            retry_policy=retry_policy,
+            metrics=metrics,
+            transport=do_migrate.new_transport(args.transport, max(args.pool_size, args.workers)),
+            batch_chunker=do_migrate.BatchChunker(max_bytes=args.batch_max_bytes),
+            gzip=args.gzip,
+            rate_limiter=rate_limiter,
+            concurrency_limiter=do_migrate.AdaptiveConcurrency(args.workers),
+        )
+        ok = do_migrate.migrate_files(
+            client, data_list, batch_size=args.batch_size, workers=args.workers, journal_path=None
+        )
+    return ok, metrics
+
+
+def latency_percentile(metrics, percent):
+    values = sorted(r["latency_ms"] for r in metrics.records)
+    return do_migrate.CallMetrics._percentile(values, percent) if values else 0
+
+
+def run_scale(action_count, args, data_dir):
+    """
+    对一个规模执行两次迁移: 首次全部新增, 第二次模型无变化
+    """
+    filename = write_migration_file(data_dir, action_count)
+    data_list = [(filename, do_migrate.load_data(filename))]
+    operation_count = len(data_list[0][1]["operations"])
+
+    state = FakeIAMState(
+        latency=args.latency / 1000.0,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+        max_body_bytes=args.max_body_bytes,
+        quota=args.quota,
+    )
+    server = FakeIAMServer(state).start()
+    results = []
+    try:
+        for round_name in ("initial", "unchanged"):
+            state.reset_stats()
+            start = time.time()
+            # the output of every operation is dropped unless --verbose
+            with contextlib.redirect_stdout(sys.stdout if args.verbose else io.StringIO()):
+                ok, metrics = run_migrate(server.host, data_list, args)
+            results.append(
+                {
+                    "actions": action_count,
+                    "operations": operation_count,
+                    "round": round_name,
+                    "ok": ok,
+                    "calls": state.calls,
+                    "errors": state.errors + state.rejected,
+                    "throttled": state.throttled,
+                    "bytes_sent": state.bytes_received,
+                    "bytes_received": state.bytes_sent,
+                    "wall_time": time.time() - start,
+                    "p95_ms": latency_percentile(metrics, 95),
+                }
+            )
+            if not ok:
+                break
+    finally:
+        server.stop()
+    return results
+
+
+def print_results(results):
+    header = "%-8s %-10s %-10s %-4s %8s %7s %9s %12s %12s %10s %10s %9s" % (
+        "actions",
+        "operations",
+        "round",
+        "ok",
+        "calls",
+        "errors",
+        "throttled",
+        "bytes_sent",
+        "bytes_recv",
+        "wall(s)",
+        "ops/s",
+        "p95(ms)",
+    )
+    print("=" * len(header))
+    print(header)
+    for r in results:
+        print(
+            "%-8d %-10d %-10s %-4s %8d %7d %9d %12d %12d %10.3f %10.1f %9.1f"
+            % (
+                r["actions"],
+                r["operations"],
+                r["round"],
+                "yes" if r["ok"] else "no",
+                r["calls"],
+                r["errors"],
+                r["throttled"],
+                r["bytes_sent"],
+                r["bytes_received"],
+                r["wall_time"],
+                r["operations"] / r["wall_time"] if r["wall_time"] else 0,
+                r["p95_ms"],
+            )
+        )
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="benchmark do_migrate.py against an in-process fake iam")
+    p.add_argument(
+        "--scales",
+        action="store",
+        default=",".join(str(scale) for scale in BENCH_SCALES),
+        help="the comma separated numbers of actions of the synthetic migration files, default: %(default)s",
+    )
+    p.add_argument("--latency", action="store", type=float, default=0, help="injected latency(ms) of every call")
+    p.add_argument(
+        "--error-rate", action="store", type=float, default=0, help="the ratio of calls answered with --error-status"
+    )
+    p.add_argument("--error-status", action="store", type=int, default=503, help="the status of the injected errors")
+    p.add_argument(
+        "--max-body-bytes", action="store", type=int, default=0, help="reject the larger request bodies with 413"
+    )
+    p.add_argument(
+        "--quota", action="store", type=int, default=0, help="answer the calls over this per second with 429"
+    )
+    p.add_argument("--seed", action="store", type=int, default=None, help="the random seed of the injected errors")
+    p.add_argument("--verbose", action="store_true", help="print the output of every migrate operation")
+    p.add_argument("--json", action="store", dest="json_path", help="also write the results to this file as json")
+
+    p.add_argument("--async", action="store_true", dest="use_async", help="migrate with the asyncio client")
+    p.add_argument("--concurrency", action="store", type=int, default=do_migrate.DEFAULT_CONCURRENCY)
+    p.add_argument("--batch-size", action="store", type=int, default=do_migrate.DEFAULT_BATCH_SIZE)
+    p.add_argument("--rate-limit", action="store", type=float, default=do_migrate.DEFAULT_RATE_LIMIT)
+    p.add_argument("--batch-max-bytes", action="store", type=int, default=do_migrate.DEFAULT_BATCH_MAX_BYTES)
+    p.add_argument("--gzip", action="store_true", help="compress the request bodies with gzip")
+    p.add_argument("--workers", action="store", type=int, default=do_migrate.DEFAULT_WORKERS)
+    p.add_argument(
+        "--transport",
+        action="store",
+        choices=(do_migrate.HTTPClientTransport.name, do_migrate.RequestsTransport.name),
+        default=do_migrate.DEFAULT_TRANSPORT,
+    )
+    p.add_argument("--pool-size", action="store", type=int, default=do_migrate.DEFAULT_POOL_SIZE)
+    p.add_argument("--max-retries", action="store", type=int, default=do_migrate.DEFAULT_MAX_RETRIES)
+    p.add_argument("--retry-budget", action="store", type=int, default=do_migrate.DEFAULT_RETRY_BUDGET)
+    return p.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    scales = [int(scale) for scale in args.scales.split(",") if scale.strip()]
+
+    data_dir = tempfile.mkdtemp(prefix="bench_migrate_")
+    results = []
+    try:
+        for action_count in scales:
+            print("benchmark [%d actions]" % action_count)
+            results.extend(run_scale(action_count, args, data_dir))
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if not all(r["ok"] for r in results):
+        exit(1)
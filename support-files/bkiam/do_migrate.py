@@ -14,38 +14,182 @@ specific language governing permissions and limitations under the License.
 from __future__ import unicode_literals
 
 import argparse
+import contextlib
+import contextvars
+import glob
+import hashlib
+import importlib.util
 import json
 import os
-
-import requests
+import pickle
+import random
+import re
+import signal
+import tempfile
+import threading
+import time
+import weakref
+from urllib.parse import unquote, urlencode, urlsplit
 
 
 # NOTE: the usage doc https://bk.tencent.com/docs/document/6.0/160/8388
 
 __version__ = "1.0.0"
 
-BK_IAM_HOST = os.getenv("BK_IAM_V3_INNER_HOST", "http://bkiam.service.consul:5001")
-USE_APIGATEWAY = os.getenv("BK_IAM_USE_APIGATEWAY", "false").lower() == "true"
-
-APP_CODE = ""
-APP_SECRET = ""
-data_file = ""
+DEFAULT_BK_IAM_HOST = os.getenv("BK_IAM_V3_INNER_HOST", "http://bkiam.service.consul:5001")
+DEFAULT_USE_APIGATEWAY = os.getenv("BK_IAM_USE_APIGATEWAY", "false").lower() == "true"
+
+# the http transport of the iam api calls: requests if it is installed, or httpclient(the standard library)
+DEFAULT_TRANSPORT = os.getenv("BK_IAM_MIGRATE_TRANSPORT") or (
+    "requests" if importlib.util.find_spec("requests") else "httpclient"
+)
+# the max number of keep-alive connections kept by the http transport of a client
+DEFAULT_POOL_SIZE = 10
+# the max number of items sent in one batch api call, 1 means no batch
+DEFAULT_BATCH_SIZE = 1
+
+# the max serialized size(bytes) of the items sent by one batch api call
+DEFAULT_BATCH_MAX_BYTES = 512 * 1024
+# the items sent by one batch api call start from this number, and adapt to the observed latency
+DEFAULT_BATCH_INITIAL_ITEMS = 20
+# the max items sent by one batch api call if --batch-size is not set, i.e: the prune deletes
+DEFAULT_BATCH_MAX_ITEMS = 1000
+# the batch grows while the latency(seconds) of the batch api calls is below half of this, and shrinks once above it
+DEFAULT_BATCH_TARGET_LATENCY = 2.0
+# the request bodies not smaller than this(bytes) are compressed if gzip is enabled
+GZIP_MIN_BYTES = 1024
+
+# the number of threads used to execute independent operations, 1 means sequential
+DEFAULT_WORKERS = 1
+
+# the max number of in-flight iam api calls of an AsyncClient
+DEFAULT_CONCURRENCY = 10
+
+# the ledger of the applied migration files, should not be named as *.json, or it will be taken as a migration file
+DEFAULT_LEDGER_PATH = os.getenv("BK_IAM_MIGRATE_LEDGER", ".do_migrate.ledger")
+
+# the journal of the completed operations, used to resume the failed migration
+DEFAULT_JOURNAL_PATH = os.getenv("BK_IAM_MIGRATE_JOURNAL", ".do_migrate.journal")
+
+# the readiness of iam is cached in the file for the ttl(seconds), shared by the consecutive invocations
+DEFAULT_READINESS_PATH = os.getenv("BK_IAM_MIGRATE_READINESS", ".do_migrate.ready")
+DEFAULT_READINESS_TTL = 300
+# the max seconds to wait for iam to be ready, and the timeout of each ping
+DEFAULT_READINESS_TIMEOUT = 60
+PING_TIMEOUT = 5
+
+# the timeouts(seconds) of the iam api calls
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+# the idempotent iam api calls will be retried on connection errors, timeouts, 429 and 5xx responses
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+DEFAULT_RETRY_MAX_BACKOFF = 10
+# the total retries of all iam api calls in a migration
+DEFAULT_RETRY_BUDGET = 30
+# the deadline(seconds) of a migration, 0 means no deadline
+DEFAULT_DEADLINE = 0
+
+# the migration files not smaller than this(bytes) will be parsed incrementally, operations are read one by one
+DEFAULT_STREAM_THRESHOLD = 8 * 1024 * 1024
+DEFAULT_STREAM_CHUNK_SIZE = 65536
+
+# the max requests per second of all iam api calls in the process, 0 means no limit, i.e: the quota of the app code
+DEFAULT_RATE_LIMIT = float(os.getenv("BK_IAM_MIGRATE_RATE_LIMIT", "0"))
+# the concurrency of the iam api calls halves on 429/503, and stops until the `Retry-After` passed
+THROTTLED_STATUS_CODES = (429, 503)
+
+# the watch mode: the interval(seconds) to check the migration files, and to query the models again to fix the drift
+DEFAULT_WATCH_INTERVAL = 2
+DEFAULT_RESYNC_INTERVAL = 300
+# wait for the writes of a changed file to complete
+WATCH_DEBOUNCE = 0.2
+
+# the message returned by upsert operations when the model is not changed
+SKIP_MESSAGE = "skip, the model is not changed"
+
+# the config blocks of a system, the same as the keys in the query response
+CONFIG_NAMES = (
+    "action_groups",
+    "resource_creator_actions",
+    "common_actions",
+    "feature_shield_rules",
+    "custom_frontend_settings",
+)
+
+# the kinds of the id sets returned by Client.query_all_models, in the order of the arguments of Client.setup_models
+ID_SET_KINDS = ("system", "resource_type", "action", "instance_selection")
 
 
 # =================== load json ===================
-def enable_use_apigateway():
-    global USE_APIGATEWAY
-    USE_APIGATEWAY = True
+# ${NAME} or ${NAME:-default} in the strings of the migration files
+_PLACEHOLDER_PATTERN = re.compile(r"\$\{(\w+)(?::-([^}]*))?\}")
+_PLACEHOLDER_BYTES_PATTERN = re.compile(rb"\$\{(\w+)(?::-([^}]*))?\}")
+
+
+class Placeholders(object):
+    """
+    迁移文件字符串中的占位符 ${NAME} 或 ${NAME:-默认值}, 加载时替换, 不修改文件
+    取值顺序: 指定的值(--set NAME=VALUE), 环境变量, 默认值; 都没有时保持不变
+    """
+
+    def __init__(self, values=None, environ=None):
+        self.values = dict(values or {})
+        self.environ = os.environ if environ is None else environ
+
+    def value(self, name, default=None):
+        if name in self.values:
+            return self.values[name]
+        return self.environ.get(name, default)
 
+    def _replace(self, match):
+        value = self.value(match.group(1), match.group(2))
+        return match.group(0) if value is None else value
 
-def load_data(filename):
+    def render(self, data):
+        if isinstance(data, str):
+            return _PLACEHOLDER_PATTERN.sub(self._replace, data) if "${" in data else data
+        if isinstance(data, dict):
+            return {k: self.render(v) for k, v in data.items()}
+        if isinstance(data, list):
+            return [self.render(d) for d in data]
+        return data
+
+    def file_hash(self, filename):
+        """
+        文件内容及其中占位符的值的hash, 占位符的值变化后视为文件变化; 没有占位符时与file_hash相同
+        """
+        sha256 = hashlib.sha256()
+        placeholders = set()
+        tail = b""
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                sha256.update(chunk)
+                # keep the tail of the last chunk, the placeholder may be split by the chunks
+                text = tail + chunk
+                placeholders.update(_PLACEHOLDER_BYTES_PATTERN.findall(text))
+                tail = text[-256:]
+        digest = sha256.hexdigest()
+        if not placeholders:
+            return digest
+
+        values = sorted(
+            [name.decode("utf-8"), self.value(name.decode("utf-8"), default.decode("utf-8") or None)]
+            for name, default in placeholders
+        )
+        return hashlib.sha256((digest + json.dumps(values)).encode("utf-8")).hexdigest()
+
+
+def load_data(filename, placeholders=None):
     """
-    解析JSON数据文件
+    解析JSON数据文件, 指定placeholders时替换字符串中的占位符
     """
     data = {}
     try:
         with open(filename) as data_file:
             data = json.load(data_file)
+        if placeholders is not None:
+            data = placeholders.render(data)
         print("parser json data file success!")
     except Exception as error:
         print("parser json data file error: %s" % error)
@@ -53,6 +197,678 @@ def load_data(filename):
     return data
 
 
+class _JSONStreamReader(object):
+    """
+    从文件中逐个解析JSON值, 缓冲区只保留未解析的部分
+    对象及数组先按括号深度找到结束位置再解码, 每个值只解码一次, 读取的内容只扫描一次
+    """
+
+    _whitespace = re.compile(r"\s*")
+    _structure = re.compile(r'[{}\[\]"]')
+    _string_end = re.compile(r'["\\]')
+
+    def __init__(self, f, chunk_size=DEFAULT_STREAM_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        # the scanning state of the pending object or array: the scanned length from pos, depth, in a string or not
+        self._scanned = 0
+        self._depth = 0
+        self._in_string = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        跳过空白, 返回下一个字符, 文件结束时返回空字符串
+        """
+        while True:
+            self.pos = self._whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("expecting one of '%s' but got '%s'" % (chars, char))
+        self.pos += 1
+        return char
+
+    def _container_end(self):
+        """
+        从上次扫描到的位置继续查找pos处的对象或数组的结束位置
+
+        return: the end of the value, None if the value is not complete in the buffer
+        """
+        buffer, pos = self.buffer, self.pos + self._scanned
+        while pos < len(buffer):
+            if self._in_string:
+                match = self._string_end.search(buffer, pos)
+                if match is None:
+                    pos = len(buffer)
+                elif match.group() == "\\":
+                    if match.end() >= len(buffer):
+                        # the escaped char is not read yet
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                else:
+                    self._in_string = False
+                    pos = match.end()
+                continue
+
+            match = self._structure.search(buffer, pos)
+            if match is None:
+                pos = len(buffer)
+                continue
+            pos = match.end()
+            if match.group() == '"':
+                self._in_string = True
+            elif match.group() in "{[":
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return pos
+        self._scanned = pos - self.pos
+        return None
+
+    def value(self):
+        if self.peek() in ("{", "["):
+            self._scanned, self._depth, self._in_string = 0, 0, False
+            while self._container_end() is None:
+                if not self._fill():
+                    raise ValueError("unexpected end of the json data")
+            value, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+            return value
+
+        # the scalars are small, decode again after more data read
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number at the end of the buffer may be not complete
+                if self.eof or (end < len(self.buffer) and self.buffer[end] not in "0123456789.eE+-"):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_json_data(filename, chunk_size=DEFAULT_STREAM_CHUNK_SIZE):
+    """
+    逐个解析迁移文件顶层对象的键值, `operations`数组中的元素逐个返回, 不需要将整个文件加载到内存中
+
+    yield: (key, index, value), index为operations中的序号, 其他键为None
+    """
+    with open(filename) as f:
+        reader = _JSONStreamReader(f, chunk_size)
+        reader.expect("{")
+        end = reader.peek() == "}" and reader.expect("}")
+        while not end:
+            key = reader.value()
+            reader.expect(":")
+            if key == "operations" and reader.peek() == "[":
+                reader.expect("[")
+                index = 0
+                end = reader.peek() == "]" and reader.expect("]")
+                while not end:
+                    yield key, index, reader.value()
+                    index += 1
+                    end = reader.expect(",]") == "]"
+            else:
+                yield key, None, reader.value()
+            end = reader.expect(",}") == "}"
+        if reader.peek():
+            raise ValueError("extra data after the json object")
+
+
+class StreamedOperations(object):
+    """
+    迁移文件中的operations, 解析文件时逐个写入临时文件, 每次遍历时从临时文件中逐个读取, 不再解析JSON
+    顺序执行时内存占用只与批量大小有关; 并发执行需要完整的操作列表来计算依赖层级
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.count = 0
+        fd, self.spool_path = tempfile.mkstemp(prefix=".do_migrate.", suffix=".spool")
+        self.spool = os.fdopen(fd, "wb")
+        # the spool file is removed once the operations are not referenced
+        self._finalizer = weakref.finalize(self, _remove_spool, self.spool, self.spool_path)
+
+    def append(self, operation):
+        pickle.dump(operation, self.spool, pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+    def __iter__(self):
+        self.spool.flush()
+        with open(self.spool_path, "rb") as f:
+            for _ in range(self.count):
+                yield pickle.load(f)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self._finalizer()
+
+
+def _remove_spool(spool, spool_path):
+    spool.close()
+    if os.path.exists(spool_path):
+        os.remove(spool_path)
+
+
+def load_data_stream(filename, placeholders=None):
+    """
+    解析JSON数据文件, 只在内存中保留operations之外的字段, operations在执行时从临时文件中逐个读取
+    文件只解析一次, 之后的统计/校验/执行都遍历解析结果
+    """
+    data = {}
+    operations = StreamedOperations(filename)
+    try:
+        for key, index, value in iter_json_data(filename):
+            value = value if placeholders is None else placeholders.render(value)
+            if index is None:
+                data[key] = value
+            else:
+                operations.append(value)
+        if operations.count or "operations" in data:
+            data["operations"] = operations
+        print("parser json data file success! stream %d operations" % operations.count)
+    except Exception as error:
+        print("parser json data file error: %s" % error)
+        operations.close()
+        data = {}
+    return data
+
+
+def load_migration_data(filename, stream_threshold=DEFAULT_STREAM_THRESHOLD, placeholders=None):
+    """
+    解析迁移文件, 不小于stream_threshold字节的文件使用流式解析, 0表示全部使用流式解析
+    """
+    if stream_threshold is not None and os.path.getsize(filename) >= stream_threshold:
+        return load_data_stream(filename, placeholders)
+    return load_data(filename, placeholders)
+
+
+def list_data_files(json_data_files=None, json_data_dir=None):
+    """
+    获取需要执行的JSON数据文件列表, 目录下的文件按文件名排序
+    """
+    filenames = list(json_data_files or [])
+    if json_data_dir:
+        filenames.extend(
+            sorted(glob.glob(os.path.join(json_data_dir, "*.json")), key=lambda f: os.path.basename(f))
+        )
+    return filenames
+
+
+def _canonical_data(data):
+    """
+    规范化模型数据: 去除空值, 用于比较模型数据是否有变化
+    """
+    if isinstance(data, dict):
+        data = {k: _canonical_data(v) for k, v in data.items()}
+        return {k: v for k, v in data.items() if v not in (None, "", [], {})}
+    if isinstance(data, list):
+        return [_canonical_data(d) for d in data]
+    return data
+
+
+# =================== content hash ===================
+
+
+def content_hash(data):
+    """
+    模型数据的内容hash, 规范化(去除空值)后按key排序序列化, 与key的顺序无关
+    """
+    content = json.dumps(_canonical_data(data), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _group_hash(digests):
+    # the hash of the sorted (id, digest) pairs, changed once any entity of the group changed
+    return content_hash(sorted([str(k), v] for k, v in digests.items()))
+
+
+def build_hash_tree(models, fields=None):
+    """
+    为模型数据建立hash树: 每个模型一个hash, 每类模型及整个系统各一个汇总hash, 汇总hash相同时无需比较其中的模型
+
+    models: {kind: {id: data}}, 配置以system_id为id
+    fields: {kind: {id: [field]}}, 只计算其中的字段, 用于与迁移文件中声明的模型比较
+    return: {"digest": digest, "kinds": {kind: {"digest": digest, "entities": {id: digest}}}}
+    """
+    kinds = {}
+    for kind, entities in models.items():
+        digests = {}
+        for model_id, data in entities.items():
+            entity_fields = (fields or {}).get(kind, {}).get(model_id)
+            if entity_fields is not None and isinstance(data, dict):
+                data = {k: data.get(k) for k in entity_fields}
+            digests[model_id] = content_hash(data)
+        kinds[kind] = {"digest": _group_hash(digests), "entities": digests}
+    return {"digest": _group_hash({k: v["digest"] for k, v in kinds.items()}), "kinds": kinds}
+
+
+def diff_hash_trees(old, new):
+    """
+    比较两棵hash树, 只展开汇总hash不同的模型类型
+
+    return: {kind: [id]}, 新增/删除/变化的模型
+    """
+    changed = {}
+    if old.get("digest") == new.get("digest"):
+        return changed
+
+    old_kinds, new_kinds = old.get("kinds", {}), new.get("kinds", {})
+    for kind in sorted(set(old_kinds) | set(new_kinds)):
+        old_kind, new_kind = old_kinds.get(kind, {}), new_kinds.get(kind, {})
+        if old_kind.get("digest") == new_kind.get("digest"):
+            continue
+        old_entities, new_entities = old_kind.get("entities", {}), new_kind.get("entities", {})
+        ids = [i for i in set(old_entities) | set(new_entities) if old_entities.get(i) != new_entities.get(i)]
+        if ids:
+            changed[kind] = sorted(ids, key=str)
+    return changed
+
+
+# =================== model store ===================
+
+
+class ModelRecord(object):
+    """
+    一个模型的数据及其内容hash
+    """
+
+    __slots__ = ("data", "digests")
+
+    def __init__(self, data):
+        self.data = data
+        # fields => content hash, computed once until the model is saved again
+        self.digests = None
+
+
+class ModelStore(object):
+    """
+    内存中的模型索引: kind => {id => ModelRecord}, 配置以system_id为id; 校验及执行共用同一个按类型的id索引
+    相同的字符串及嵌套结构(如各操作相同的related_resource_types)只保存一份, 模型数据只读, 修改时整体替换
+    """
+
+    __slots__ = ("kinds", "_interned")
+
+    def __init__(self):
+        self.kinds = {}
+        # str => str, and (type, items) => the shared dict/list
+        self._interned = {}
+
+    @staticmethod
+    def _intern_key(value):
+        # the nested values are interned already, the same content is the same object
+        if isinstance(value, (dict, list)):
+            return type(value), id(value)
+        return type(value), value
+
+    def intern(self, data):
+        """
+        返回与data内容相同的共享对象, 不修改data
+        """
+        if isinstance(data, str):
+            return self._interned.setdefault(data, data)
+        if isinstance(data, dict):
+            data = {self.intern(k): self.intern(v) for k, v in data.items()}
+            key = (dict, tuple(sorted((k, self._intern_key(v)) for k, v in data.items())))
+        elif isinstance(data, list):
+            data = [self.intern(d) for d in data]
+            key = (list, tuple(self._intern_key(d) for d in data))
+        else:
+            return data
+        return self._interned.setdefault(key, data)
+
+    def get(self, kind, model_id):
+        record = self.kinds.get(kind, {}).get(model_id)
+        return None if record is None else record.data
+
+    def ids(self, kind):
+        return self.kinds.get(kind, {}).keys()
+
+    def save(self, kind, model_id, data, merge=False):
+        records = self.kinds.setdefault(kind, {})
+        record = records.get(model_id)
+        if merge and record is not None and isinstance(record.data, dict) and isinstance(data, dict):
+            data = dict(record.data, **data)
+        if isinstance(data, dict):
+            # the model itself is unique by id, only the strings and nested structures are shared
+            data = {self.intern(k): self.intern(v) for k, v in data.items()}
+        else:
+            data = self.intern(data)
+        records[model_id] = ModelRecord(data)
+
+    def remove(self, kind, model_id):
+        self.kinds.get(kind, {}).pop(model_id, None)
+
+    def digest(self, kind, model_id, fields=None):
+        record = self.kinds.get(kind, {}).get(model_id)
+        if record is None:
+            return None
+
+        if record.digests is None:
+            record.digests = {}
+        if fields not in record.digests:
+            data = record.data
+            if fields is not None and isinstance(data, dict):
+                data = {k: data.get(k) for k in fields}
+            record.digests[fields] = content_hash(data)
+        return record.digests[fields]
+
+    def as_dict(self):
+        return {kind: {i: r.data for i, r in records.items()} for kind, records in self.kinds.items()}
+
+
+def declared_models(data_list, with_data=True):
+    """
+    所有迁移文件执行后声明的模型, update操作合并到之前的数据中; 校验只需要id, 不保存模型数据
+
+    return: {system_id: ModelStore}
+    """
+    stores = {}
+    for _, data in data_list:
+        system_id = data.get("system_id")
+        for op in data.get("operations") or []:
+            operation, op_data = op.get("operation"), op.get("data")
+            kind = _operation_kind(operation or "")
+            if kind is None or not op_data or op.get("superseded_by"):
+                continue
+            if kind in CONFIG_NAMES:
+                model_id = system_id
+            elif isinstance(op_data, dict) and op_data.get("id"):
+                model_id = op_data.get("id")
+            else:
+                continue
+
+            store = stores.get(system_id)
+            if store is None:
+                store = stores[system_id] = ModelStore()
+            if operation.startswith("delete_"):
+                store.remove(kind, model_id)
+            elif not with_data:
+                store.save(kind, model_id, None)
+            else:
+                store.save(kind, model_id, op_data, merge=operation.startswith("update_"))
+    return stores
+
+
+def declared_ids(declared, system_id, kind):
+    """
+    declared_models的结果中某系统某类型的模型id
+    """
+    store = declared.get(system_id)
+    return () if store is None else store.ids(kind)
+
+
+def declared_fields(models):
+    """
+    声明的模型数据中的字段, 用于只比较查询到的模型中的这些字段
+
+    models: ModelStore
+    return: {kind: {id: [field]}}
+    """
+    return {
+        kind: {model_id: sorted(r.data) for model_id, r in records.items() if isinstance(r.data, dict)}
+        for kind, records in models.kinds.items()
+    }
+
+
+def export_hash_trees(data_list, client=None):
+    """
+    导出迁移文件中声明的模型的hash树; 指定client时同时查询模型, 导出其hash树及与声明不同的模型
+
+    return: {system_id: {"declared": tree, "live": tree, "changed": {kind: [id]}}}
+    """
+    trees = {}
+    for system_id, models in declared_models(data_list).items():
+        declared = build_hash_tree(models.as_dict())
+        trees[system_id] = {"declared": declared}
+        if client is not None:
+            client.load_models(system_id)
+            # only the declared fields of the queried models are hashed, the same as the upsert operations
+            live = client.hash_tree(declared_fields(models))
+            trees[system_id].update(live=live, changed=diff_hash_trees(live, declared))
+    return trees
+
+
+# =================== migration ledger ===================
+
+# the ledger, journal and readiness files may be shared by the migrations running concurrently in the process
+_state_file_thread_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _state_file_lock(path):
+    """
+    锁定状态文件的读写, 线程之间使用线程锁, 进程之间(如migrate_many使用多进程)使用path.lock文件的flock
+    """
+    with _state_file_thread_lock:
+        lock_file = None
+        try:
+            import fcntl
+
+            lock_file = open("%s.lock" % path, "a")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except ImportError:
+            # no flock on the platform, only the threads are serialized
+            pass
+        except OSError as error:
+            print("lock state file [%s] fail, only the threads are serialized: %s" % (path, error))
+        try:
+            yield
+        finally:
+            # the flock is released once the file closed
+            if lock_file is not None:
+                lock_file.close()
+
+
+def _state_tmp_path(path):
+    # the temporary file of each process, the other processes may not respect the lock
+    return "%s.%d.tmp" % (path, os.getpid())
+
+
+def file_hash(filename):
+    """
+    计算文件内容的sha256
+    """
+    sha256 = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class MigrationLedger(object):
+    """
+    已成功执行的迁移文件记录, 按system_id及文件名记录最后一次执行的文件内容hash, 内容未变化的文件无需再次执行
+    文件恢复为之前执行过的内容(如回滚)时与最后一次执行的不同, 会再次执行
+    记录保存在本地文件中, 可同时镜像到另一个位置(如持久化的挂载目录), 加载时合并两者的记录
+    """
+
+    def __init__(self, path=DEFAULT_LEDGER_PATH, mirror_path=None, placeholders=None):
+        self.path = path
+        self.mirror_path = mirror_path
+        # the files rendered with the other values of the placeholders are taken as changed
+        self.placeholders = placeholders
+        # system_id => {filename => {"hash": file hash, "applied_at": timestamp}}
+        self.records = {}
+        self._file_hashes = {}
+
+    @staticmethod
+    def _read(path):
+        if not path or not os.path.exists(path):
+            return {}
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except Exception as error:
+            print("load migration ledger [%s] error, will ignore it: %s" % (path, error))
+            return {}
+
+    @staticmethod
+    def _upgrade(records):
+        """
+        兼容按文件内容hash记录的旧格式: {system_id: {file_hash: {"file", "applied_at"}}}, 只保留每个文件最后一次的记录
+        """
+        upgraded = {}
+        for system_id, applied in records.items():
+            files = upgraded.setdefault(system_id, {})
+            for key, record in applied.items():
+                if "hash" not in record:
+                    key, record = record.get("file"), {"hash": key, "applied_at": record.get("applied_at", 0)}
+                if key not in files or record.get("applied_at", 0) >= files[key].get("applied_at", 0):
+                    files[key] = record
+        return upgraded
+
+    def _merge(self, records):
+        # the later record of a file wins, the records of the other files are kept
+        for system_id, applied in self._upgrade(records).items():
+            files = self.records.setdefault(system_id, {})
+            for name, record in applied.items():
+                if name not in files or record.get("applied_at", 0) > files[name].get("applied_at", 0):
+                    files[name] = record
+
+    def load(self):
+        for path in (self.path, self.mirror_path):
+            self._merge(self._read(path))
+        return self
+
+    def save(self):
+        for path in (self.path, self.mirror_path):
+            if not path:
+                continue
+            with _state_file_lock(path):
+                # keep the records saved by the other systems since loaded
+                self._merge(self._read(path))
+                tmp_path = _state_tmp_path(path)
+                try:
+                    with open(tmp_path, "w") as f:
+                        json.dump(self.records, f, indent=2, sort_keys=True)
+                    os.replace(tmp_path, path)
+                except Exception as error:
+                    print("save migration ledger [%s] error: %s" % (path, error))
+
+    def _file_hash(self, data_file):
+        if data_file not in self._file_hashes:
+            if self.placeholders is None:
+                self._file_hashes[data_file] = file_hash(data_file)
+            else:
+                self._file_hashes[data_file] = self.placeholders.file_hash(data_file)
+        return self._file_hashes[data_file]
+
+    def is_applied(self, data_file, data):
+        record = self.records.get(data.get("system_id"), {}).get(os.path.basename(data_file))
+        return record is not None and record.get("hash") == self._file_hash(data_file)
+
+    def mark_applied(self, data_file, data):
+        self.records.setdefault(data.get("system_id"), {})[os.path.basename(data_file)] = {
+            "hash": self._file_hash(data_file),
+            "applied_at": int(time.time()),
+        }
+        self.save()
+
+
+class OperationJournal(object):
+    """
+    迁移文件中已成功执行的操作记录, 每个操作执行成功后追加一行, 重试时从未完成的操作继续执行
+    记录与文件内容hash绑定, 文件变化后之前的记录失效; 与MigrationLedger一致, 占位符的值变化也视为文件变化
+    """
+
+    def __init__(self, path, data_file, placeholders=None, verbose=True):
+        self.path = path
+        self.file = os.path.basename(data_file)
+        self.file_hash = file_hash(data_file) if placeholders is None else placeholders.file_hash(data_file)
+        # operation index => result message
+        self.completed = {}
+        self._load(verbose)
+
+    def _entries(self):
+        if not os.path.exists(self.path):
+            return []
+
+        entries = []
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    # the last line may be broken if the process was killed while writing
+                    continue
+        return entries
+
+    def _load(self, verbose=True):
+        for entry in self._entries():
+            if entry.get("file") == self.file and entry.get("hash") == self.file_hash:
+                self.completed[entry.get("index")] = entry.get("message")
+        if self.completed and verbose:
+            print("resume migrate [%s], %d operations completed in the last run" % (self.file, len(self.completed)))
+
+    def is_completed(self, index):
+        return index in self.completed
+
+    def record(self, index, operation, message):
+        self.completed[index] = message
+        entry = {"file": self.file, "hash": self.file_hash, "index": index, "operation": operation, "message": message}
+        with _state_file_lock(self.path):
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def clear(self):
+        """
+        迁移文件执行成功后清除该文件的记录
+        """
+        self.completed = {}
+        with _state_file_lock(self.path):
+            entries = [e for e in self._entries() if e.get("file") != self.file]
+            if not entries:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+
+            tmp_path = _state_tmp_path(self.path)
+            with open(tmp_path, "w") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self.path)
+
+
+def completed_operations(journal_path, data_files, placeholders=None):
+    """
+    journal中各迁移文件已完成的操作序号, 优化执行计划时之后的写操作不能合并到已完成的操作中
+
+    return: {data_file: {index}}
+    """
+    if not journal_path:
+        return {}
+    completed = {}
+    for data_file in data_files:
+        indexes = set(OperationJournal(journal_path, data_file, placeholders, verbose=False).completed)
+        if indexes:
+            completed[data_file] = indexes
+    return completed
+
+
 # =================== http request ===================
 
 
@@ -63,98 +879,1114 @@ def _gen_header():
     return headers
 
 
-def _http_request(method, url, headers=None, data=None, timeout=None, verify=False, cert=None, cookies=None):
+class TransportError(Exception):
+    """
+    请求未得到响应: 连接失败, 超时, 连接被断开等
+    """
+
+    def __init__(self, message, timeout=False):
+        super(TransportError, self).__init__(message)
+        self.timeout = timeout
+
+
+def _env_proxy(scheme, netloc):
+    """
+    获取环境变量HTTP_PROXY/HTTPS_PROXY/NO_PROXY中访问netloc使用的代理
+
+    return: the parsed proxy url, None if not proxied
+    """
+    import urllib.request
+
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(netloc):
+        return None
+    return urlsplit(proxy if "://" in proxy else "http://%s" % proxy)
+
+
+def _proxy_headers(proxy):
+    """
+    代理url中有用户名时, 使用basic认证
+    """
+    if not proxy.username:
+        return {}
+    import base64
+
+    credentials = ("%s:%s" % (unquote(proxy.username), unquote(proxy.password or ""))).encode("utf-8")
+    return {"Proxy-Authorization": "Basic %s" % base64.b64encode(credentials).decode("ascii")}
+
+
+def _ssl_context(verify, cert):
+    """
+    与requests一致, verify为True时使用环境变量REQUESTS_CA_BUNDLE/CURL_CA_BUNDLE中的CA证书, 为字符串时使用指定的CA证书
+    cert为客户端证书文件, 或(证书文件, 私钥文件)
+    """
+    import ssl
+
+    if verify is True:
+        verify = os.getenv("REQUESTS_CA_BUNDLE") or os.getenv("CURL_CA_BUNDLE") or True
+    # the default verify paths of openssl include the SSL_CERT_FILE and SSL_CERT_DIR
+    context = ssl.create_default_context(cafile=verify if isinstance(verify, str) else None)
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if cert:
+        context.load_cert_chain(*cert) if isinstance(cert, tuple) else context.load_cert_chain(cert)
+    return context
+
+
+class HTTPClientTransport(object):
+    """
+    基于标准库http.client的传输层, 按host复用keep-alive连接, 不依赖第三方库
+    与requests一致, 使用环境变量HTTP_PROXY/HTTPS_PROXY/NO_PROXY中的代理, REQUESTS_CA_BUNDLE/SSL_CERT_FILE中的CA证书
+    """
+
+    name = "httpclient"
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        # (scheme, netloc) => [idle connections]
+        self._idle_connections = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _new_connection(scheme, netloc, verify, cert, proxy=None):
+        """
+        通过代理访问http时, 连接的proxy_headers不为None, 请求使用完整的url并带上这些请求头;
+        通过代理访问https时, 使用CONNECT建立隧道
+        """
+        import http.client
+
+        proxy_headers = _proxy_headers(proxy) if proxy is not None else {}
+        proxy_netloc = proxy.netloc.rsplit("@", 1)[-1] if proxy is not None else None
+
+        if scheme != "https":
+            if proxy is None:
+                return http.client.HTTPConnection(netloc)
+            connection = http.client.HTTPConnection(proxy_netloc)
+            connection.proxy_headers = proxy_headers
+            return connection
+
+        context = _ssl_context(verify, cert)
+        if proxy is None:
+            return http.client.HTTPSConnection(netloc, context=context)
+        connection = http.client.HTTPSConnection(proxy_netloc, context=context)
+        connection.set_tunnel(netloc, headers=proxy_headers)
+        return connection
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._idle_connections.get(key)
+            return idle.pop() if idle else None
+
+    def _release(self, key, connection):
+        with self._lock:
+            idle = self._idle_connections.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def request(self, method, url, headers=None, body=None, timeout=None, verify=False, cert=None):
+        """
+        timeout: seconds or (connect timeout, read timeout)
+        return: status_code, content, headers(the names are lower case)
+        """
+        import http.client
+
+        parsed = urlsplit(url)
+        key = (parsed.scheme, parsed.netloc)
+        path = (parsed.path or "/") + ("?" + parsed.query if parsed.query else "")
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+        connection = self._acquire(key)
+        while True:
+            reused = connection is not None
+            if not reused:
+                proxy = _env_proxy(parsed.scheme, parsed.netloc)
+                connection = self._new_connection(parsed.scheme, parsed.netloc, verify, cert, proxy)
+            request_path, request_headers = path, headers or {}
+            if getattr(connection, "proxy_headers", None) is not None:
+                request_path = "%s://%s%s" % (parsed.scheme, parsed.netloc, path)
+                request_headers = dict(request_headers, **connection.proxy_headers)
+            try:
+                if connection.sock is None:
+                    connection.timeout = connect_timeout
+                    connection.connect()
+                connection.sock.settimeout(read_timeout)
+                connection.request(method, request_path, body=body, headers=request_headers)
+                resp = connection.getresponse()
+                content = resp.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                connection.close()
+                # the idle connection may have been closed by the server, retry once with a new connection
+                if reused:
+                    connection = None
+                    continue
+                raise TransportError(str(e) or e.__class__.__name__)
+            except (OSError, http.client.HTTPException) as e:
+                import socket
+
+                connection.close()
+                raise TransportError(str(e) or e.__class__.__name__, timeout=isinstance(e, socket.timeout))
+
+            if resp.will_close:
+                connection.close()
+            else:
+                self._release(key, connection)
+            return resp.status, content, {k.lower(): v for k, v in resp.getheaders()}
+
+    def close(self):
+        with self._lock:
+            idle_connections, self._idle_connections = self._idle_connections, {}
+        for connections in idle_connections.values():
+            for connection in connections:
+                connection.close()
+
+
+class RequestsTransport(object):
+    """
+    基于requests的传输层, session带连接池, 复用keep-alive连接
+    """
+
+    name = "requests"
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def request(self, method, url, headers=None, body=None, timeout=None, verify=False, cert=None):
+        import requests
+
+        session = self._get_session()
+        try:
+            resp = session.request(method, url, headers=headers, data=body, timeout=timeout, verify=verify, cert=cert)
+        except requests.exceptions.RequestException as e:
+            raise TransportError(str(e), timeout=isinstance(e, requests.exceptions.Timeout))
+        return resp.status_code, resp.content, {k.lower(): v for k, v in resp.headers.items()}
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+class MemoryTransport(object):
+    """
+    内存中的传输层, 不发送网络请求, 用于测试
+    handler(method, path, data) 返回 (status_code, response json) 或 (status_code, response json, headers),
+    未指定时所有请求都返回成功
+    """
+
+    name = "memory"
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, handler=None):
+        self.handler = handler or (lambda method, path, data: (200, {"code": 0, "message": "ok", "data": {}}))
+        # [(method, path, data)]
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, body=None, timeout=None, verify=False, cert=None):
+        parsed = urlsplit(url)
+        path = (parsed.path or "/") + ("?" + parsed.query if parsed.query else "")
+        data = json.loads(body.decode("utf-8")) if body else None
+        with self._lock:
+            self.requests.append((method, path, data))
+        response = self.handler(method, path, data)
+        headers = {k.lower(): v for k, v in (response[2] if len(response) > 2 else {}).items()}
+        return response[0], json.dumps(response[1]).encode("utf-8"), headers
+
+    def close(self):
+        pass
+
+
+# name => transport class, the networking libraries are imported only when the first request is sent
+TRANSPORTS = {
+    HTTPClientTransport.name: HTTPClientTransport,
+    RequestsTransport.name: RequestsTransport,
+    MemoryTransport.name: MemoryTransport,
+}
+
+
+def new_transport(name=DEFAULT_TRANSPORT, pool_size=DEFAULT_POOL_SIZE):
+    """
+    创建带连接池的传输层, 复用keep-alive连接
+    """
+    if name not in TRANSPORTS:
+        raise ValueError("unknown transport: %s, should be one of %s" % (name, ", ".join(sorted(TRANSPORTS))))
+    return TRANSPORTS[name](pool_size=pool_size)
+
+
+def parse_retry_after(value):
+    """
+    解析Retry-After响应头: 秒数或HTTP日期
+
+    return: seconds, None if invalid
+    """
+    if not value:
+        return None
     try:
-        if method == "GET":
-            resp = requests.get(
-                url=url, headers=headers, params=data, timeout=timeout, verify=verify, cert=cert, cookies=cookies
-            )
-        elif method == "HEAD":
-            resp = requests.head(url=url, headers=headers, verify=verify, cert=cert, cookies=cookies)
-        elif method == "POST":
-            resp = requests.post(
-                url=url, headers=headers, json=data, timeout=timeout, verify=verify, cert=cert, cookies=cookies
-            )
-        elif method == "DELETE":
-            resp = requests.delete(
-                url=url, headers=headers, json=data, timeout=timeout, verify=verify, cert=cert, cookies=cookies
-            )
-        elif method == "PUT":
-            resp = requests.put(
-                url=url, headers=headers, json=data, timeout=timeout, verify=verify, cert=cert, cookies=cookies
-            )
-        else:
-            return False, {"error": "method not supported"}
-    except requests.exceptions.RequestException as e:
-        print("http request error! method: %s, url: %s, data: %s! err=%s", method, url, data, e)
-        return False, {"error": str(e)}
-    else:
-        if resp.status_code != 200:
-            content = resp.content[:100] if resp.content else ""
-            error_msg = (
-                "http request fail! method: %s, url: %s, data: %s, " "response_status_code: %s, response_content: %s"
-            )
-            print(error_msg % (method, url, str(data), resp.status_code, content))
-            return False, {"error": "status_code is %d, not 200" % resp.status_code}
+        return max(0.0, float(value))
+    except ValueError:
+        pass
 
-        return True, resp.json()
+    from email.utils import parsedate_to_datetime
 
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_error(status_code, resp_headers, stats):
+    error = {"error": "status_code is %d, not 200" % status_code, "status_code": status_code}
+    retry_after = parse_retry_after((resp_headers or {}).get("retry-after"))
+    if retry_after is not None:
+        error["retry_after"] = retry_after
+        stats["retry_after"] = retry_after
+    return error
+
+
+def _http_request(
+    method,
+    url,
+    headers=None,
+    data=None,
+    timeout=None,
+    verify=False,
+    cert=None,
+    cookies=None,
+    transport=None,
+    stats=None,
+    compress=False,
+):
+    # the timings(seconds) of json encoding, network and response decoding, and the sizes will be set into stats
+    stats = stats if stats is not None else {}
+    if method not in ("GET", "HEAD", "POST", "PUT", "DELETE"):
+        return False, {"error": "method not supported"}
+
+    start = time.time()
+    body = None
+    headers = dict(headers or {})
+    if method == "GET":
+        if data:
+            url = "%s%s%s" % (url, "&" if "?" in url else "?", urlencode(data))
+    elif method != "HEAD" and data is not None:
+        body = json.dumps(data).encode("utf-8")
+        headers.setdefault("Content-Type", "application/json")
+        if compress and len(body) >= GZIP_MIN_BYTES:
+            import gzip
+
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+    if cookies:
+        headers["Cookie"] = "; ".join("%s=%s" % (k, v) for k, v in cookies.items())
+    stats["encode"] = time.time() - start
+    stats["bytes_sent"] = len(body or b"")
+
+    # without a transport, the request will be sent by a new connection
+    owned_transport = transport is None
+    if owned_transport:
+        transport = new_transport(pool_size=1)
+
+    start = time.time()
+    try:
+        status_code, content, resp_headers = transport.request(
+            method, url, headers=headers, body=body, timeout=timeout, verify=verify, cert=cert
+        )
+    except TransportError as e:
+        stats["network"] = time.time() - start
+        stats["timeout"] = e.timeout
+        print("http request error! method: %s, url: %s, data: %s! err=%s" % (method, url, data, e))
+        return False, {"error": str(e)}
+    finally:
+        if owned_transport:
+            transport.close()
+
+    stats["network"] = time.time() - start
+    stats["status"] = status_code
+    stats["bytes_received"] = len(content or b"")
+    if status_code != 200:
+        error_msg = (
+            "http request fail! method: %s, url: %s, data: %s, " "response_status_code: %s, response_content: %s"
+        )
+        print(error_msg % (method, url, str(data), status_code, (content or b"")[:100]))
+        return False, _http_error(status_code, resp_headers, stats)
 
-def http_get(url, data, headers=None, verify=False, cert=None, timeout=None, cookies=None):
+    start = time.time()
+    try:
+        result = json.loads(content.decode("utf-8"))
+    except ValueError as e:
+        return False, {"error": "invalid json response: %s" % e, "status_code": status_code}
+    stats["decode"] = time.time() - start
+    return True, result
+
+
+def http_get(
+    url,
+    data,
+    headers=None,
+    verify=False,
+    cert=None,
+    timeout=None,
+    cookies=None,
+    transport=None,
+    stats=None,
+    compress=False,
+):
     if not headers:
         headers = _gen_header()
     return _http_request(
-        method="GET", url=url, headers=headers, data=data, verify=verify, cert=cert, timeout=timeout, cookies=cookies
+        method="GET",
+        url=url,
+        headers=headers,
+        data=data,
+        timeout=timeout,
+        verify=verify,
+        cert=cert,
+        cookies=cookies,
+        transport=transport,
+        stats=stats,
+        compress=compress,
     )
 
 
-def http_post(url, data, headers=None, verify=False, cert=None, timeout=None, cookies=None):
+def http_post(
+    url,
+    data,
+    headers=None,
+    verify=False,
+    cert=None,
+    timeout=None,
+    cookies=None,
+    transport=None,
+    stats=None,
+    compress=False,
+):
     if not headers:
         headers = _gen_header()
     return _http_request(
-        method="POST", url=url, headers=headers, data=data, timeout=timeout, verify=verify, cert=cert, cookies=cookies
+        method="POST",
+        url=url,
+        headers=headers,
+        data=data,
+        timeout=timeout,
+        verify=verify,
+        cert=cert,
+        cookies=cookies,
+        transport=transport,
+        stats=stats,
+        compress=compress,
     )
 
 
-def http_put(url, data, headers=None, verify=False, cert=None, timeout=None, cookies=None):
+def http_put(
+    url,
+    data,
+    headers=None,
+    verify=False,
+    cert=None,
+    timeout=None,
+    cookies=None,
+    transport=None,
+    stats=None,
+    compress=False,
+):
     if not headers:
         headers = _gen_header()
     return _http_request(
-        method="PUT", url=url, headers=headers, data=data, timeout=timeout, verify=verify, cert=cert, cookies=cookies
+        method="PUT",
+        url=url,
+        headers=headers,
+        data=data,
+        timeout=timeout,
+        verify=verify,
+        cert=cert,
+        cookies=cookies,
+        transport=transport,
+        stats=stats,
+        compress=compress,
     )
 
 
-def http_delete(url, data, headers=None, verify=False, cert=None, timeout=None, cookies=None):
+def http_delete(
+    url,
+    data,
+    headers=None,
+    verify=False,
+    cert=None,
+    timeout=None,
+    cookies=None,
+    transport=None,
+    stats=None,
+    compress=False,
+):
     if not headers:
         headers = _gen_header()
     return _http_request(
-        method="DELETE", url=url, headers=headers, data=data, timeout=timeout, verify=verify, cert=cert, cookies=cookies
+        method="DELETE",
+        url=url,
+        headers=headers,
+        data=data,
+        timeout=timeout,
+        verify=verify,
+        cert=cert,
+        cookies=cookies,
+        transport=transport,
+        stats=stats,
+        compress=compress,
     )
 
 
+# http method => the function sending the request
+HTTP_FUNCS = {
+    "GET": http_get,
+    "POST": http_post,
+    "PUT": http_put,
+    "DELETE": http_delete,
+}
+
+_MODEL_PATH = "/api/v1/model/systems/{system_id}"
+
+# the iam model apis shared by Client and AsyncClient: name => (http method, path template)
+IAM_APIS = {
+    "add_system": ("POST", "/api/v1/model/systems"),
+    "update_system": ("PUT", _MODEL_PATH),
+    "batch_add_resource_types": ("POST", _MODEL_PATH + "/resource-types"),
+    "update_resource_type": ("PUT", _MODEL_PATH + "/resource-types/{resource_type_id}"),
+    "batch_delete_resource_types": ("DELETE", _MODEL_PATH + "/resource-types?check_existence=false"),
+    "batch_add_instance_selections": ("POST", _MODEL_PATH + "/instance-selections"),
+    "update_instance_selection": ("PUT", _MODEL_PATH + "/instance-selections/{instance_selection_id}"),
+    "batch_delete_instance_selections": ("DELETE", _MODEL_PATH + "/instance-selections?check_existence=false"),
+    "batch_add_actions": ("POST", _MODEL_PATH + "/actions"),
+    "update_action": ("PUT", _MODEL_PATH + "/actions/{action_id}"),
+    "batch_delete_actions": ("DELETE", _MODEL_PATH + "/actions?check_existence=false"),
+    "query": ("GET", _MODEL_PATH + "/query"),
+}
+# the configs of the system: add_action_groups, update_action_groups, ...
+IAM_APIS.update(
+    ("%s_%s" % (prefix, name), (method, "%s/configs/%s" % (_MODEL_PATH, name)))
+    for name in CONFIG_NAMES
+    for prefix, method in (("add", "POST"), ("update", "PUT"))
+)
+
+
+class RetryPolicy(object):
+    """
+    iam接口调用的超时及重试策略
+    幂等请求(GET/PUT/DELETE)在连接错误/超时/429/5xx时按指数退避(带随机抖动)重试,
+    429表示请求未被处理, 非幂等请求也会重试; 响应中有Retry-After时至少等待其指定的时长
+    一次迁移中所有请求共享重试次数预算及截止时间, 保证最坏情况下的执行时长可控
+    """
+
+    idempotent_methods = ("GET", "PUT", "DELETE")
+
+    def __init__(
+        self,
+        connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+        read_timeout=DEFAULT_READ_TIMEOUT,
+        max_retries=DEFAULT_MAX_RETRIES,
+        backoff=DEFAULT_RETRY_BACKOFF,
+        max_backoff=DEFAULT_RETRY_MAX_BACKOFF,
+        retry_budget=DEFAULT_RETRY_BUDGET,
+        deadline=DEFAULT_DEADLINE,
+    ):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_budget = retry_budget
+        self.deadline_at = time.time() + deadline if deadline else None
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        if self.deadline_at is None:
+            return None
+        return self.deadline_at - time.time()
+
+    def timeout(self):
+        """
+        return: (connect_timeout, read_timeout), None if the deadline exceeded
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return self.connect_timeout, self.read_timeout
+        if remaining <= 0:
+            return None
+        return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+    @staticmethod
+    def is_retryable_error(data):
+        status_code = data.get("status_code")
+        # no status code means connection error or timeout
+        return status_code is None or status_code == 429 or status_code >= 500
+
+    def retry_delay(self, method, attempt, ok, data):
+        """
+        return: the seconds to wait before the next retry, None if should not retry
+        """
+        if ok or attempt >= self.max_retries:
+            return None
+        if method not in self.idempotent_methods and data.get("status_code") != 429:
+            return None
+        if not self.is_retryable_error(data):
+            return None
+
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt)) * random.uniform(0.5, 1)
+        delay = max(delay, data.get("retry_after") or 0)
+        remaining = self.remaining()
+        if remaining is not None and delay >= remaining:
+            return None
+
+        with self._lock:
+            if self.retries >= self.retry_budget:
+                print("the retry budget(%d) of the migration is exhausted, will not retry" % self.retry_budget)
+                return None
+            self.retries += 1
+        return delay
+
+
+DEADLINE_EXCEEDED_ERROR = {"error": "the deadline of the migration exceeded"}
+
+
+class RateLimiter(object):
+    """
+    令牌桶限流, 同一进程中的所有请求共享, 使请求速率不超过网关对应用的配额
+    rate为每秒请求数, 0表示不限流; burst为允许的突发请求数, 默认与rate相同
+    """
+
+    def __init__(self, rate=DEFAULT_RATE_LIMIT, burst=None):
+        self.rate = rate
+        self.burst = max(1.0, burst or rate or 1)
+        self.tokens = self.burst
+        self.updated_at = time.time()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        预占一个令牌
+
+        return: the seconds to wait before sending the request
+        """
+        if not self.rate:
+            return 0
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency(object):
+    """
+    AIMD方式控制同时进行中的请求数:
+    - 请求成功后上限增加 1/上限, 即每一轮请求增加1, 不超过max_concurrency
+    - 429/503后上限减半(一秒内最多减半一次), 有Retry-After时所有请求暂停到指定时间之后
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_CONCURRENCY):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.paused_until = 0
+        self._decreased_at = 0
+        self._cond = threading.Condition()
+        # created by the first async_acquire, in the event loop of the AsyncClient
+        self._async_cond = None
+
+    def _wait_time(self):
+        """
+        return: 0 if a request could be sent now, the seconds to wait, or None to wait for a release
+        """
+        now = time.time()
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        return 0
+
+    def _try_acquire(self):
+        """
+        return: 0 if acquired, otherwise the seconds to wait, or None to wait for a release
+        """
+        with self._cond:
+            wait = self._wait_time()
+            if wait == 0:
+                self.in_flight += 1
+            return wait
+
+    async def async_acquire(self):
+        """
+        acquire的asyncio版本, 等待async_release的通知, 暂停时等待到暂停结束
+        """
+        import asyncio
+
+        if self._async_cond is None:
+            self._async_cond = asyncio.Condition()
+        async with self._async_cond:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                try:
+                    await asyncio.wait_for(self._async_cond.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def async_release(self, stats):
+        self.release(stats)
+        if self._async_cond is not None:
+            async with self._async_cond:
+                self._async_cond.notify_all()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                wait = self._wait_time()
+                if wait == 0:
+                    self.in_flight += 1
+                    return
+                self._cond.wait(wait)
+
+    def release(self, stats):
+        """
+        stats: the stats of the request, with the status and the `Retry-After`
+        """
+        status_code = (stats or {}).get("status")
+        retry_after = (stats or {}).get("retry_after")
+        with self._cond:
+            self.in_flight -= 1
+            now = time.time()
+            if status_code in THROTTLED_STATUS_CODES:
+                if now - self._decreased_at >= 1:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._decreased_at = now
+                    print("iam api throttled(%s), the concurrency decreases to %d" % (status_code, int(self.limit)))
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            elif status_code == 200:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+# the stats of the last iam api call in the current thread, used to adapt the batch size
+_last_call_stats = contextvars.ContextVar("last_call_stats", default=None)
+
+
+class BatchChunker(object):
+    """
+    批量接口调用的分片: 按条数及序列化后的字节数拆分, 条数上限根据每次调用的耗时及错误调整
+    - 耗时低于target_latency的一半时条数上限翻倍(不超过max_items), 超过target_latency时减半
+    - 413(请求体过大)或超时后条数上限减半, 413时字节数上限也降低到被拒绝的分片大小的一半
+    """
+
+    def __init__(
+        self,
+        max_bytes=DEFAULT_BATCH_MAX_BYTES,
+        initial_items=DEFAULT_BATCH_INITIAL_ITEMS,
+        target_latency=DEFAULT_BATCH_TARGET_LATENCY,
+        max_items=DEFAULT_BATCH_MAX_ITEMS,
+    ):
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        self.max_items = max(1, max_items)
+        self.limit = min(max(1, initial_items), self.max_items)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_batch_size(cls, batch_size, **kwargs):
+        """
+        分片条数不超过--batch-size, 未开启批量时使用默认的上限
+        """
+        return cls(max_items=batch_size if batch_size > 1 else DEFAULT_BATCH_MAX_ITEMS, **kwargs)
+
+    def next_chunk(self, sizes, start):
+        """
+        sizes: the serialized sizes of the items
+        return: the end of the chunk starting from start, at least one item
+        """
+        end, total = start, 0
+        while end < len(sizes) and end - start < self.limit:
+            if end > start and total + sizes[end] > self.max_bytes:
+                break
+            total += sizes[end]
+            end += 1
+        return end
+
+    def observe(self, ok, stats, size=0):
+        """
+        根据调用结果调整分片上限, size为分片序列化后的字节数
+
+        return: whether the request was rejected as too large, the chunk could be split and sent again
+        """
+        stats = stats or {}
+        with self._lock:
+            if stats.get("status") == 413 and size > 1:
+                self.max_bytes = min(self.max_bytes, size // 2)
+            if stats.get("status") == 413 or stats.get("timeout"):
+                self.limit = max(1, self.limit // 2)
+                return stats.get("status") == 413
+
+            latency = stats.get("network")
+            if ok and latency is not None:
+                if latency > self.target_latency:
+                    self.limit = max(1, self.limit // 2)
+                elif latency < self.target_latency / 2:
+                    self.limit = min(self.limit * 2, self.max_items)
+        return False
+
+
+class ReadinessProbe(object):
+    """
+    等待权限中心可用: 截止时间内按指数退避(带随机抖动)重试ping
+    可用的结果在ttl内有效, 可缓存到状态文件中供连续执行的进程复用; 任一iam接口调用成功也视为可用
+    """
+
+    def __init__(
+        self,
+        bk_iam_host,
+        path=None,
+        ttl=DEFAULT_READINESS_TTL,
+        timeout=DEFAULT_READINESS_TIMEOUT,
+        backoff=DEFAULT_RETRY_BACKOFF,
+        max_backoff=DEFAULT_RETRY_MAX_BACKOFF,
+    ):
+        self.bk_iam_host = bk_iam_host
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # the last time iam was known to be ready
+        self.ready_at = None
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
+    def is_ready(self):
+        if self.ready_at is None:
+            self.ready_at = self._read().get(self.bk_iam_host)
+        return self.ready_at is not None and time.time() - self.ready_at < self.ttl
+
+    def mark_ready(self):
+        now = time.time()
+        # refreshed at most twice in a ttl
+        if self.ready_at is not None and now - self.ready_at < self.ttl / 2:
+            return
+        self.ready_at = now
+        if not self.path:
+            return
+
+        with _state_file_lock(self.path):
+            states = self._read()
+            states[self.bk_iam_host] = now
+            tmp_path = _state_tmp_path(self.path)
+            try:
+                with open(tmp_path, "w") as f:
+                    json.dump(states, f)
+                os.replace(tmp_path, self.path)
+            except Exception as error:
+                print("save iam readiness [%s] error: %s" % (self.path, error))
+
+    def _next_delay(self, attempt, deadline_at, data):
+        """
+        return: the seconds to wait before the next ping, None if the deadline exceeded
+        """
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt)) * random.uniform(0.5, 1)
+        if time.time() + delay >= deadline_at:
+            print("iam service is not ready in %ss: %s" % (self.timeout, data.get("error")))
+            return None
+        print("iam service is not ready, ping again after %.2fs: %s" % (delay, data.get("error")))
+        return delay
+
+    def _ping_timeout(self, deadline_at):
+        return max(0.1, min(PING_TIMEOUT, deadline_at - time.time()))
+
+    def wait(self, ping):
+        """
+        ping: ping(timeout) => (ok, data)
+        return: 截止时间内是否可用
+        """
+        if self.is_ready():
+            return True
+
+        deadline_at = time.time() + self.timeout
+        attempt = 0
+        while True:
+            ok, data = ping(self._ping_timeout(deadline_at))
+            if ok:
+                self.mark_ready()
+                return True
+            delay = self._next_delay(attempt, deadline_at, data)
+            if delay is None:
+                return False
+            time.sleep(delay)
+            attempt += 1
+
+    async def async_wait(self, ping):
+        """
+        wait的asyncio版本, ping为协程函数
+        """
+        import asyncio
+
+        if self.is_ready():
+            return True
+
+        deadline_at = time.time() + self.timeout
+        attempt = 0
+        while True:
+            ok, data = await ping(self._ping_timeout(deadline_at))
+            if ok:
+                self.mark_ready()
+                return True
+            delay = self._next_delay(attempt, deadline_at, data)
+            if delay is None:
+                return False
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+# =================== metrics ===================
+
+# the operation being executed in the current thread or asyncio task, used to group the api calls
+_current_operation = contextvars.ContextVar("current_operation", default=None)
+
+# the ids in the path => the placeholders, i.e: /api/v1/model/systems/{system_id}/actions/{action_id}
+_PATH_TEMPLATE_PATTERNS = (
+    (re.compile(r"^(/api/v1/model/systems)/[^/]+"), r"\1/{system_id}"),
+    (re.compile(r"/resource-types/[^/]+"), "/resource-types/{resource_type_id}"),
+    (re.compile(r"/instance-selections/[^/]+"), "/instance-selections/{instance_selection_id}"),
+    (re.compile(r"/actions/[^/]+"), "/actions/{action_id}"),
+)
+
+
+def path_template(path):
+    path = path.split("?", 1)[0]
+    for pattern, repl in _PATH_TEMPLATE_PATTERNS:
+        path = pattern.sub(repl, path)
+    return path
+
+
+class CallMetrics(object):
+    """
+    记录每次iam接口调用的耗时及数据大小, 结束时按接口及操作类型汇总输出; 可同时输出为NDJSON
+    """
+
+    def __init__(self, ndjson_path=None):
+        self.records = []
+        self._lock = threading.Lock()
+        self._ndjson_file = open(ndjson_path, "a") if ndjson_path else None
+
+    def record(self, method, path, ok, latency, stats):
+        record = {
+            "time": round(time.time(), 3),
+            "method": method,
+            "path": path_template(path),
+            "operation": _current_operation.get(),
+            "ok": ok,
+            "status": stats.get("status"),
+            "bytes_sent": stats.get("bytes_sent", 0),
+            "bytes_received": stats.get("bytes_received", 0),
+            "encode_ms": round(stats.get("encode", 0) * 1000, 3),
+            "network_ms": round(stats.get("network", 0) * 1000, 3),
+            "decode_ms": round(stats.get("decode", 0) * 1000, 3),
+            "latency_ms": round(latency * 1000, 3),
+        }
+        with self._lock:
+            self.records.append(record)
+            if self._ndjson_file:
+                self._ndjson_file.write(json.dumps(record) + "\n")
+                self._ndjson_file.flush()
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+
+    def close(self):
+        if self._ndjson_file:
+            self._ndjson_file.close()
+            self._ndjson_file = None
+
+    @staticmethod
+    def _percentile(sorted_values, percent):
+        index = max(0, int(-(-len(sorted_values) * percent // 100)) - 1)
+        return sorted_values[index]
+
+    def _print_summary(self, title, key_func):
+        groups = {}
+        for record in self.records:
+            groups.setdefault(key_func(record), []).append(record["latency_ms"])
+
+        print("%-80s %6s %9s %9s %9s %9s" % (title, "count", "p50(ms)", "p95(ms)", "p99(ms)", "max(ms)"))
+        for key in sorted(groups, key=lambda k: -sum(groups[k])):
+            values = sorted(groups[key])
+            print(
+                "%-80s %6d %9.1f %9.1f %9.1f %9.1f"
+                % (
+                    key,
+                    len(values),
+                    self._percentile(values, 50),
+                    self._percentile(values, 95),
+                    self._percentile(values, 99),
+                    values[-1],
+                )
+            )
+
+    def summary(self):
+        with self._lock:
+            records = list(self.records)
+        return {
+            "calls": len(records),
+            "failed": len([r for r in records if not r["ok"]]),
+            "bytes_sent": sum(r["bytes_sent"] for r in records),
+            "bytes_received": sum(r["bytes_received"] for r in records),
+            "encode_ms": round(sum(r["encode_ms"] for r in records), 3),
+            "network_ms": round(sum(r["network_ms"] for r in records), 3),
+            "decode_ms": round(sum(r["decode_ms"] for r in records), 3),
+        }
+
+    def print_report(self):
+        if not self.records:
+            return
+
+        print("=" * 30, "iam api performance report", "=" * 30)
+        self._print_summary("endpoint", lambda r: "%s %s" % (r["method"], r["path"]))
+        print("")
+        self._print_summary("operation", lambda r: r["operation"] or "-")
+        print("")
+        print(
+            "total: %(calls)d calls, %(failed)d failed, "
+            "%(bytes_sent)d bytes sent, %(bytes_received)d bytes received; "
+            "json encode %(encode_ms).1fms, network %(network_ms).1fms, json decode %(decode_ms).1fms"
+            % self.summary()
+        )
+
+
 # =================== iam func ===================
 
 
 class Client(object):
-    def __init__(self, app_code, app_secret, bk_iam_host):
+    def __init__(
+        self,
+        app_code,
+        app_secret,
+        bk_iam_host,
+        pool_size=DEFAULT_POOL_SIZE,
+        retry_policy=None,
+        metrics=None,
+        transport=None,
+        batch_chunker=None,
+        gzip=False,
+        rate_limiter=None,
+        concurrency_limiter=None,
+        use_apigateway=DEFAULT_USE_APIGATEWAY,
+        readiness=None,
+    ):
         self.app_code = app_code
         self.app_secret = app_secret
         self.bk_iam_host = bk_iam_host
-        self.system_id_set = set()
-        self.resource_id_set = set()
-        self.action_id_set = set()
-
-    # 调用权限中心方法
-    def _call_iam_api(self, http_func, path, data):
+        self.use_apigateway = use_apigateway
+        self.readiness = readiness or ReadinessProbe(bk_iam_host)
+        # the migration file being executed
+        self.data_file = ""
+        # all iam api calls of the client reuse the pooled keep-alive connections
+        self.transport = transport or new_transport(pool_size=pool_size)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.metrics = metrics or CallMetrics()
+        self.batch_chunker = batch_chunker or BatchChunker()
+        # compress the request bodies, the gateway should accept `Content-Encoding: gzip`
+        self.gzip = gzip
+        # could be shared by the clients in one process, to keep all calls of the app code within the quota
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.concurrency_limiter = concurrency_limiter or AdaptiveConcurrency(pool_size)
+        self._init_models()
+
+    def _init_models(self):
+        # the queried models of the system, also the id index used to resolve the upsert operations
+        self.models = ModelStore()
+        # the system_id which models had been queried, reused by all migration files of the system
+        self.model_system_id = None
+
+    def _gen_iam_headers(self):
         headers = {"X-BK-APP-CODE": self.app_code, "X-BK-APP-SECRET": self.app_secret}
-        if USE_APIGATEWAY:
+        if self.use_apigateway:
             headers = {
                 "X-Bkapi-Authorization": json.dumps({"bk_app_code": self.app_code, "bk_app_secret": self.app_secret}),
             }
+        return headers
+
+    # 调用权限中心方法
+    def _call_iam_api(self, http_func, path, data):
+        headers = self._gen_iam_headers()
 
         url = "{host}{path}".format(host=self.bk_iam_host, path=path)
-        ok, _data = http_func(url, data, headers=headers)
-        # TODO: add debug here
+        method = http_func.__name__[len("http_") :].upper()
+        attempt = 0
+        while True:
+            timeout = self.retry_policy.timeout()
+            if timeout is None:
+                ok, _data = False, DEADLINE_EXCEEDED_ERROR
+                break
+
+            stats = {}
+            self.concurrency_limiter.acquire()
+            try:
+                self.rate_limiter.acquire()
+                start = time.time()
+                ok, _data = http_func(
+                    url,
+                    data,
+                    headers=headers,
+                    timeout=timeout,
+                    transport=self.transport,
+                    stats=stats,
+                    compress=self.gzip,
+                )
+            finally:
+                self.concurrency_limiter.release(stats)
+            self.metrics.record(method, path, ok, time.time() - start, stats)
+            _last_call_stats.set(stats)
+            # a successful call proves iam is ready, no need to ping before the next migration
+            if ok:
+                self.readiness.mark_ready()
+
+            delay = self.retry_policy.retry_delay(method, attempt, ok, _data)
+            if delay is None:
+                break
+            attempt += 1
+            print("_call_iam_api retry(%d) after %.2fs, method: %s, path: %s" % (attempt, delay, method, path))
+            time.sleep(delay)
+        return self._parse_iam_response(http_func.__name__, path, ok, _data)
+
+    @staticmethod
+    def _parse_iam_response(http_func_name, path, ok, _data):
         if not ok:
             message = _data.get("error", "verify from iam server fail")
             print("_call_iam_api fail.", "error:", message)
@@ -164,13 +1996,13 @@ class Client(object):
             message = _data.get("message", "iam api fail")
 
             if not (
-                http_func.__name__ == "http_get"
+                http_func_name == "http_get"
                 and path.startswith("/api/v1/model/systems/")
                 and path.endswith("/query")
                 and message.startswith("not found:system(")
                 and message.endswith(") not exists")
             ):
-                print("_call_iam_api fail.", "method:", http_func.__name__, "path:", path, "error:", message)
+                print("_call_iam_api fail.", "method:", http_func_name, "path:", path, "error:", message)
 
             return False, message, None
 
@@ -197,19 +2029,19 @@ class Client(object):
         "upsert_action": "upsert_action",
         "add_action_groups": "add_action_groups",
         "update_action_groups": "update_action_groups",
-        "upsert_action_groups": "update_action_groups",
+        "upsert_action_groups": "upsert_action_groups",
         "add_resource_creator_actions": "add_resource_creator_actions",
         "update_resource_creator_actions": "update_resource_creator_actions",
-        "upsert_resource_creator_actions": "update_resource_creator_actions",
+        "upsert_resource_creator_actions": "upsert_resource_creator_actions",
         "add_common_actions": "add_common_actions",
         "update_common_actions": "update_common_actions",
-        "upsert_common_actions": "update_common_actions",
+        "upsert_common_actions": "upsert_common_actions",
         "add_feature_shield_rules": "add_feature_shield_rules",
         "update_feature_shield_rules": "update_feature_shield_rules",
-        "upsert_feature_shield_rules": "update_feature_shield_rules",
+        "upsert_feature_shield_rules": "upsert_feature_shield_rules",
         "add_custom_frontend_settings": "add_custom_frontend_settings",
         "update_custom_frontend_settings": "update_custom_frontend_settings",
-        "upsert_custom_frontend_settings": "update_custom_frontend_settings"
+        "upsert_custom_frontend_settings": "upsert_custom_frontend_settings"
     }
 
     """
@@ -228,137 +2060,97 @@ class Client(object):
     - Query
     """
 
-    # ---------- system
-    def api_add_system(self, data):
-        path = "/api/v1/model/systems"
-        ok, message, data = self._call_iam_api(http_post, path, data)
-        # if alreay exists, return true
+    def _call_api(self, name, data=None, **path_args):
+        """
+        调用IAM_APIS中的接口, path_args为路径中的参数
+        """
+        method, path = IAM_APIS[name]
+        return self._call_iam_api(HTTP_FUNCS[method], path.format(**path_args), data)
+
+    def _call_api_ok(self, name, data=None, **path_args):
+        ok, message, _ = self._call_api(name, data, **path_args)
         return ok, message
 
+    # ---------- system
+    def api_add_system(self, data):
+        # if alreay exists, return true
+        return self._call_api_ok("add_system", data)
+
     def api_update_system(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_put, path, data)
-        return ok, message
+        return self._call_api_ok("update_system", data, system_id=system_id)
 
     # ---------- resource_type
 
     def api_batch_add_resource_types(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/resource-types".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_post, path, data)
-        # if alreay exists, return true
-        return ok, message
+        return self._call_api_ok("batch_add_resource_types", data, system_id=system_id)
 
     def api_update_resource_type(self, system_id, resource_type_id, data):
-        path = "/api/v1/model/systems/{system_id}/resource-types/{resource_type_id}".format(
-            system_id=system_id, resource_type_id=resource_type_id
+        return self._call_api_ok(
+            "update_resource_type", data, system_id=system_id, resource_type_id=resource_type_id
         )
-        ok, message, data = self._call_iam_api(http_put, path, data)
-        return ok, message
 
     def api_batch_delete_resource_types(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/resource-types?check_existence=false".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_delete, path, data)
-        return ok, message
+        return self._call_api_ok("batch_delete_resource_types", data, system_id=system_id)
 
     # ---------- instance_selection
 
     def api_batch_add_instance_selections(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/instance-selections".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_post, path, data)
-        # if alreay exists, return true
-        return ok, message
+        return self._call_api_ok("batch_add_instance_selections", data, system_id=system_id)
 
     def api_update_instance_selection(self, system_id, instance_selection_id, data):
-        path = "/api/v1/model/systems/{system_id}/instance-selections/{instance_selection_id}".format(
-            system_id=system_id, instance_selection_id=instance_selection_id
+        return self._call_api_ok(
+            "update_instance_selection", data, system_id=system_id, instance_selection_id=instance_selection_id
         )
-        ok, message, data = self._call_iam_api(http_put, path, data)
-        return ok, message
 
     def api_batch_delete_instance_selections(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/instance-selections?check_existence=false".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_delete, path, data)
-        return ok, message
+        return self._call_api_ok("batch_delete_instance_selections", data, system_id=system_id)
 
     # ---------- action
 
     def api_batch_add_actions(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/actions".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_post, path, data)
-        # if alreay exists, return true
-        return ok, message
+        return self._call_api_ok("batch_add_actions", data, system_id=system_id)
 
     def api_update_action(self, system_id, action_id, data):
-        path = "/api/v1/model/systems/{system_id}/actions/{action_id}".format(system_id=system_id, action_id=action_id)
-        ok, message, data = self._call_iam_api(http_put, path, data)
-        return ok, message
+        return self._call_api_ok("update_action", data, system_id=system_id, action_id=action_id)
 
     def api_batch_delete_actions(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/actions?check_existence=false".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_delete, path, data)
-        return ok, message
+        return self._call_api_ok("batch_delete_actions", data, system_id=system_id)
 
-    # ---------- action_groups
+    # ---------- configs: action_groups, resource_creator_actions, common_actions, ...
     def api_add_action_groups(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/configs/action_groups".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_post, path, data)
-        return ok, message
+        return self._call_api_ok("add_action_groups", data, system_id=system_id)
 
     def api_update_action_groups(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/configs/action_groups".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_put, path, data)
-        return ok, message
+        return self._call_api_ok("update_action_groups", data, system_id=system_id)
 
-    # ---------- resource_creator_actions
     def api_add_resource_creator_actions(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/configs/resource_creator_actions".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_post, path, data)
-        return ok, message
+        return self._call_api_ok("add_resource_creator_actions", data, system_id=system_id)
 
     def api_update_resource_creator_actions(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/configs/resource_creator_actions".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_put, path, data)
-        return ok, message
+        return self._call_api_ok("update_resource_creator_actions", data, system_id=system_id)
 
-    # ---------- common_actions
     def api_add_common_actions(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/configs/common_actions".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_post, path, data)
-        return ok, message
+        return self._call_api_ok("add_common_actions", data, system_id=system_id)
 
     def api_update_common_actions(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/configs/common_actions".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_put, path, data)
-        return ok, message
+        return self._call_api_ok("update_common_actions", data, system_id=system_id)
 
-    # ---------- feature_shield_rules
     def api_add_feature_shield_rules(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/configs/feature_shield_rules".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_post, path, data)
-        return ok, message
+        return self._call_api_ok("add_feature_shield_rules", data, system_id=system_id)
 
     def api_update_feature_shield_rules(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/configs/feature_shield_rules".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_put, path, data)
-        return ok, message
+        return self._call_api_ok("update_feature_shield_rules", data, system_id=system_id)
 
-    # ---------- custom_frontend_settings
     def api_add_custom_frontend_settings(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/configs/custom_frontend_settings".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_post, path, data)
-        return ok, message
+        return self._call_api_ok("add_custom_frontend_settings", data, system_id=system_id)
 
     def api_update_custom_frontend_settings(self, system_id, data):
-        path = "/api/v1/model/systems/{system_id}/configs/custom_frontend_settings".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_put, path, data)
-        return ok, message
+        return self._call_api_ok("update_custom_frontend_settings", data, system_id=system_id)
 
     # ---------- query
 
     def api_query(self, system_id):
-        path = "/api/v1/model/systems/{system_id}/query".format(system_id=system_id)
-        ok, message, data = self._call_iam_api(http_get, path, None)
-        return ok, message, data
+        return self._call_api("query", system_id=system_id)
 
     # =================== operations ===================
 
@@ -370,7 +2162,10 @@ class Client(object):
         if system_id != d_system_id:
             return False, "json[system_id] is not equals the value of `id`"
 
-        return self.api_add_system(data)
+        ok, message = self.api_add_system(data)
+        if ok:
+            self.save_model("system", system_id, data)
+        return ok, message
 
     def update_system(self, system_id, data):
         d_system_id = data.get("id")
@@ -380,7 +2175,10 @@ class Client(object):
         if system_id != d_system_id:
             return False, "json[system_id] is not equals the value of `id`"
 
-        return self.api_update_system(system_id, data)
+        ok, message = self.api_update_system(system_id, data)
+        if ok:
+            self.save_model("system", system_id, data, merge=True)
+        return ok, message
 
     def add_resource_type(self, system_id, data):
         d_resource_type_id = data.get("id")
@@ -388,15 +2186,22 @@ class Client(object):
             return False, "the field `id` required"
 
         d = [data]
-        return self.api_batch_add_resource_types(system_id, d)
+        ok, message = self.api_batch_add_resource_types(system_id, d)
+        if ok:
+            self.save_model("resource_type", d_resource_type_id, data)
+        return ok, message
 
     def update_resource_type(self, system_id, data):
         d_resource_type_id = data.get("id")
         if not d_resource_type_id:
             return False, "the field `id` required"
 
-        data.pop("id")
-        return self.api_update_resource_type(system_id, d_resource_type_id, data)
+        # the operation data is kept as it is, it is reported with the id after the operation executed
+        data = {k: v for k, v in data.items() if k != "id"}
+        ok, message = self.api_update_resource_type(system_id, d_resource_type_id, data)
+        if ok:
+            self.save_model("resource_type", d_resource_type_id, data, merge=True)
+        return ok, message
 
     def delete_resource_type(self, system_id, data):
         d_resource_type_id = data.get("id")
@@ -405,7 +2210,10 @@ class Client(object):
 
         d = [{"id": d_resource_type_id}]
 
-        return self.api_batch_delete_resource_types(system_id, d)
+        ok, message = self.api_batch_delete_resource_types(system_id, d)
+        if ok:
+            self.remove_model("resource_type", d_resource_type_id)
+        return ok, message
 
     def add_instance_selection(self, system_id, data):
         d_instance_selection_id = data.get("id")
@@ -413,15 +2221,22 @@ class Client(object):
             return False, "the field `id` required"
 
         d = [data]
-        return self.api_batch_add_instance_selections(system_id, d)
+        ok, message = self.api_batch_add_instance_selections(system_id, d)
+        if ok:
+            self.save_model("instance_selection", d_instance_selection_id, data)
+        return ok, message
 
     def update_instance_selection(self, system_id, data):
         d_instance_selection_id = data.get("id")
         if not d_instance_selection_id:
             return False, "the field `id` required"
 
-        data.pop("id")
-        return self.api_update_instance_selection(system_id, d_instance_selection_id, data)
+        # the operation data is kept as it is, it is reported with the id after the operation executed
+        data = {k: v for k, v in data.items() if k != "id"}
+        ok, message = self.api_update_instance_selection(system_id, d_instance_selection_id, data)
+        if ok:
+            self.save_model("instance_selection", d_instance_selection_id, data, merge=True)
+        return ok, message
 
     def delete_instance_selection(self, system_id, data):
         d_instance_selection_id = data.get("id")
@@ -430,7 +2245,10 @@ class Client(object):
 
         d = [{"id": d_instance_selection_id}]
 
-        return self.api_batch_delete_instance_selections(system_id, d)
+        ok, message = self.api_batch_delete_instance_selections(system_id, d)
+        if ok:
+            self.remove_model("instance_selection", d_instance_selection_id)
+        return ok, message
 
     def add_action(self, system_id, data):
         d_action_id = data.get("id")
@@ -438,14 +2256,20 @@ class Client(object):
             return False, "the field `id` required"
 
         d = [data]
-        return self.api_batch_add_actions(system_id, d)
+        ok, message = self.api_batch_add_actions(system_id, d)
+        if ok:
+            self.save_model("action", d_action_id, data)
+        return ok, message
 
     def update_action(self, system_id, data):
         d_action_id = data.get("id")
         if not d_action_id:
             return False, "the field `id` required"
 
-        return self.api_update_action(system_id, d_action_id, data)
+        ok, message = self.api_update_action(system_id, d_action_id, data)
+        if ok:
+            self.save_model("action", d_action_id, data, merge=True)
+        return ok, message
 
     def delete_action(self, system_id, data):
         d_action_id = data.get("id")
@@ -454,41 +2278,76 @@ class Client(object):
 
         d = [{"id": d_action_id}]
 
-        return self.api_batch_delete_actions(system_id, d)
+        ok, message = self.api_batch_delete_actions(system_id, d)
+        if ok:
+            self.remove_model("action", d_action_id)
+        return ok, message
 
     def add_action_groups(self, system_id, data):
-        return self.api_add_action_groups(system_id, data)
+        ok, message = self.api_add_action_groups(system_id, data)
+        if ok:
+            self.save_model("action_groups", system_id, data)
+        return ok, message
 
     def update_action_groups(self, system_id, data):
-        return self.api_update_action_groups(system_id, data)
+        ok, message = self.api_update_action_groups(system_id, data)
+        if ok:
+            self.save_model("action_groups", system_id, data)
+        return ok, message
 
     def add_common_actions(self, system_id, data):
-        return self.api_add_common_actions(system_id, data)
+        ok, message = self.api_add_common_actions(system_id, data)
+        if ok:
+            self.save_model("common_actions", system_id, data)
+        return ok, message
 
     def update_common_actions(self, system_id, data):
-        return self.api_update_common_actions(system_id, data)
+        ok, message = self.api_update_common_actions(system_id, data)
+        if ok:
+            self.save_model("common_actions", system_id, data)
+        return ok, message
 
     def add_resource_creator_actions(self, system_id, data):
-        return self.api_add_resource_creator_actions(system_id, data)
+        ok, message = self.api_add_resource_creator_actions(system_id, data)
+        if ok:
+            self.save_model("resource_creator_actions", system_id, data)
+        return ok, message
 
     def update_resource_creator_actions(self, system_id, data):
-        return self.api_update_resource_creator_actions(system_id, data)
+        ok, message = self.api_update_resource_creator_actions(system_id, data)
+        if ok:
+            self.save_model("resource_creator_actions", system_id, data)
+        return ok, message
 
     def add_feature_shield_rules(self, system_id, data):
-        return self.api_add_feature_shield_rules(system_id, data)
+        ok, message = self.api_add_feature_shield_rules(system_id, data)
+        if ok:
+            self.save_model("feature_shield_rules", system_id, data)
+        return ok, message
 
     def update_feature_shield_rules(self, system_id, data):
-        return self.api_update_feature_shield_rules(system_id, data)
+        ok, message = self.api_update_feature_shield_rules(system_id, data)
+        if ok:
+            self.save_model("feature_shield_rules", system_id, data)
+        return ok, message
 
     def add_custom_frontend_settings(self, system_id, data):
-        return self.api_add_custom_frontend_settings(system_id, data)
+        ok, message = self.api_add_custom_frontend_settings(system_id, data)
+        if ok:
+            self.save_model("custom_frontend_settings", system_id, data)
+        return ok, message
 
     def update_custom_frontend_settings(self, system_id, data):
-        return self.api_update_custom_frontend_settings(system_id, data)
+        ok, message = self.api_update_custom_frontend_settings(system_id, data)
+        if ok:
+            self.save_model("custom_frontend_settings", system_id, data)
+        return ok, message
 
     def upsert_system(self, system_id, data):
-        if system_id not in self.system_id_set:
+        if system_id not in self.models.ids("system"):
             return self.add_system(system_id, data)
+        if self.is_model_unchanged("system", system_id, data):
+            return True, SKIP_MESSAGE
         return self.update_system(system_id, data)
 
     def upsert_resource_type(self, system_id, data):
@@ -496,8 +2355,10 @@ class Client(object):
         if not d_resource_type_id:
             return False, "the field `id` required"
 
-        if d_resource_type_id not in self.resource_id_set:
+        if d_resource_type_id not in self.models.ids("resource_type"):
             return self.add_resource_type(system_id, data)
+        if self.is_model_unchanged("resource_type", d_resource_type_id, data):
+            return True, SKIP_MESSAGE
         return self.update_resource_type(system_id, data)
 
     def upsert_instance_selection(self, system_id, data):
@@ -505,8 +2366,10 @@ class Client(object):
         if not d_instance_selection_id:
             return False, "the field `id` required"
 
-        if d_instance_selection_id not in self.instance_selection_id_set:
+        if d_instance_selection_id not in self.models.ids("instance_selection"):
             return self.add_instance_selection(system_id, data)
+        if self.is_model_unchanged("instance_selection", d_instance_selection_id, data):
+            return True, SKIP_MESSAGE
         return self.update_instance_selection(system_id, data)
 
     def upsert_action(self, system_id, data):
@@ -514,15 +2377,50 @@ class Client(object):
         if not d_action_id:
             return False, "the field `id` required"
 
-        if d_action_id not in self.action_id_set:
+        if d_action_id not in self.models.ids("action"):
             return self.add_action(system_id, data)
+        if self.is_model_unchanged("action", d_action_id, data):
+            return True, SKIP_MESSAGE
         return self.update_action(system_id, data)
 
+    def upsert_action_groups(self, system_id, data):
+        if self.is_model_unchanged("action_groups", system_id, data):
+            return True, SKIP_MESSAGE
+        return self.update_action_groups(system_id, data)
+
+    def upsert_resource_creator_actions(self, system_id, data):
+        if self.is_model_unchanged("resource_creator_actions", system_id, data):
+            return True, SKIP_MESSAGE
+        return self.update_resource_creator_actions(system_id, data)
+
+    def upsert_common_actions(self, system_id, data):
+        if self.is_model_unchanged("common_actions", system_id, data):
+            return True, SKIP_MESSAGE
+        return self.update_common_actions(system_id, data)
+
+    def upsert_feature_shield_rules(self, system_id, data):
+        if self.is_model_unchanged("feature_shield_rules", system_id, data):
+            return True, SKIP_MESSAGE
+        return self.update_feature_shield_rules(system_id, data)
+
+    def upsert_custom_frontend_settings(self, system_id, data):
+        if self.is_model_unchanged("custom_frontend_settings", system_id, data):
+            return True, SKIP_MESSAGE
+        return self.update_custom_frontend_settings(system_id, data)
+
     def query_all_models(self, system_id):
+        """
+        查询系统的所有模型并保存到self.models
+
+        return: (system_ids, resource_type_ids, action_ids, instance_selection_ids), 可传给setup_models
+        """
         ok, message, data = self.api_query(system_id)
+        return self._parse_query_result(system_id, ok, message, data)
+
+    def _parse_query_result(self, system_id, ok, message, data):
         if not ok:
             # ignore the first migration do_migrate fail
-            if "0001_" in data_file:
+            if "0001_" in self.data_file:
                 pass
             else:
                 print(
@@ -530,44 +2428,511 @@ class Client(object):
                     "because the system is not registered yet] do api_query fail",
                     message,
                 )
-            return set(), set(), set(), set()
+            self.models = ModelStore()
+            return self.model_id_sets()
 
         system = data.get("base_info", {}) or {}
         resource_types = data.get("resource_types", []) or []
         actions = data.get("actions", []) or []
         instance_selections = data.get("instance_selections", []) or []
 
-        system_ids = {system.get("id")}
-        resource_type_ids = {r.get("id") for r in resource_types}
-        action_ids = {a.get("id") for a in actions}
-        instance_selection_ids = {r.get("id") for r in instance_selections}
-
-        return system_ids, resource_type_ids, action_ids, instance_selection_ids
+        # keep the full queried models, used to skip the upsert operations which not change anything
+        models = ModelStore()
+        models.save("system", system.get("id"), system)
+        for kind, entities in (
+            ("resource_type", resource_types),
+            ("instance_selection", instance_selections),
+            ("action", actions),
+        ):
+            models.kinds.setdefault(kind, {})
+            for entity in entities:
+                models.save(kind, entity.get("id"), entity)
+        for name in CONFIG_NAMES:
+            if data.get(name):
+                models.save(name, system_id, data.get(name))
+
+        self.models = models
+        return self.model_id_sets()
 
     def do_operation(self, op, system_id, data):
         if op not in self.operation_funcs:
             print("invalid operation: %s" % op)
             exit(1)
 
-        return getattr(self, self.operation_funcs[op])(system_id, data)
+        token = _current_operation.set(op)
+        try:
+            return getattr(self, self.operation_funcs[op])(system_id, data)
+        finally:
+            _current_operation.reset(token)
+
+    # operations which could be merged into one batch api call: operation => batch api
+    batch_operation_funcs = {
+        "add_resource_type": "api_batch_add_resource_types",
+        "delete_resource_type": "api_batch_delete_resource_types",
+        "add_instance_selection": "api_batch_add_instance_selections",
+        "delete_instance_selection": "api_batch_delete_instance_selections",
+        "add_action": "api_batch_add_actions",
+        "delete_action": "api_batch_delete_actions",
+    }
+
+    # the upsert operations of these kinds are resolved to add or update by the model id index
+    upsert_model_kinds = ("resource_type", "instance_selection", "action")
+
+    def resolve_operation(self, op, data):
+        """
+        upsert操作根据当前已有的模型数据转换为add或update操作
+        """
+        kind = op.replace("upsert_", "", 1)
+        if not op.startswith("upsert_") or kind not in self.upsert_model_kinds:
+            return op
+        if not isinstance(data, dict) or not data.get("id"):
+            return op
+
+        if data.get("id") in self.models.ids(kind):
+            return op.replace("upsert_", "update_", 1)
+        return op.replace("upsert_", "add_", 1)
+
+    def do_batch_operation(self, op, system_id, data_list):
+        """
+        将多个同类型的add/delete操作合并为批量接口调用, 由batch_chunker按条数及字节数拆分为多次调用
+        请求体过大被拒绝时拆分后重新发送; delete超时后也拆分后重新发送, add可能已执行, 不重新发送
+        """
+        api_func = self.batch_operation_funcs[op]
+        data_list, sizes = self._batch_data(op, data_list)
+
+        ok, message = True, "ok"
+        start = 0
+        while start < len(data_list):
+            end = self.batch_chunker.next_chunk(sizes, start)
+            chunk = data_list[start:end]
+
+            _last_call_stats.set(None)
+            token = _current_operation.set("batch_%s" % op)
+            try:
+                ok, message = getattr(self, api_func)(system_id, chunk)
+            finally:
+                _current_operation.reset(token)
+
+            if self._observe_batch(op, ok, message, chunk, sum(sizes[start:end])):
+                continue
+            if not ok:
+                return ok, message
+
+            self._save_batch_models(op, chunk)
+            start = end
+        return ok, message
+
+    @staticmethod
+    def _batch_data(op, data_list):
+        """
+        return: (data_list, the serialized sizes of the items)
+        """
+        if op.startswith("delete_"):
+            data_list = [{"id": d.get("id")} for d in data_list]
+        return data_list, [len(json.dumps(d)) for d in data_list]
+
+    def _observe_batch(self, op, ok, message, chunk, size):
+        """
+        根据分片调用的结果调整batch_chunker
+
+        return: whether the failed chunk should be split and sent again
+        """
+        stats = _last_call_stats.get()
+        rejected = self.batch_chunker.observe(ok, stats, size)
+        if ok:
+            return False
+        resend = rejected or (op.startswith("delete_") and (stats or {}).get("timeout"))
+        if resend and len(chunk) > 1:
+            print("batch operation [%s] split into smaller chunks: %s" % (op, message))
+            return True
+        return False
+
+    def _save_batch_models(self, op, data_list):
+        kind = op.split("_", 1)[1]
+        for d in data_list:
+            if op.startswith("add_"):
+                self.save_model(kind, d.get("id"), d)
+            else:
+                self.remove_model(kind, d.get("id"))
+
+    def model_ids(self, kind):
+        return self.models.ids(kind)
+
+    # ---------- the id sets before ModelStore, kept for the callers of setup_models
+
+    def model_id_sets(self):
+        return tuple(set(self.models.ids(kind)) for kind in ID_SET_KINDS)
 
     def setup_models(self, system_id_set, resource_id_set, action_id_set, instance_selection_id_set):
-        self.system_id_set = system_id_set
-        self.resource_id_set = resource_id_set
-        self.action_id_set = action_id_set
-        self.instance_selection_id_set = instance_selection_id_set
+        """
+        按各类型的id集合设置已存在的模型: 集合外的模型删除, 已有的模型数据保留, 新增的模型没有数据(不会跳过更新)
+        """
+        id_sets = (system_id_set, resource_id_set, action_id_set, instance_selection_id_set)
+        for kind, id_set in zip(ID_SET_KINDS, id_sets):
+            id_set = set(id_set)
+            for model_id in set(self.models.ids(kind)) - id_set:
+                self.models.remove(kind, model_id)
+            for model_id in id_set - set(self.models.ids(kind)):
+                self.models.save(kind, model_id, None)
+
+    @property
+    def system_id_set(self):
+        return self.models.ids("system")
+
+    @property
+    def resource_id_set(self):
+        return self.models.ids("resource_type")
+
+    @property
+    def action_id_set(self):
+        return self.models.ids("action")
+
+    @property
+    def instance_selection_id_set(self):
+        return self.models.ids("instance_selection")
+
+    def save_model(self, kind, model_id, data, merge=False):
+        self.models.save(kind, model_id, data, merge=merge)
+
+    def remove_model(self, kind, model_id):
+        self.models.remove(kind, model_id)
+
+    def model_digest(self, kind, model_id, fields=None):
+        """
+        模型数据的内容hash, 只计算fields中的字段; 每个模型只计算一次, 模型数据变化后重新计算
+        """
+        return self.models.digest(kind, model_id, fields)
+
+    def is_model_unchanged(self, kind, model_id, data):
+        """
+        比较迁移数据与已有模型数据的内容hash, 只比较迁移数据中包含的字段
+        """
+        fields = tuple(sorted(data)) if isinstance(data, dict) else None
+        digest = self.model_digest(kind, model_id, fields)
+        return digest is not None and digest == content_hash(data)
+
+    def hash_tree(self, fields=None):
+        return build_hash_tree(self.models.as_dict(), fields)
+
+    def load_models(self, system_id):
+        """
+        查询系统的所有模型数据, 同一个系统只查询一次, 之后由client在内存中维护
+        """
+        if self.model_system_id == system_id:
+            return
+
+        self.query_all_models(system_id)
+        self.model_system_id = system_id
+
+    def wait_ready(self):
+        """
+        等待权限中心可用, 已确认可用时不再ping
+        """
+        return self.readiness.wait(
+            lambda timeout: api_ping(self.bk_iam_host, transport=self.transport, timeout=timeout)
+        )
 
 
 # ---------- ping
 
 
-def api_ping(bk_iam_host):
+def api_ping(bk_iam_host, transport=None, timeout=PING_TIMEOUT):
     url = "{host}{path}".format(host=bk_iam_host, path="/ping")
-    ok, data = http_get(url, None, timeout=5)
+    ok, data = http_get(url, None, timeout=timeout, transport=transport)
     return ok, data
 
 
-def do_migrate(data, bk_iam_host=BK_IAM_HOST, app_code=APP_CODE, app_secret=APP_SECRET):
+# =================== parallel executor ===================
+
+# the execution order of operation kinds, an operation waits for the earlier operations of lower ranks
+OPERATION_KIND_RANKS = {
+    "system": 0,
+    "resource_type": 1,
+    "instance_selection": 2,
+    "action": 3,
+}
+CONFIG_KIND_RANK = 4
+
+
+def _operation_kind(operation):
+    """
+    获取操作的模型类型, 如 upsert_action => action
+    """
+    kind = operation.split("_", 1)[1] if "_" in operation else operation
+    if kind in OPERATION_KIND_RANKS or kind in CONFIG_NAMES:
+        return kind
+    return None
+
+
+def _iter_action_refs(data, field=""):
+    # action_groups/common_actions/resource_creator_actions: {"actions": [{"id": action_id}], ...}
+    if isinstance(data, dict):
+        for key, value in data.items():
+            sub_field = "%s.%s" % (field, key) if field else key
+            if key == "actions" and isinstance(value, list):
+                for a in value:
+                    if isinstance(a, dict):
+                        yield sub_field, None, "action", a.get("id")
+            else:
+                for ref in _iter_action_refs(value, sub_field):
+                    yield ref
+    elif isinstance(data, list):
+        for i, d in enumerate(data):
+            for ref in _iter_action_refs(d, "%s[%d]" % (field, i)):
+                yield ref
+
+
+def _iter_resource_type_refs(data, field):
+    # resource_creator_actions: [{"id": resource_type_id, "actions": [...], "sub_resource_types": [...]}]
+    if isinstance(data, dict):
+        if data.get("id"):
+            yield field, None, "resource_type", data.get("id")
+        for i, d in enumerate(data.get("sub_resource_types") or []):
+            for ref in _iter_resource_type_refs(d, "%s.sub_resource_types[%d]" % (field, i)):
+                yield ref
+    elif isinstance(data, list):
+        for i, d in enumerate(data):
+            for ref in _iter_resource_type_refs(d, "%s[%d]" % (field, i)):
+                yield ref
+
+
+def iter_operation_refs(kind, data):
+    """
+    遍历操作数据引用的其他模型
+
+    yield: (field, system_id, kind, id), system_id is None if the reference is in the same system
+    """
+    if not isinstance(data, (dict, list)):
+        return
+
+    if kind == "resource_type":
+        for r in data.get("parent") or []:
+            yield "parent", r.get("system_id"), "resource_type", r.get("id")
+    elif kind == "instance_selection":
+        for r in data.get("resource_type_chain") or []:
+            yield "resource_type_chain", r.get("system_id"), "resource_type", r.get("id")
+    elif kind == "action":
+        for r in data.get("related_resource_types") or []:
+            yield "related_resource_types", r.get("system_id"), "resource_type", r.get("id")
+            for i in r.get("related_instance_selections") or []:
+                yield "related_instance_selections", i.get("system_id"), "instance_selection", i.get("id")
+        for a in data.get("related_actions") or []:
+            yield "related_actions", None, "action", a
+    elif kind == "resource_creator_actions":
+        config = data.get("config") if isinstance(data, dict) else data
+        for ref in _iter_resource_type_refs(config, "config"):
+            yield ref
+        for ref in _iter_action_refs(data):
+            yield ref
+    elif kind in CONFIG_NAMES:
+        for ref in _iter_action_refs(data):
+            yield ref
+
+
+def operation_refs(kind, data):
+    """
+    获取操作数据引用的其他模型: {(kind, id)}
+    """
+    return {(ref_kind, ref_id) for _, _, ref_kind, ref_id in iter_operation_refs(kind, data)}
+
+
+def plan_operation_levels(operations):
+    """
+    根据操作之间的依赖关系计算每个操作的执行层级, 同一层级的操作之间没有依赖, 可以并发执行
+    依赖关系:
+    - 同一个模型的操作按顺序执行
+    - 操作需要等待之前的更低rank的操作, 顺序为 system, resource_type, instance_selection, action, configs
+    - 操作需要等待之前的被其引用的模型的操作, 以及之前的引用了该模型的操作
+    - system操作及未知的操作作为屏障, 与前后所有操作都按顺序执行
+
+    operations: [(operation, data)]
+    return: the level of each operation
+    """
+    levels = []
+    # the max level of the operations of each model, and of the operations referencing each model
+    model_levels = {}
+    referrer_levels = {}
+    rank_levels = {}
+    max_level = -1
+    # all operations after a barrier should wait for it
+    floor = 0
+
+    for operation, data in operations:
+        kind = _operation_kind(operation)
+        if kind is None or kind == "system" or (kind in OPERATION_KIND_RANKS and not data.get("id")):
+            level = max_level + 1
+            floor = level + 1
+            levels.append(level)
+            max_level = level
+            continue
+
+        rank = OPERATION_KIND_RANKS.get(kind, CONFIG_KIND_RANK)
+        key = (kind, data.get("id")) if kind in OPERATION_KIND_RANKS else (kind, None)
+        refs = operation_refs(kind, data)
+
+        level = floor
+        level = max([level] + [lv + 1 for r, lv in rank_levels.items() if r < rank])
+        level = max(level, model_levels.get(key, -1) + 1, referrer_levels.get(key, -1) + 1)
+        level = max([level] + [model_levels.get(ref, -1) + 1 for ref in refs])
+
+        levels.append(level)
+        model_levels[key] = level
+        for ref in refs:
+            referrer_levels[ref] = max(referrer_levels.get(ref, -1), level)
+        rank_levels[rank] = max(rank_levels.get(rank, -1), level)
+        max_level = max(max_level, level)
+
+    return levels
+
+
+def group_operation_levels(levels):
+    """
+    return: [[operation index]], the operations grouped by level in order
+    """
+    level_indexes = {}
+    for index, level in enumerate(levels):
+        level_indexes.setdefault(level, []).append(index)
+    return [level_indexes[level] for level in sorted(level_indexes)]
+
+
+def report_operation_result(operation, data, ok, message):
+    op_data_id = "id=%s" % data.get("id") if isinstance(data, dict) else ""
+    if not ok:
+        print("execute operation [%s] %s fail, error message: %s" % (operation, message, op_data_id))
+    elif message == SKIP_MESSAGE:
+        print("execute operation [%s] %s %s" % (operation, op_data_id, SKIP_MESSAGE))
+    else:
+        print("execute operation [%s] %s success!" % (operation, op_data_id))
+
+
+def report_batch_result(batch_operation, data_list, ok, message):
+    op_data_ids = "id=%s" % ",".join(d.get("id") for d in data_list)
+    if not ok:
+        print("execute batch operation [%s] %s fail, error message: %s" % (batch_operation, message, op_data_ids))
+    else:
+        print("execute batch operation [%s] %s success!" % (batch_operation, op_data_ids))
+
+
+def group_batch_operations(client, operations, indexes, batch_size):
+    """
+    同一层级的操作之间没有依赖, 其中解析为同类型add/delete的操作合并为批量调用, 每组最多batch_size个
+
+    operations: [(index, operation, data)]
+    return: [(batch_operation, [index])], batch_operation为None时为单个操作
+    """
+    tasks = []
+    batches = {}
+    for index in indexes:
+        _, operation, data = operations[index]
+        batch_operation = client.resolve_operation(operation, data) if batch_size > 1 else None
+        if batch_operation not in client.batch_operation_funcs or not isinstance(data, dict) or not data.get("id"):
+            tasks.append((None, [index]))
+            continue
+        batch = batches.get(batch_operation)
+        if batch is None or len(batch) >= batch_size:
+            batch = batches[batch_operation] = []
+            tasks.append((batch_operation, batch))
+        batch.append(index)
+    return tasks
+
+
+def prepare_operations(client, operations, journal=None):
+    """
+    检查操作数据, 无效操作之后的操作都不会被执行, 与顺序执行保持一致
+    journal中记录已完成的操作将被跳过
+
+    return: [(index, operation, data)], error_message
+    """
+    valid_operations = []
+    for index, op in enumerate(operations):
+        operation = op.get("operation")
+        if not operation:
+            print("there got a empty `operation` in the json, will ignore and continue")
+            continue
+        if journal and journal.is_completed(index):
+            print("skip operation [%s] #%d, it has been completed in the last run" % (operation, index))
+            continue
+        # merged into another operation by the plan optimizer
+        if op.get("superseded_by"):
+            print("skip operation [%s] #%d, superseded by %s" % (operation, index, op.get("superseded_by")))
+            continue
+
+        data = op.get("data")
+        if not data:
+            return valid_operations, "no `data` in the json body or the `data` is empty, operation=%s" % operation
+        if operation not in client.operation_funcs:
+            return valid_operations, "invalid operation: %s" % operation
+        valid_operations.append((index, operation, data))
+    return valid_operations, None
+
+
+def execute_operations_parallel(
+    client, system_id, operations, workers=DEFAULT_WORKERS, journal=None, batch_size=DEFAULT_BATCH_SIZE
+):
+    """
+    按依赖层级并发执行操作, 某一层级有操作失败时不再执行之后的层级
+    执行结果按操作顺序输出, 未开启批量时输出与顺序执行一致
+    batch_size > 1 时同一层级中同类型的add/delete操作合并为批量调用, 见group_batch_operations
+
+    operations: [(index, operation, data)]
+    return: ok
+    """
+    level_indexes = group_operation_levels(plan_operation_levels([(o, d) for _, o, d in operations]))
+
+    def execute(batch_operation, indexes):
+        try:
+            if batch_operation:
+                data_list = [operations[index][2] for index in indexes]
+                return client.do_batch_operation(batch_operation, system_id, data_list)
+            _, operation, data = operations[indexes[0]]
+            return client.do_operation(operation, system_id, data)
+        except Exception as e:
+            return False, "execute operation raise exception: %s" % e
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for indexes in level_indexes:
+            # resolved after the earlier levels completed, the models added by them are known
+            tasks = group_batch_operations(client, operations, indexes, batch_size)
+            futures = [pool.submit(execute, batch_operation, task_indexes) for batch_operation, task_indexes in tasks]
+
+            failed = False
+            for (batch_operation, task_indexes), future in zip(tasks, futures):
+                # fail fast, the operations not started yet will not be executed
+                if failed and future.cancel():
+                    continue
+
+                ok, message = future.result()
+                if batch_operation:
+                    report_batch_result(batch_operation, [operations[i][2] for i in task_indexes], ok, message)
+                else:
+                    report_operation_result(operations[task_indexes[0]][1], operations[task_indexes[0]][2], ok, message)
+                if ok and journal:
+                    for index in task_indexes:
+                        op_index, operation, _ = operations[index]
+                        journal.record(op_index, batch_operation or operation, message)
+                failed = failed or not ok
+
+            if failed:
+                return False
+    finally:
+        pool.shutdown(wait=True)
+
+    return True
+
+
+def do_migrate(
+    data,
+    bk_iam_host=DEFAULT_BK_IAM_HOST,
+    app_code="",
+    app_secret="",
+    client=None,
+    batch_size=DEFAULT_BATCH_SIZE,
+    workers=DEFAULT_WORKERS,
+    journal=None,
+):
     system_id = data.get("system_id")
     if not system_id:
         print("invald json. [system_id] required, and should not be empty")
@@ -580,14 +2945,37 @@ def do_migrate(data, bk_iam_host=BK_IAM_HOST, app_code=APP_CODE, app_secret=APP_
 
     print("do migrate")
 
-    client = Client(app_code, app_secret, bk_iam_host)
+    # the client may be shared by multiple migration files, keep the queried models in memory
+    if client is None:
+        client = Client(app_code, app_secret, bk_iam_host)
 
     # 1. query all data of the system
-    system_ids, resource_type_ids, action_ids, instance_selection_ids = client.query_all_models(system_id)
+    client.load_models(system_id)
 
-    client.setup_models(system_ids, resource_type_ids, action_ids, instance_selection_ids)
+    if workers > 1:
+        return _do_migrate_parallel(client, system_id, operations, workers, journal, batch_size)
 
-    for op in operations:
+    # consecutive add/delete operations of the same kind, will be sent by one batch api call
+    batch_operation = None
+    batch_data = []
+    batch_indexes = []
+
+    def flush_batch():
+        if not batch_data:
+            return True
+
+        ok, message = client.do_batch_operation(batch_operation, system_id, batch_data)
+        report_batch_result(batch_operation, batch_data, ok, message)
+        del batch_data[:]
+        if not ok:
+            return False
+        if journal:
+            for index in batch_indexes:
+                journal.record(index, batch_operation, message)
+        del batch_indexes[:]
+        return True
+
+    for index, op in enumerate(operations):
         operation = op.get("operation")
         if not operation:
             print("there got a empty `operation` in the json, will ignore and continue")
@@ -595,11 +2983,41 @@ def do_migrate(data, bk_iam_host=BK_IAM_HOST, app_code=APP_CODE, app_secret=APP_
             # print("")
             # return False
 
+        # resume from the operations not completed in the last run
+        if journal and journal.is_completed(index):
+            print("skip operation [%s] #%d, it has been completed in the last run" % (operation, index))
+            continue
+        # merged into another operation by the plan optimizer
+        if op.get("superseded_by"):
+            print("skip operation [%s] #%d, superseded by %s" % (operation, index, op.get("superseded_by")))
+            continue
+
         data = op.get("data")
         if not data:
             print("no `data` in the json body or the `data` is empty, operation=%s" % operation)
             return False
 
+        if batch_size > 1:
+            resolved_operation = client.resolve_operation(operation, data)
+            if (
+                resolved_operation in client.batch_operation_funcs
+                and isinstance(data, dict)
+                and data.get("id")
+                and data.get("id") not in {d.get("id") for d in batch_data}
+            ):
+                if resolved_operation != batch_operation and not flush_batch():
+                    return False
+                batch_operation = resolved_operation
+                batch_data.append(data)
+                batch_indexes.append(index)
+                if len(batch_data) >= batch_size and not flush_batch():
+                    return False
+                continue
+
+            # keep the order of operations, the pending batch should be executed first
+            if not flush_batch():
+                return False
+
         op_data_id = ""
         if isinstance(data, dict):
             op_data_id = "id=%s" % data.get("id")
@@ -608,73 +3026,2188 @@ def do_migrate(data, bk_iam_host=BK_IAM_HOST, app_code=APP_CODE, app_secret=APP_
         if not ok:
             print("execute operation [%s] %s fail, error message: %s" % (operation, message, op_data_id))
             return False
+        if journal:
+            journal.record(index, operation, message)
+        if message == SKIP_MESSAGE:
+            print("execute operation [%s] %s %s" % (operation, op_data_id, SKIP_MESSAGE))
+            continue
         print("execute operation [%s] %s success!" % (operation, op_data_id))
 
+    if not flush_batch():
+        return False
+
     print("end migrate")
     return True
 
 
-if __name__ == "__main__":
-    p = argparse.ArgumentParser()
-    p.add_argument(
-        "-t",
-        action="store",
-        dest="bk_iam_host",
-        help=(
-            "bk_iam_host, i.e: http://iam.service.consul;"
-            "you can use bk_apigateway_url here, set with the '--apigateway' "
-        ),
-        required=True,
-    )
-    p.add_argument(
-        "-f",
-        action="store",
-        dest="json_data_file",
-        help="which migration file to execute, i.e: 00001_bk_cmdb_20190618100210.json",
-        required=True,
-    )
-    p.add_argument("-a", action="store", dest="app_code", help="app code", required=True)
-    p.add_argument("-s", action="store", dest="app_secret", help="app secret", required=True)
+def migrate_files(
+    client,
+    data_list,
+    batch_size=DEFAULT_BATCH_SIZE,
+    workers=DEFAULT_WORKERS,
+    ledger=None,
+    journal_path=DEFAULT_JOURNAL_PATH,
+    unresolved_refs=None,
+    applied=None,
+    placeholders=None,
+):
+    """
+    使用一个Client依次执行所有迁移文件
 
-    p.add_argument(
-        "--apigateway",
-        action="store_true",
-        dest="use_apigateway",
-        help="you can use bk_apigateway_url in '-t', should set this flag",
-    )
-    args = p.parse_args()
+    data_list: [(data_file, data)]
+    applied: 执行成功的迁移文件会追加到该列表中
+    placeholders: 加载迁移文件时使用的占位符, 操作记录与替换后的内容绑定
+    """
+    # ping only if iam is not known to be ready
+    if not client.wait_ready():
+        print("iam service is not available: %s" % client.bk_iam_host)
+        return False
 
-    BK_IAM_HOST = args.bk_iam_host.rstrip("/")
-    USE_APIGATEWAY = args.use_apigateway
-    if USE_APIGATEWAY:
-        print(
-            "use apigateway:",
-            args.use_apigateway,
-            ", please make sure '-t %s' is a valid bk_apigateway_url" % args.bk_iam_host,
-        )
+    # the references not declared in the migration files should exist in iam, checked before any write
+    client.data_file = data_list[0][0] if data_list else ""
+    errors = check_refs_with_models(client, unresolved_refs or [])
+    if errors:
+        print_validation_errors(errors)
+        return False
 
-    if not BK_IAM_HOST.startswith("http://"):
-        BK_IAM_HOST = "http://%s" % BK_IAM_HOST
+    for data_file, data in data_list:
+        print("start migrate [%s]" % data_file)
 
-    data_file = args.json_data_file
-    APP_CODE = args.app_code
-    APP_SECRET = args.app_secret
+        client.data_file = data_file
+        journal = OperationJournal(journal_path, data_file, placeholders) if journal_path else None
+        ok = do_migrate(data, client=client, batch_size=batch_size, workers=workers, journal=journal)
+        if not ok:
+            print("do migrate [%s] fail" % data_file)
+            return False
+        if journal:
+            journal.clear()
+        if ledger:
+            ledger.mark_applied(data_file, data)
+        if applied is not None:
+            applied.append(data_file)
+        print("do migrate [%s] success!" % data_file)
+    return True
 
-    # test ping
-    ok, _ = api_ping(BK_IAM_HOST)
-    if not ok:
-        print("iam service is not available: %s" % BK_IAM_HOST)
-        exit(1)
 
-    print("start migrate [%s]" % data_file)
+def _do_migrate_parallel(client, system_id, operations, workers, journal=None, batch_size=DEFAULT_BATCH_SIZE):
+    valid_operations, error_message = prepare_operations(client, operations, journal)
+    if not execute_operations_parallel(client, system_id, valid_operations, workers, journal, batch_size):
+        return False
 
-    # 数据解析
-    data = load_data(data_file)
-    if not data:
-        exit(1)
+    if error_message:
+        print(error_message)
+        return False
 
-    ok = do_migrate(data, BK_IAM_HOST, APP_CODE, APP_SECRET)
-    if not ok:
-        print("do migrate [%s] fail" % data_file)
-        exit(1)
-    print("do migrate [%s] success!" % data_file)
\ No newline at end of file
+    print("end migrate")
+    return True
+
+
+# =================== validation ===================
+
+
+def validate_data_list(data_list, operation_funcs=None, declared=None):
+    """
+    执行前检查所有迁移文件, 不访问权限中心: 操作及数据格式, 以及引用的资源类型/实例视图/操作是否存在
+    先为所有迁移文件中声明的模型建立索引, 再线性检查所有操作, 一次报告所有错误
+
+    data_list: [(data_file, data)]
+    declared: declared_models(with_data=False)的结果, 未指定时重新建立
+    return: errors, unresolved_refs
+        unresolved_refs: [(system_id, kind, id, error)], the references not declared in the migration files,
+        should be checked again with the queried models
+    """
+    operation_funcs = operation_funcs or Client.operation_funcs
+    errors = []
+    # system_id => the ids of the models exist after all migration files executed
+    if declared is None:
+        declared = declared_models(data_list, with_data=False)
+
+    unresolved_refs = []
+    for data_file, data in data_list:
+        name = os.path.basename(data_file)
+        system_id = data.get("system_id")
+        if not system_id:
+            errors.append("[%s] [system_id] required, and should not be empty" % name)
+        operations = data.get("operations")
+        if not operations or not isinstance(operations, (list, StreamedOperations)):
+            errors.append("[%s] [operations] required, and should be a non-empty list" % name)
+            continue
+
+        for index, op in enumerate(operations):
+            operation, op_data = op.get("operation"), op.get("data")
+            if not operation:
+                # the same as the execution, the empty operation will be ignored
+                continue
+
+            prefix = "[%s] operations[%d] %s" % (name, index, operation)
+            if operation not in operation_funcs:
+                errors.append("%s: invalid operation" % prefix)
+                continue
+            if not op_data:
+                errors.append("%s: no `data` or the `data` is empty" % prefix)
+                continue
+
+            kind = _operation_kind(operation)
+            if kind in OPERATION_KIND_RANKS:
+                if not isinstance(op_data, dict) or not op_data.get("id"):
+                    errors.append("%s: the field `id` required" % prefix)
+                    continue
+                prefix = "%s id=%s" % (prefix, op_data.get("id"))
+                if kind == "system" and op_data.get("id") != system_id:
+                    errors.append("%s: json[system_id] is not equals the value of `id`" % prefix)
+            if operation.startswith("delete_"):
+                continue
+
+            for field, ref_system_id, ref_kind, ref_id in iter_operation_refs(kind, op_data):
+                # the models of other systems could not be checked
+                if ref_system_id not in (None, system_id):
+                    continue
+                error = "%s: %s references unknown %s `%s`" % (prefix, field, ref_kind.replace("_", " "), ref_id)
+                if not ref_id:
+                    errors.append("%s: %s has a reference without `id`" % (prefix, field))
+                elif ref_id not in declared_ids(declared, system_id, ref_kind):
+                    unresolved_refs.append((system_id, ref_kind, ref_id, error))
+
+    return errors, unresolved_refs
+
+
+def check_unresolved_refs(unresolved_refs, client, system_id):
+    """
+    检查未在迁移文件中声明的引用是否存在于已查询的模型中, client需要已加载system_id的模型
+
+    return: errors
+    """
+    return [
+        error
+        for ref_system_id, ref_kind, ref_id, error in unresolved_refs
+        if ref_system_id == system_id and ref_id not in client.model_ids(ref_kind)
+    ]
+
+
+def check_refs_with_models(client, unresolved_refs):
+    """
+    查询各系统已有的模型后, 检查未在迁移文件中声明的引用
+
+    return: errors
+    """
+    errors = []
+    for system_id in sorted({ref[0] for ref in unresolved_refs}):
+        client.load_models(system_id)
+        errors.extend(check_unresolved_refs(unresolved_refs, client, system_id))
+    return errors
+
+
+def print_validation_errors(errors):
+    print("validate migration files fail, %d errors:" % len(errors))
+    for error in errors:
+        print("  %s" % error)
+
+
+# =================== prune ===================
+
+# the stale models are deleted in this order, the actions reference the instance selections and resource types,
+# the instance selections reference the resource types
+PRUNE_KINDS = ("action", "instance_selection", "resource_type")
+
+
+def stale_model_ids(client, system_id, declared):
+    """
+    权限中心中存在, 但所有迁移文件执行后不应存在的模型, 按删除顺序返回
+
+    declared: declared_models(with_data=False)的结果
+    return: [(kind, [id])]
+    """
+    client.load_models(system_id)
+    return [
+        (kind, sorted(client.model_ids(kind) - declared_ids(declared, system_id, kind))) for kind in PRUNE_KINDS
+    ]
+
+
+def prune_models(client, system_id, declared, dry_run=False):
+    """
+    删除未在迁移文件中声明的模型, 先列出所有待删除的模型, 再按类型批量删除
+    """
+    stale = stale_model_ids(client, system_id, declared)
+    if not any(ids for _, ids in stale):
+        print("prune [%s]: no stale model" % system_id)
+        return True
+
+    for kind, ids in stale:
+        for _id in ids:
+            print("prune [%s]: stale %s id=%s" % (system_id, kind.replace("_", " "), _id))
+    if dry_run:
+        return True
+
+    for kind, ids in stale:
+        if not ids:
+            continue
+        operation = "delete_%s" % kind
+        op_data_ids = "id=%s" % ",".join(ids)
+        ok, message = client.do_batch_operation(operation, system_id, [{"id": _id} for _id in ids])
+        if not ok:
+            print("execute batch operation [%s] %s fail, error message: %s" % (operation, op_data_ids, message))
+            return False
+        print("execute batch operation [%s] %s success!" % (operation, op_data_ids))
+    return True
+
+
+# =================== plan optimizer ===================
+
+
+def _iter_data_list_operations(data_list):
+    """
+    按顺序遍历所有迁移文件中的操作, 流式读取的文件只返回一次 (data_file, None, None) 作为分隔
+
+    yield: (data_file, index, op)
+    """
+    for data_file, data in data_list:
+        operations = data.get("operations")
+        if not isinstance(operations, list):
+            yield data_file, None, None
+            continue
+        for index, op in enumerate(operations):
+            if isinstance(op, dict) and isinstance(op.get("operation"), str):
+                yield data_file, index, op
+
+
+def optimize_data_list(data_list, completed=None):
+    """
+    执行前合并所有迁移文件中的冗余写操作, 只发送最少的写请求:
+    - 同一模型之后的add/update/upsert操作合并到第一个操作中, 合并后引用的模型需要在第一个操作之前声明或已存在
+    - 同一配置的多次写入只保留最后一次
+    - delete操作之前的操作, 以及流式读取的文件之前的操作, 不与之后的操作合并
+    - 上次执行中已完成的操作重试时会跳过, 之后的写操作不合并到其中
+    被合并的操作标记superseded_by, 执行时跳过, 操作序号保持不变
+
+    data_list: [(data_file, data)]
+    completed: {data_file: {index}}, the operations completed in the last run, see completed_operations
+    return: data_list, merged, superseded
+    """
+    completed = completed or {}
+    # copy the operations, the loaded data is not changed
+    data_list = [
+        (data_file, dict(data, operations=[dict(op) if isinstance(op, dict) else op for op in data["operations"]]))
+        if isinstance(data.get("operations"), list)
+        else (data_file, data)
+        for data_file, data in data_list
+    ]
+    system_ids = {data_file: data.get("system_id") for data_file, data in data_list}
+
+    # (system_id, kind, id) => the position of the first operation declaring the model
+    declared_at = {}
+    for position, (data_file, index, op) in enumerate(_iter_data_list_operations(data_list)):
+        if op is None:
+            continue
+        kind = _operation_kind(op["operation"])
+        data = op.get("data")
+        if kind in OPERATION_KIND_RANKS and isinstance(data, dict) and not op["operation"].startswith("delete_"):
+            declared_at.setdefault((system_ids[data_file], kind, data.get("id")), position)
+
+    # (system_id, kind, id) => (position, data_file, index, op), the operation the later writes merged into
+    heads = {}
+    # (system_id, config name) => (data_file, index, op), the last write of the config
+    configs = {}
+    merged = superseded = 0
+    for position, (data_file, index, op) in enumerate(_iter_data_list_operations(data_list)):
+        if op is None:
+            heads.clear()
+            configs.clear()
+            continue
+
+        system_id = system_ids[data_file]
+        operation, data = op["operation"], op.get("data")
+        kind = _operation_kind(operation)
+        location = "%s#%d" % (os.path.basename(data_file), index)
+        if kind in CONFIG_NAMES and data:
+            last = configs.get((system_id, kind))
+            if last:
+                last[2]["superseded_by"] = location
+                superseded += 1
+            configs[(system_id, kind)] = (data_file, index, op)
+            continue
+
+        if kind not in OPERATION_KIND_RANKS or not isinstance(data, dict) or not data.get("id"):
+            continue
+        key = (system_id, kind, data.get("id"))
+        if operation.startswith("delete_") or index in completed.get(data_file, ()):
+            heads.pop(key, None)
+            continue
+
+        head = heads.get(key)
+        # the models referenced by the later write should exist at the position of the first operation
+        if head is None or any(
+            declared_at.get((system_id, ref_kind, ref_id), -1) > head[0]
+            for _, ref_system_id, ref_kind, ref_id in iter_operation_refs(kind, data)
+            if ref_system_id in (None, system_id)
+        ):
+            heads[key] = (position, data_file, index, op)
+            continue
+
+        _, head_file, head_index, head_op = head
+        head_data = dict(head_op["data"])
+        head_data.update(data)
+        head_op["data"] = head_data
+        op["superseded_by"] = "%s#%d" % (os.path.basename(head_file), head_index)
+        merged += 1
+
+    return data_list, merged, superseded
+
+
+# =================== plan ===================
+
+
+def load_snapshot(filename):
+    """
+    加载保存的api_query响应作为模型快照, 支持完整响应{"code": 0, "data": {...}}或其中的data
+    """
+    snapshot = load_data(filename)
+    if "code" in snapshot and "data" in snapshot:
+        snapshot = snapshot.get("data") or {}
+    return snapshot
+
+
+class PlanClient(Client):
+    """
+    只生成执行计划, 不发送任何写请求; 指定快照时从快照中读取模型数据, 完全离线执行
+    """
+
+    # http func => plan group
+    plan_groups = {
+        "http_post": "add",
+        "http_put": "update",
+        "http_delete": "delete",
+    }
+
+    def __init__(
+        self,
+        app_code,
+        app_secret,
+        bk_iam_host,
+        snapshot=None,
+        pool_size=DEFAULT_POOL_SIZE,
+        retry_policy=None,
+        transport=None,
+        batch_chunker=None,
+        use_apigateway=DEFAULT_USE_APIGATEWAY,
+        readiness=None,
+    ):
+        super(PlanClient, self).__init__(
+            app_code,
+            app_secret,
+            bk_iam_host,
+            pool_size=pool_size,
+            retry_policy=retry_policy,
+            transport=transport,
+            batch_chunker=batch_chunker,
+            use_apigateway=use_apigateway,
+            readiness=readiness,
+        )
+        self.snapshot = snapshot
+        # group => [(method, path, operation, data)]
+        self.plan = {"add": [], "update": [], "delete": [], "skip": []}
+        self._operation = None
+
+    def _call_iam_api(self, http_func, path, data):
+        if http_func.__name__ == "http_get":
+            if self.snapshot is None:
+                return super(PlanClient, self)._call_iam_api(http_func, path, data)
+            return self._query_snapshot(path)
+
+        method = http_func.__name__[len("http_") :].upper()
+        self.plan[self.plan_groups[http_func.__name__]].append((method, path, self._operation, data))
+        return True, "ok", None
+
+    def _query_snapshot(self, path):
+        system_id = (self.snapshot.get("base_info") or {}).get("id")
+        if path != "/api/v1/model/systems/{system_id}/query".format(system_id=system_id):
+            return False, "snapshot of the system not found", None
+        return True, "ok", self.snapshot
+
+    def do_operation(self, op, system_id, data):
+        self._operation = "%s id=%s" % (op, data.get("id")) if isinstance(data, dict) and data.get("id") else op
+        ok, message = super(PlanClient, self).do_operation(op, system_id, data)
+        if ok and message == SKIP_MESSAGE:
+            self.plan["skip"].append(("-", "-", self._operation, data))
+        return ok, message
+
+    def do_batch_operation(self, op, system_id, data_list):
+        self._operation = "%s id=%s" % (op, ",".join(d.get("id") for d in data_list))
+        return super(PlanClient, self).do_batch_operation(op, system_id, data_list)
+
+    def print_plan(self):
+        print("migration plan:")
+        for group in ("add", "update", "delete", "skip"):
+            calls = self.plan[group]
+            print("  %s (%d):" % (group, len(calls)))
+            for method, path, operation, _ in calls:
+                if group == "skip":
+                    print("    [%s]" % operation)
+                else:
+                    print("    %s %s [%s]" % (method, path, operation))
+        writes = sum(len(self.plan[group]) for group in ("add", "update", "delete"))
+        print("total: %d write calls, %d skipped" % (writes, len(self.plan["skip"])))
+
+
+# =================== asyncio client ===================
+
+
+class AsyncHTTPTransport(object):
+    """
+    基于asyncio的HTTP/1.1客户端, 复用keep-alive连接
+    与HTTPClientTransport一致, 使用环境变量中的代理及CA证书
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, verify=False, cert=None):
+        self.pool_size = pool_size
+        self.verify = verify
+        self.cert = cert
+        # (scheme, host, port) => [(reader, writer)]
+        self._idle_connections = {}
+        # (scheme, host, port) => the headers sent to the http proxy, the requests use the full urls
+        self._forward_headers = {}
+
+    async def _open_connection(self, scheme, host, port):
+        """
+        通过代理访问https时, 使用CONNECT建立隧道
+        """
+        import asyncio
+
+        key, netloc = (scheme, host, port), "%s:%d" % (host, port)
+        ssl_context = _ssl_context(self.verify, self.cert) if scheme == "https" else None
+        proxy = _env_proxy(scheme, netloc)
+        if proxy is None:
+            self._forward_headers.pop(key, None)
+            return await asyncio.open_connection(host, port, ssl=ssl_context)
+        if scheme != "https":
+            self._forward_headers[key] = _proxy_headers(proxy)
+            return await asyncio.open_connection(proxy.hostname, proxy.port or 80)
+        self._forward_headers.pop(key, None)
+        return await self._open_tunnel(proxy, netloc, host, ssl_context)
+
+    @staticmethod
+    async def _open_tunnel(proxy, netloc, host, ssl_context):
+        import asyncio
+        import socket
+
+        loop = asyncio.get_running_loop()
+        addresses = await loop.getaddrinfo(proxy.hostname, proxy.port or 80, type=socket.SOCK_STREAM)
+        family, sock_type, proto, _, address = addresses[0]
+        sock = socket.socket(family, sock_type, proto)
+        try:
+            sock.setblocking(False)
+            await loop.sock_connect(sock, address)
+            lines = ["CONNECT %s HTTP/1.1" % netloc, "Host: %s" % netloc]
+            lines.extend("%s: %s" % (k, v) for k, v in _proxy_headers(proxy).items())
+            await loop.sock_sendall(sock, ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+            # the server sends nothing before the tls handshake, the response of the proxy is read to the end
+            response = b""
+            while b"\r\n\r\n" not in response:
+                chunk = await loop.sock_recv(sock, 4096)
+                if not chunk:
+                    raise ConnectionError("connection closed by the proxy")
+                response += chunk
+            status = int(response.split(None, 2)[1])
+            if status != 200:
+                raise ConnectionError("proxy CONNECT %s fail: %s" % (netloc, status))
+            return await asyncio.open_connection(sock=sock, ssl=ssl_context, server_hostname=host)
+        except BaseException:
+            sock.close()
+            raise
+
+    @staticmethod
+    async def _read_body(reader, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";", 1)[0].strip(), 16)
+                if size == 0:
+                    # skip the trailers
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks)
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+
+        if "content-length" in headers:
+            return await reader.readexactly(int(headers["content-length"]))
+        return await reader.read()
+
+    async def _send(self, connection, method, host, path, headers, body):
+        reader, writer = connection
+        lines = ["%s %s HTTP/1.1" % (method, path), "Host: %s" % host, "Content-Length: %d" % len(body or b"")]
+        lines.extend("%s: %s" % (k, v) for k, v in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("utf-8") + (body or b""))
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        status = int(status_line.split(None, 2)[1])
+
+        resp_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            k, _, v = line.decode("latin-1").partition(":")
+            resp_headers[k.strip().lower()] = v.strip()
+
+        content = await self._read_body(reader, resp_headers)
+        keep_alive = resp_headers.get("connection", "").lower() != "close" and (
+            "content-length" in resp_headers or "transfer-encoding" in resp_headers
+        )
+        return status, content, resp_headers, keep_alive
+
+    async def request(self, method, url, headers=None, body=None, timeout=None):
+        """
+        timeout: seconds or (connect timeout, read timeout)
+        return: status_code, content, headers(the names are lower case)
+        """
+        import asyncio
+
+        parsed = urlsplit(url)
+        port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        key = (parsed.scheme, parsed.hostname, port)
+        path = (parsed.path or "/") + ("?" + parsed.query if parsed.query else "")
+        connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+
+        async def send(connection):
+            request_path, request_headers = path, headers or {}
+            forward_headers = self._forward_headers.get(key)
+            if forward_headers is not None:
+                request_path = "%s://%s%s" % (parsed.scheme, parsed.netloc, path)
+                request_headers = dict(request_headers, **forward_headers)
+            return await asyncio.wait_for(
+                self._send(connection, method, parsed.netloc, request_path, request_headers, body), read_timeout
+            )
+
+        idle = self._idle_connections.setdefault(key, [])
+        reused = bool(idle)
+        if reused:
+            connection = idle.pop()
+        else:
+            connection = await asyncio.wait_for(self._open_connection(*key), connect_timeout)
+        try:
+            try:
+                status, content, resp_headers, keep_alive = await send(connection)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # the idle connection may have been closed by the server, retry once with a new connection
+                connection[1].close()
+                if not reused:
+                    raise
+                connection = await asyncio.wait_for(self._open_connection(*key), connect_timeout)
+                status, content, resp_headers, keep_alive = await send(connection)
+        except BaseException:
+            connection[1].close()
+            raise
+
+        if keep_alive and len(idle) < self.pool_size:
+            idle.append(connection)
+        else:
+            connection[1].close()
+        return status, content, resp_headers
+
+    async def close(self):
+        for connections in self._idle_connections.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle_connections = {}
+
+
+async def async_http_request(
+    transport, method, url, headers=None, data=None, timeout=None, stats=None, compress=False
+):
+    import asyncio
+
+    stats = stats if stats is not None else {}
+    if not headers:
+        headers = _gen_header()
+
+    start = time.time()
+    body = None
+    if method == "GET":
+        if data:
+            url = "%s?%s" % (url, urlencode(data))
+    elif data is not None:
+        body = json.dumps(data).encode("utf-8")
+        headers = dict(headers)
+        headers.setdefault("Content-Type", "application/json")
+        if compress and len(body) >= GZIP_MIN_BYTES:
+            import gzip
+
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+    stats["encode"] = time.time() - start
+    stats["bytes_sent"] = len(body or b"")
+
+    start = time.time()
+    try:
+        status_code, content, resp_headers = await transport.request(
+            method, url, headers=headers, body=body, timeout=timeout
+        )
+    except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+        stats["network"] = time.time() - start
+        stats["timeout"] = isinstance(e, asyncio.TimeoutError)
+        print("http request error! method: %s, url: %s, data: %s! err=%s" % (method, url, data, e))
+        return False, {"error": str(e) or e.__class__.__name__}
+    stats["network"] = time.time() - start
+    stats["status"] = status_code
+    stats["bytes_received"] = len(content)
+
+    if status_code != 200:
+        error_msg = (
+            "http request fail! method: %s, url: %s, data: %s, " "response_status_code: %s, response_content: %s"
+        )
+        print(error_msg % (method, url, str(data), status_code, content[:100]))
+        return False, _http_error(status_code, resp_headers, stats)
+
+    start = time.time()
+    try:
+        result = json.loads(content.decode("utf-8"))
+    except ValueError as e:
+        return False, {"error": "invalid json response: %s" % e, "status_code": status_code}
+    stats["decode"] = time.time() - start
+    return True, result
+
+
+class AsyncClient(Client):
+    """
+    Client的asyncio版本, api_*及操作方法均为协程, 同时进行中的请求数由AdaptiveConcurrency限制
+    """
+
+    def __init__(
+        self,
+        app_code,
+        app_secret,
+        bk_iam_host,
+        pool_size=DEFAULT_POOL_SIZE,
+        concurrency=DEFAULT_CONCURRENCY,
+        retry_policy=None,
+        metrics=None,
+        batch_chunker=None,
+        gzip=False,
+        rate_limiter=None,
+        use_apigateway=DEFAULT_USE_APIGATEWAY,
+        readiness=None,
+    ):
+        super(AsyncClient, self).__init__(
+            app_code,
+            app_secret,
+            bk_iam_host,
+            pool_size=pool_size,
+            retry_policy=retry_policy,
+            metrics=metrics,
+            transport=AsyncHTTPTransport(pool_size=max(pool_size, concurrency)),
+            batch_chunker=batch_chunker,
+            gzip=gzip,
+            rate_limiter=rate_limiter,
+            concurrency_limiter=AdaptiveConcurrency(concurrency),
+            use_apigateway=use_apigateway,
+            readiness=readiness,
+        )
+        self.concurrency = concurrency
+
+    async def close(self):
+        await self.transport.close()
+
+    async def _call_iam_api(self, method, path, data):
+        import asyncio
+
+        url = "{host}{path}".format(host=self.bk_iam_host, path=path)
+        headers = self._gen_iam_headers()
+        attempt = 0
+        while True:
+            timeout = self.retry_policy.timeout()
+            if timeout is None:
+                ok, _data = False, DEADLINE_EXCEEDED_ERROR
+                break
+
+            stats = {}
+            await self.concurrency_limiter.async_acquire()
+            try:
+                wait = self.rate_limiter.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                start = time.time()
+                ok, _data = await async_http_request(
+                    self.transport,
+                    method,
+                    url,
+                    headers=headers,
+                    data=data,
+                    timeout=timeout,
+                    stats=stats,
+                    compress=self.gzip,
+                )
+            finally:
+                await self.concurrency_limiter.async_release(stats)
+            self.metrics.record(method, path, ok, time.time() - start, stats)
+            _last_call_stats.set(stats)
+            if ok:
+                self.readiness.mark_ready()
+
+            delay = self.retry_policy.retry_delay(method, attempt, ok, _data)
+            if delay is None:
+                break
+            attempt += 1
+            print("_call_iam_api retry(%d) after %.2fs, method: %s, path: %s" % (attempt, delay, method, path))
+            await asyncio.sleep(delay)
+        return self._parse_iam_response("http_%s" % method.lower(), path, ok, _data)
+
+    async def _call_api(self, name, data=None, **path_args):
+        method, path = IAM_APIS[name]
+        return await self._call_iam_api(method, path.format(**path_args), data)
+
+    async def _call_api_ok(self, name, data=None, **path_args):
+        ok, message, _ = await self._call_api(name, data, **path_args)
+        return ok, message
+
+    # ---------- system
+    async def api_add_system(self, data):
+        # if alreay exists, return true
+        return await self._call_api_ok("add_system", data)
+
+    async def api_update_system(self, system_id, data):
+        return await self._call_api_ok("update_system", data, system_id=system_id)
+
+    # ---------- resource_type
+
+    async def api_batch_add_resource_types(self, system_id, data):
+        return await self._call_api_ok("batch_add_resource_types", data, system_id=system_id)
+
+    async def api_update_resource_type(self, system_id, resource_type_id, data):
+        return await self._call_api_ok(
+            "update_resource_type", data, system_id=system_id, resource_type_id=resource_type_id
+        )
+
+    async def api_batch_delete_resource_types(self, system_id, data):
+        return await self._call_api_ok("batch_delete_resource_types", data, system_id=system_id)
+
+    # ---------- instance_selection
+
+    async def api_batch_add_instance_selections(self, system_id, data):
+        return await self._call_api_ok("batch_add_instance_selections", data, system_id=system_id)
+
+    async def api_update_instance_selection(self, system_id, instance_selection_id, data):
+        return await self._call_api_ok(
+            "update_instance_selection", data, system_id=system_id, instance_selection_id=instance_selection_id
+        )
+
+    async def api_batch_delete_instance_selections(self, system_id, data):
+        return await self._call_api_ok("batch_delete_instance_selections", data, system_id=system_id)
+
+    # ---------- action
+
+    async def api_batch_add_actions(self, system_id, data):
+        return await self._call_api_ok("batch_add_actions", data, system_id=system_id)
+
+    async def api_update_action(self, system_id, action_id, data):
+        return await self._call_api_ok("update_action", data, system_id=system_id, action_id=action_id)
+
+    async def api_batch_delete_actions(self, system_id, data):
+        return await self._call_api_ok("batch_delete_actions", data, system_id=system_id)
+
+    # ---------- configs: action_groups, resource_creator_actions, common_actions, ...
+    async def api_add_action_groups(self, system_id, data):
+        return await self._call_api_ok("add_action_groups", data, system_id=system_id)
+
+    async def api_update_action_groups(self, system_id, data):
+        return await self._call_api_ok("update_action_groups", data, system_id=system_id)
+
+    async def api_add_resource_creator_actions(self, system_id, data):
+        return await self._call_api_ok("add_resource_creator_actions", data, system_id=system_id)
+
+    async def api_update_resource_creator_actions(self, system_id, data):
+        return await self._call_api_ok("update_resource_creator_actions", data, system_id=system_id)
+
+    async def api_add_common_actions(self, system_id, data):
+        return await self._call_api_ok("add_common_actions", data, system_id=system_id)
+
+    async def api_update_common_actions(self, system_id, data):
+        return await self._call_api_ok("update_common_actions", data, system_id=system_id)
+
+    async def api_add_feature_shield_rules(self, system_id, data):
+        return await self._call_api_ok("add_feature_shield_rules", data, system_id=system_id)
+
+    async def api_update_feature_shield_rules(self, system_id, data):
+        return await self._call_api_ok("update_feature_shield_rules", data, system_id=system_id)
+
+    async def api_add_custom_frontend_settings(self, system_id, data):
+        return await self._call_api_ok("add_custom_frontend_settings", data, system_id=system_id)
+
+    async def api_update_custom_frontend_settings(self, system_id, data):
+        return await self._call_api_ok("update_custom_frontend_settings", data, system_id=system_id)
+
+    # ---------- query
+
+    async def api_query(self, system_id):
+        return await self._call_api("query", system_id=system_id)
+
+    # =================== operations ===================
+
+    async def add_system(self, system_id, data):
+        d_system_id = data.get("id")
+        if not d_system_id:
+            return False, "the field `id` required"
+
+        if system_id != d_system_id:
+            return False, "json[system_id] is not equals the value of `id`"
+
+        ok, message = await self.api_add_system(data)
+        if ok:
+            self.save_model("system", system_id, data)
+        return ok, message
+
+    async def update_system(self, system_id, data):
+        d_system_id = data.get("id")
+        if not d_system_id:
+            return False, "the field `id` required"
+
+        if system_id != d_system_id:
+            return False, "json[system_id] is not equals the value of `id`"
+
+        ok, message = await self.api_update_system(system_id, data)
+        if ok:
+            self.save_model("system", system_id, data, merge=True)
+        return ok, message
+
+    async def _add_model(self, kind, system_id, data):
+        if not data.get("id"):
+            return False, "the field `id` required"
+        return await self.do_batch_operation("add_%s" % kind, system_id, [data])
+
+    async def _delete_model(self, kind, system_id, data):
+        if not data.get("id"):
+            return False, "the field `id` required"
+        return await self.do_batch_operation("delete_%s" % kind, system_id, [data])
+
+    async def _update_model(self, kind, api_func, system_id, data):
+        model_id = data.get("id")
+        if not model_id:
+            return False, "the field `id` required"
+
+        # only the update action api accepts the `id` field in the body
+        if kind != "action":
+            data = {k: v for k, v in data.items() if k != "id"}
+        ok, message = await api_func(system_id, model_id, data)
+        if ok:
+            self.save_model(kind, model_id, data, merge=True)
+        return ok, message
+
+    async def _upsert_model(self, kind, system_id, data):
+        if not data.get("id"):
+            return False, "the field `id` required"
+
+        operation = self.resolve_operation("upsert_%s" % kind, data)
+        if operation.startswith("add_"):
+            return await self._add_model(kind, system_id, data)
+        if self.is_model_unchanged(kind, data.get("id"), data):
+            return True, SKIP_MESSAGE
+        return await getattr(self, operation)(system_id, data)
+
+    async def add_resource_type(self, system_id, data):
+        return await self._add_model("resource_type", system_id, data)
+
+    async def update_resource_type(self, system_id, data):
+        return await self._update_model("resource_type", self.api_update_resource_type, system_id, data)
+
+    async def delete_resource_type(self, system_id, data):
+        return await self._delete_model("resource_type", system_id, data)
+
+    async def add_instance_selection(self, system_id, data):
+        return await self._add_model("instance_selection", system_id, data)
+
+    async def update_instance_selection(self, system_id, data):
+        return await self._update_model("instance_selection", self.api_update_instance_selection, system_id, data)
+
+    async def delete_instance_selection(self, system_id, data):
+        return await self._delete_model("instance_selection", system_id, data)
+
+    async def add_action(self, system_id, data):
+        return await self._add_model("action", system_id, data)
+
+    async def update_action(self, system_id, data):
+        return await self._update_model("action", self.api_update_action, system_id, data)
+
+    async def delete_action(self, system_id, data):
+        return await self._delete_model("action", system_id, data)
+
+    async def _save_config(self, name, api_func, system_id, data):
+        ok, message = await api_func(system_id, data)
+        if ok:
+            self.save_model(name, system_id, data)
+        return ok, message
+
+    async def _upsert_config(self, name, system_id, data):
+        if self.is_model_unchanged(name, system_id, data):
+            return True, SKIP_MESSAGE
+        return await getattr(self, "update_%s" % name)(system_id, data)
+
+    async def add_action_groups(self, system_id, data):
+        return await self._save_config("action_groups", self.api_add_action_groups, system_id, data)
+
+    async def update_action_groups(self, system_id, data):
+        return await self._save_config("action_groups", self.api_update_action_groups, system_id, data)
+
+    async def upsert_action_groups(self, system_id, data):
+        return await self._upsert_config("action_groups", system_id, data)
+
+    async def add_resource_creator_actions(self, system_id, data):
+        return await self._save_config(
+            "resource_creator_actions", self.api_add_resource_creator_actions, system_id, data
+        )
+
+    async def update_resource_creator_actions(self, system_id, data):
+        return await self._save_config(
+            "resource_creator_actions", self.api_update_resource_creator_actions, system_id, data
+        )
+
+    async def upsert_resource_creator_actions(self, system_id, data):
+        return await self._upsert_config("resource_creator_actions", system_id, data)
+
+    async def add_common_actions(self, system_id, data):
+        return await self._save_config("common_actions", self.api_add_common_actions, system_id, data)
+
+    async def update_common_actions(self, system_id, data):
+        return await self._save_config("common_actions", self.api_update_common_actions, system_id, data)
+
+    async def upsert_common_actions(self, system_id, data):
+        return await self._upsert_config("common_actions", system_id, data)
+
+    async def add_feature_shield_rules(self, system_id, data):
+        return await self._save_config("feature_shield_rules", self.api_add_feature_shield_rules, system_id, data)
+
+    async def update_feature_shield_rules(self, system_id, data):
+        return await self._save_config("feature_shield_rules", self.api_update_feature_shield_rules, system_id, data)
+
+    async def upsert_feature_shield_rules(self, system_id, data):
+        return await self._upsert_config("feature_shield_rules", system_id, data)
+
+    async def add_custom_frontend_settings(self, system_id, data):
+        return await self._save_config(
+            "custom_frontend_settings", self.api_add_custom_frontend_settings, system_id, data
+        )
+
+    async def update_custom_frontend_settings(self, system_id, data):
+        return await self._save_config(
+            "custom_frontend_settings", self.api_update_custom_frontend_settings, system_id, data
+        )
+
+    async def upsert_custom_frontend_settings(self, system_id, data):
+        return await self._upsert_config("custom_frontend_settings", system_id, data)
+
+    async def upsert_system(self, system_id, data):
+        if system_id not in self.models.ids("system"):
+            return await self.add_system(system_id, data)
+        if self.is_model_unchanged("system", system_id, data):
+            return True, SKIP_MESSAGE
+        return await self.update_system(system_id, data)
+
+    async def upsert_resource_type(self, system_id, data):
+        return await self._upsert_model("resource_type", system_id, data)
+
+    async def upsert_instance_selection(self, system_id, data):
+        return await self._upsert_model("instance_selection", system_id, data)
+
+    async def upsert_action(self, system_id, data):
+        return await self._upsert_model("action", system_id, data)
+
+    async def query_all_models(self, system_id):
+        ok, message, data = await self.api_query(system_id)
+        return self._parse_query_result(system_id, ok, message, data)
+
+    async def load_models(self, system_id):
+        if self.model_system_id == system_id:
+            return
+
+        await self.query_all_models(system_id)
+        self.model_system_id = system_id
+
+    async def wait_ready(self):
+        return await self.readiness.async_wait(
+            lambda timeout: async_api_ping(self.transport, self.bk_iam_host, timeout=timeout)
+        )
+
+    async def do_operation(self, op, system_id, data):
+        if op not in self.operation_funcs:
+            print("invalid operation: %s" % op)
+            exit(1)
+
+        # each asyncio task runs in a copy of the context, the operation will not leak to the other tasks
+        _current_operation.set(op)
+        return await getattr(self, self.operation_funcs[op])(system_id, data)
+
+    async def do_batch_operation(self, op, system_id, data_list):
+        api_func = self.batch_operation_funcs[op]
+        data_list, sizes = self._batch_data(op, data_list)
+
+        ok, message = True, "ok"
+        start = 0
+        while start < len(data_list):
+            end = self.batch_chunker.next_chunk(sizes, start)
+            chunk = data_list[start:end]
+
+            _last_call_stats.set(None)
+            ok, message = await getattr(self, api_func)(system_id, chunk)
+            if self._observe_batch(op, ok, message, chunk, sum(sizes[start:end])):
+                continue
+            if not ok:
+                return ok, message
+
+            self._save_batch_models(op, chunk)
+            start = end
+        return ok, message
+
+
+async def async_api_ping(transport, bk_iam_host, timeout=PING_TIMEOUT):
+    url = "{host}{path}".format(host=bk_iam_host, path="/ping")
+    return await async_http_request(transport, "GET", url, timeout=timeout)
+
+
+async def async_do_migrate(data, client, journal=None):
+    """
+    do_migrate的asyncio版本, 同一依赖层级的操作并发执行, 并发请求数由client的信号量限制
+    """
+    import asyncio
+
+    system_id = data.get("system_id")
+    if not system_id:
+        print("invald json. [system_id] required, and should not be empty")
+        return False
+
+    operations = data.get("operations")
+    if not operations:
+        print("invald json. [operations] required, and should not be empty")
+        return False
+
+    print("do migrate")
+
+    # 1. query all data of the system
+    await client.load_models(system_id)
+
+    valid_operations, error_message = prepare_operations(client, operations, journal)
+    operation_pairs = [(o, d) for _, o, d in valid_operations]
+    for indexes in group_operation_levels(plan_operation_levels(operation_pairs)):
+        tasks = [
+            asyncio.ensure_future(client.do_operation(operation_pairs[index][0], system_id, operation_pairs[index][1]))
+            for index in indexes
+        ]
+
+        # fail fast, cancel the pending operations of the level once an operation failed
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if any(t.exception() is not None or not t.result()[0] for t in done):
+                for t in pending:
+                    t.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                break
+
+        failed = False
+        for index, task in zip(indexes, tasks):
+            if task.cancelled():
+                continue
+            op_index, operation, op_data = valid_operations[index]
+            if task.exception() is not None:
+                ok, message = False, "execute operation raise exception: %s" % task.exception()
+            else:
+                ok, message = task.result()
+            report_operation_result(operation, op_data, ok, message)
+            if ok and journal:
+                journal.record(op_index, operation, message)
+            failed = failed or not ok
+        if failed:
+            return False
+
+    if error_message:
+        print(error_message)
+        return False
+
+    print("end migrate")
+    return True
+
+
+async def async_migrate_files(
+    data_list,
+    bk_iam_host,
+    app_code,
+    app_secret,
+    concurrency=DEFAULT_CONCURRENCY,
+    ledger=None,
+    journal_path=DEFAULT_JOURNAL_PATH,
+    unresolved_refs=None,
+    retry_policy=None,
+    metrics=None,
+    batch_chunker=None,
+    gzip=False,
+    rate_limiter=None,
+    use_apigateway=DEFAULT_USE_APIGATEWAY,
+    applied=None,
+    readiness=None,
+    placeholders=None,
+):
+    """
+    使用一个AsyncClient依次执行所有迁移文件
+
+    data_list: [(data_file, data)]
+    applied: 执行成功的迁移文件会追加到该列表中
+    placeholders: 加载迁移文件时使用的占位符, 操作记录与替换后的内容绑定
+    """
+    client = AsyncClient(
+        app_code,
+        app_secret,
+        bk_iam_host,
+        concurrency=concurrency,
+        retry_policy=retry_policy,
+        metrics=metrics,
+        batch_chunker=batch_chunker,
+        gzip=gzip,
+        rate_limiter=rate_limiter,
+        use_apigateway=use_apigateway,
+        readiness=readiness,
+    )
+    try:
+        if not await client.wait_ready():
+            print("iam service is not available: %s" % bk_iam_host)
+            return False
+
+        errors = []
+        client.data_file = data_list[0][0] if data_list else ""
+        for system_id in sorted({ref[0] for ref in unresolved_refs or []}):
+            await client.load_models(system_id)
+            errors.extend(check_unresolved_refs(unresolved_refs, client, system_id))
+        if errors:
+            print_validation_errors(errors)
+            return False
+
+        for data_file, data in data_list:
+            print("start migrate [%s]" % data_file)
+            client.data_file = data_file
+            journal = OperationJournal(journal_path, data_file, placeholders) if journal_path else None
+            if not await async_do_migrate(data, client, journal=journal):
+                print("do migrate [%s] fail" % data_file)
+                return False
+            if journal:
+                journal.clear()
+            if ledger:
+                ledger.mark_applied(data_file, data)
+            if applied is not None:
+                applied.append(data_file)
+            print("do migrate [%s] success!" % data_file)
+        return True
+    finally:
+        await client.close()
+
+
+# =================== watch ===================
+
+
+class _Inotify(object):
+    """
+    通过inotify等待目录中的文件变化, 只用于及时唤醒, 变化的文件仍由轮询比较确定; 不支持inotify的平台上不可用
+    """
+
+    # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    mask = 0x002 | 0x004 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+
+    def __init__(self, directory):
+        self.fd = None
+        try:
+            import ctypes
+
+            libc = ctypes.CDLL(None, use_errno=True)
+            # IN_NONBLOCK is the same as O_NONBLOCK
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        if libc.inotify_add_watch(fd, os.fsencode(directory), self.mask) < 0:
+            os.close(fd)
+            return
+        self.fd = fd
+
+    @property
+    def available(self):
+        return self.fd is not None
+
+    def wait(self, timeout):
+        """
+        等待文件变化, 超时返回False
+        """
+        import select
+
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        # drain the events, the changed files are found by the next scan
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class MigrationWatcher(object):
+    """
+    常驻执行目录中的迁移文件: 文件变化后执行变化的文件, 定期重新查询模型并执行所有文件, 修正权限中心中模型的偏差
+    使用同一个Client, 模型数据保存在内存中, 未变化的操作不会调用iam接口
+    """
+
+    def __init__(
+        self,
+        client,
+        directory,
+        poll_interval=DEFAULT_WATCH_INTERVAL,
+        resync_interval=DEFAULT_RESYNC_INTERVAL,
+        retry_policy_factory=RetryPolicy,
+        batch_size=DEFAULT_BATCH_SIZE,
+        workers=DEFAULT_WORKERS,
+        journal_path=DEFAULT_JOURNAL_PATH,
+        stream_threshold=DEFAULT_STREAM_THRESHOLD,
+        optimize=True,
+        prune=False,
+        placeholders=None,
+    ):
+        self.client = client
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.resync_interval = resync_interval
+        # each round of the migration has its own retry budget and deadline
+        self.retry_policy_factory = retry_policy_factory
+        self.batch_size = batch_size
+        self.workers = workers
+        self.journal_path = journal_path
+        self.stream_threshold = stream_threshold
+        self.optimize = optimize
+        self.prune = prune
+        self.placeholders = placeholders
+        # data_file => (mtime_ns, size, file hash)
+        self.files = {}
+        # the files failed to apply, applied again in the next round even if not changed
+        self.pending = set()
+
+    def scan(self):
+        """
+        比较文件的修改时间及大小, 有变化时再比较文件内容hash
+
+        return: (changed, removed), 内容变化及新增的文件, 删除的文件
+        """
+        files = {}
+        changed = []
+        for data_file in list_data_files(json_data_dir=self.directory):
+            try:
+                stat = os.stat(data_file)
+            except OSError:
+                continue
+            state = self.files.get(data_file)
+            if state and state[:2] == (stat.st_mtime_ns, stat.st_size):
+                files[data_file] = state
+                continue
+            digest = file_hash(data_file)
+            files[data_file] = (stat.st_mtime_ns, stat.st_size, digest)
+            if not state or state[2] != digest:
+                changed.append(data_file)
+        removed = sorted(set(self.files) - set(files))
+        self.files = files
+        self.pending &= set(files)
+        return changed, removed
+
+    def apply(self, data_files):
+        """
+        校验目录中的所有迁移文件, 只执行指定的文件; 执行失败的文件保留在pending中, 下一轮再次执行
+        """
+        start = time.time()
+        # marked as succeeded only after all files applied
+        self.pending.update(data_files)
+        data_list, _, unresolved_refs, declared = prepare_data_list(
+            sorted(self.files), self.stream_threshold, optimize=False, placeholders=self.placeholders
+        )
+        if data_list is None:
+            return False
+
+        # the writes are merged within the executed files only, the others had been applied
+        data_list = [(data_file, data) for data_file, data in data_list if data_file in data_files]
+        if self.optimize and data_list:
+            completed = completed_operations(self.journal_path, data_files, self.placeholders)
+            data_list = optimize_data_list(data_list, completed)[0]
+
+        self.client.retry_policy = self.retry_policy_factory()
+        try:
+            ok = migrate_files(
+                self.client,
+                data_list,
+                batch_size=self.batch_size,
+                workers=self.workers,
+                journal_path=self.journal_path,
+                unresolved_refs=unresolved_refs,
+                placeholders=self.placeholders,
+            )
+            if ok and self.prune:
+                for system_id in sorted(declared):
+                    ok = prune_models(self.client, system_id, declared) and ok
+        finally:
+            self.client.metrics.print_report()
+            self.client.metrics.reset()
+        if ok:
+            self.pending.difference_update(data_files)
+        result = "success" if ok else "fail"
+        print("apply %d migration files %s in %.3fs" % (len(data_list), result, time.time() - start))
+        return ok
+
+    def resync(self):
+        # the models are queried again on the next migration
+        self.client.model_system_id = None
+        return self.apply(sorted(self.files))
+
+    def run(self):
+        inotify = _Inotify(self.directory)
+        print(
+            "watch migration files in [%s] with %s, %s"
+            % (
+                self.directory,
+                "inotify" if inotify.available else "polling every %ss" % self.poll_interval,
+                "resync the models every %ss" % self.resync_interval if self.resync_interval else "resync disabled",
+            )
+        )
+        try:
+            self.scan()
+            self.resync()
+            resync_at = time.time() + self.resync_interval
+            while True:
+                if not inotify.available:
+                    time.sleep(self.poll_interval)
+                elif inotify.wait(self.poll_interval):
+                    # the editors may write a file in several steps
+                    time.sleep(WATCH_DEBOUNCE)
+                    inotify.wait(0)
+
+                changed, removed = self.scan()
+                if self.resync_interval and time.time() >= resync_at:
+                    print("resync the models of iam")
+                    self.resync()
+                    resync_at = time.time() + self.resync_interval
+                elif changed or self.pending or (removed and self.prune):
+                    for data_file in changed:
+                        print("migration file [%s] changed" % data_file)
+                    for data_file in removed:
+                        print("migration file [%s] removed" % data_file)
+                    for data_file in sorted(self.pending - set(changed)):
+                        print("migration file [%s] failed in the last round, apply again" % data_file)
+                    self.apply(sorted(self.pending | set(changed)))
+        except KeyboardInterrupt:
+            print("stop watching")
+        finally:
+            inotify.close()
+
+
+# =================== migration driver ===================
+
+
+def normalize_iam_host(bk_iam_host):
+    bk_iam_host = (bk_iam_host or DEFAULT_BK_IAM_HOST).rstrip("/")
+    if not bk_iam_host.startswith(("http://", "https://")):
+        bk_iam_host = "http://%s" % bk_iam_host
+    return bk_iam_host
+
+
+def prepare_data_list(
+    data_files,
+    stream_threshold=DEFAULT_STREAM_THRESHOLD,
+    ledger=None,
+    force=False,
+    optimize=True,
+    offline=False,
+    placeholders=None,
+    journal_path=None,
+):
+    """
+    加载并校验所有迁移文件, 跳过已执行且未变化的文件, 合并冗余的写操作
+
+    offline: 离线校验, 迁移文件中未声明的引用视为错误
+    placeholders: 加载时替换迁移文件中的占位符
+    journal_path: 重试时从中读取上次已完成的操作, 不合并到已完成的操作中
+    return: (data_list, skipped, unresolved_refs, declared), 加载或校验失败时data_list为None
+        declared: 所有迁移文件(包括跳过的)执行后存在的模型, 见declared_models
+    """
+    data_list = []
+    for data_file in data_files:
+        data = load_migration_data(data_file, stream_threshold, placeholders)
+        if not data:
+            print("load migration file [%s] fail" % data_file)
+            return None, [], [], {}
+        data_list.append((data_file, data))
+
+    # validate all migration files before any network call
+    declared = declared_models(data_list, with_data=False)
+    errors, unresolved_refs = validate_data_list(data_list, declared=declared)
+    if offline:
+        errors.extend(ref[3] for ref in unresolved_refs)
+    if errors:
+        print_validation_errors(errors)
+        return None, [], unresolved_refs, declared
+
+    # skip the files which had been applied successfully and not changed since then
+    skipped = []
+    if ledger and not force:
+        skipped = [data_file for data_file, data in data_list if ledger.is_applied(data_file, data)]
+        for data_file in skipped:
+            print("skip migrate [%s], it has been applied and not changed" % data_file)
+        data_list = [(data_file, data) for data_file, data in data_list if data_file not in skipped]
+
+    # merge the redundant writes of all migration files
+    if optimize and data_list:
+        completed = completed_operations(journal_path, [data_file for data_file, _ in data_list], placeholders)
+        data_list, merged, superseded = optimize_data_list(data_list, completed)
+        if merged or superseded:
+            print(
+                "optimize migration plan: %d writes merged into the first write of the same model, "
+                "%d config writes superseded by the later ones" % (merged, superseded)
+            )
+    return data_list, skipped, unresolved_refs, declared
+
+
+def migrate_system(
+    bk_iam_host,
+    app_code,
+    app_secret,
+    json_data_files=None,
+    json_data_dir=None,
+    use_apigateway=DEFAULT_USE_APIGATEWAY,
+    batch_size=DEFAULT_BATCH_SIZE,
+    batch_max_bytes=DEFAULT_BATCH_MAX_BYTES,
+    batch_target_latency=DEFAULT_BATCH_TARGET_LATENCY,
+    gzip=False,
+    workers=DEFAULT_WORKERS,
+    force=False,
+    ledger_path=DEFAULT_LEDGER_PATH,
+    ledger_mirror_path=None,
+    journal_path=DEFAULT_JOURNAL_PATH,
+    use_async=False,
+    concurrency=DEFAULT_CONCURRENCY,
+    connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+    read_timeout=DEFAULT_READ_TIMEOUT,
+    max_retries=DEFAULT_MAX_RETRIES,
+    retry_budget=DEFAULT_RETRY_BUDGET,
+    deadline=DEFAULT_DEADLINE,
+    optimize=True,
+    stream_threshold=DEFAULT_STREAM_THRESHOLD,
+    metrics_ndjson=None,
+    rate_limit=DEFAULT_RATE_LIMIT,
+    rate_burst=None,
+    transport=DEFAULT_TRANSPORT,
+    pool_size=DEFAULT_POOL_SIZE,
+    prune=False,
+    readiness_path=DEFAULT_READINESS_PATH,
+    readiness_ttl=DEFAULT_READINESS_TTL,
+    readiness_timeout=DEFAULT_READINESS_TIMEOUT,
+    variables=None,
+    rate_limiter=None,
+    print_report=True,
+):
+    """
+    执行一组迁移文件, 配置及运行状态都在本次调用内, 同一进程中可并发执行多个
+    参数与命令行参数同名; rate_limiter可由多个调用共享, 未指定时按rate_limit/rate_burst创建
+    prune: 迁移成功后删除权限中心中未在迁移文件中声明的操作/实例视图/资源类型
+    variables: 迁移文件中占位符的值, 见Placeholders
+
+    return: {"ok", "message", "files": [{"file", "system_id", "status"}], "metrics", "elapsed"}
+        status: applied, skipped(已执行且未变化), failed, pending(之前的文件失败, 未执行)
+    """
+    start = time.time()
+    result = {"ok": False, "message": "", "files": [], "metrics": {}, "elapsed": 0}
+    data_files = list_data_files(json_data_files, json_data_dir)
+    if not data_files:
+        result["message"] = "no migration file to execute"
+        return result
+
+    bk_iam_host = normalize_iam_host(bk_iam_host)
+    placeholders = Placeholders(variables)
+    ledger = MigrationLedger(ledger_path, ledger_mirror_path, placeholders).load()
+    data_list, skipped, unresolved_refs, declared = prepare_data_list(
+        data_files, stream_threshold, ledger, force, optimize, placeholders=placeholders, journal_path=journal_path
+    )
+    if data_list is None:
+        result["message"] = "load or validate migration files fail"
+        return result
+
+    applied = []
+    metrics = CallMetrics(metrics_ndjson)
+    # the deadline of the migration starts from here
+    retry_policy = RetryPolicy(
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        max_retries=max_retries,
+        retry_budget=retry_budget,
+        deadline=deadline,
+    )
+    rate_limiter = rate_limiter or RateLimiter(rate_limit, rate_burst)
+    readiness = ReadinessProbe(bk_iam_host, readiness_path, readiness_ttl, readiness_timeout)
+
+    def new_batch_chunker():
+        return BatchChunker.for_batch_size(batch_size, max_bytes=batch_max_bytes, target_latency=batch_target_latency)
+
+    def new_client():
+        # all files share one client, the models of the system will be queried only once
+        return Client(
+            app_code,
+            app_secret,
+            bk_iam_host,
+            retry_policy=retry_policy,
+            metrics=metrics,
+            transport=new_transport(transport, max(pool_size, workers)),
+            batch_chunker=new_batch_chunker(),
+            gzip=gzip,
+            rate_limiter=rate_limiter,
+            concurrency_limiter=AdaptiveConcurrency(workers),
+            use_apigateway=use_apigateway,
+            readiness=readiness,
+        )
+
+    client = None
+    try:
+        if not data_list:
+            print("all migration files have been applied, nothing to do")
+            ok = True
+        elif use_async:
+            import asyncio
+
+            ok = asyncio.run(
+                async_migrate_files(
+                    data_list,
+                    bk_iam_host,
+                    app_code,
+                    app_secret,
+                    concurrency,
+                    ledger=ledger,
+                    journal_path=journal_path,
+                    unresolved_refs=unresolved_refs,
+                    retry_policy=retry_policy,
+                    metrics=metrics,
+                    batch_chunker=new_batch_chunker(),
+                    gzip=gzip,
+                    rate_limiter=rate_limiter,
+                    use_apigateway=use_apigateway,
+                    applied=applied,
+                    readiness=readiness,
+                    placeholders=placeholders,
+                )
+            )
+        else:
+            client = new_client()
+            ok = migrate_files(
+                client,
+                data_list,
+                batch_size=batch_size,
+                workers=workers,
+                ledger=ledger,
+                journal_path=journal_path,
+                unresolved_refs=unresolved_refs,
+                applied=applied,
+                placeholders=placeholders,
+            )
+
+        pruned = True
+        if ok and prune:
+            # the asyncio client has been closed, the models of the system are queried again by a sync client
+            client = client or new_client()
+            for system_id in sorted(declared):
+                pruned = prune_models(client, system_id, declared)
+                if not pruned:
+                    break
+    finally:
+        if print_report:
+            metrics.print_report()
+        metrics.close()
+
+    system_ids = {data_file: data.get("system_id") for data_file, data in data_list}
+    failed = None if ok else next((f for f, _ in data_list if f not in applied), None)
+    for data_file in data_files:
+        if data_file in skipped:
+            status = "skipped"
+        elif data_file in applied:
+            status = "applied"
+        else:
+            status = "failed" if data_file == failed else "pending"
+        result["files"].append({"file": data_file, "system_id": system_ids.get(data_file), "status": status})
+
+    if ok and not pruned:
+        ok, failed_message = False, "prune the stale models fail"
+    else:
+        failed_message = "do migrate [%s] fail" % failed
+    result.update(
+        ok=ok,
+        message="" if ok else failed_message,
+        metrics=metrics.summary(),
+        elapsed=round(time.time() - start, 3),
+    )
+    return result
+
+
+def _safe_name(name):
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+def migrate_many(systems, max_workers=None, use_processes=False, rate_limiter=None):
+    """
+    并发执行多个系统(如多个租户)的迁移, 每个系统使用独立的Client及运行状态, 返回合并的结果
+    未指定ledger_path/journal_path的系统使用按名称区分的记录文件, 互不影响
+
+    systems: [{"name": 名称, 其余为migrate_system的参数}]
+    use_processes: 使用进程池执行, 进程间不能共享rate_limiter, 每个系统按自己的rate_limit限流
+    rate_limiter: 线程池执行时所有系统共享的RateLimiter, 如同一个app code的配额
+    return: {"ok", "systems": {name: migrate_system的结果}, "metrics": 所有系统合计}
+    """
+    tasks = []
+    for index, settings in enumerate(systems):
+        settings = dict(settings)
+        name = str(settings.pop("name", None) or index)
+        if name in dict(tasks):
+            raise ValueError("duplicate system name: %s" % name)
+        settings.setdefault("ledger_path", "%s.%s" % (DEFAULT_LEDGER_PATH, _safe_name(name)))
+        settings.setdefault("journal_path", "%s.%s" % (DEFAULT_JOURNAL_PATH, _safe_name(name)))
+        # the reports of the systems running concurrently would be interleaved, summaries are returned instead
+        settings.setdefault("print_report", False)
+        if rate_limiter is not None and not use_processes:
+            settings.setdefault("rate_limiter", rate_limiter)
+        tasks.append((name, settings))
+
+    results = {}
+    if tasks:
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        with executor_class(max_workers=max_workers or len(tasks)) as executor:
+            futures = [(name, executor.submit(migrate_system, **settings)) for name, settings in tasks]
+            for name, future in futures:
+                try:
+                    results[name] = future.result()
+                except Exception as error:
+                    results[name] = {
+                        "ok": False,
+                        "message": "migrate raise exception: %s" % error,
+                        "files": [],
+                        "metrics": {},
+                        "elapsed": 0,
+                    }
+
+    metrics = {}
+    for result in results.values():
+        for key, value in result["metrics"].items():
+            metrics[key] = round(metrics.get(key, 0) + value, 3)
+    return {"ok": all(r["ok"] for r in results.values()), "systems": results, "metrics": metrics}
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser()
+    p.add_argument(
+        "-t",
+        action="store",
+        dest="bk_iam_host",
+        help=(
+            "bk_iam_host, i.e: http://iam.service.consul;"
+            "you can use bk_apigateway_url here, set with the '--apigateway' "
+        ),
+    )
+    files_group = p.add_mutually_exclusive_group(required=True)
+    files_group.add_argument(
+        "-f",
+        action="append",
+        dest="json_data_files",
+        help=(
+            "which migration file to execute, i.e: 00001_bk_cmdb_20190618100210.json; "
+            "can be set multiple times, the files will be executed in the given order"
+        ),
+    )
+    files_group.add_argument(
+        "-d",
+        action="store",
+        dest="json_data_dir",
+        help="execute all migration files(*.json) in the directory, ordered by file name",
+    )
+    files_group.add_argument(
+        "--watch",
+        action="store",
+        dest="watch_dir",
+        help=(
+            "keep running, execute the migration files(*.json) in the directory once changed, "
+            "and all of them again every --resync-interval seconds to fix the models changed in iam"
+        ),
+    )
+    p.add_argument("-a", action="store", dest="app_code", help="app code")
+    p.add_argument("-s", action="store", dest="app_secret", help="app secret")
+
+    p.add_argument(
+        "--apigateway",
+        action="store_true",
+        dest="use_apigateway",
+        help="you can use bk_apigateway_url in '-t', should set this flag",
+    )
+    p.add_argument(
+        "--batch-size",
+        action="store",
+        dest="batch_size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=(
+            "merge consecutive add/delete operations of the same kind into batch api calls, "
+            "with at most batch_size items per call; default is %d(no batch)" % DEFAULT_BATCH_SIZE
+        ),
+    )
+    p.add_argument(
+        "--batch-max-bytes",
+        action="store",
+        dest="batch_max_bytes",
+        type=int,
+        default=DEFAULT_BATCH_MAX_BYTES,
+        help="the max serialized size(bytes) of the items sent by one batch api call, default: %(default)s",
+    )
+    p.add_argument(
+        "--batch-target-latency",
+        action="store",
+        dest="batch_target_latency",
+        type=float,
+        default=DEFAULT_BATCH_TARGET_LATENCY,
+        help=(
+            "the batch api calls start with %d items, the number doubles while the latency(seconds) is below half "
+            "of this and halves once above it or after a 413/timeout; default: %%(default)s"
+            % DEFAULT_BATCH_INITIAL_ITEMS
+        ),
+    )
+    p.add_argument(
+        "--gzip",
+        action="store_true",
+        dest="gzip",
+        help="compress the request bodies with gzip, only if the iam service or the gateway accepts it",
+    )
+    p.add_argument(
+        "--workers",
+        action="store",
+        dest="workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=(
+            "the number of threads to execute independent operations concurrently, "
+            "with --batch-size the independent add/delete operations of the same kind are merged into batch calls; "
+            "default is %d(sequential)" % DEFAULT_WORKERS
+        ),
+    )
+    p.add_argument(
+        "--validate",
+        action="store_true",
+        dest="validate",
+        help="only validate the migration files offline, all references should be declared in the migration files",
+    )
+    p.add_argument(
+        "--plan",
+        action="store_true",
+        dest="plan",
+        help="only print the http calls which would be made, grouped by add/update/delete/skip, without any write",
+    )
+    p.add_argument(
+        "--snapshot",
+        action="store",
+        dest="snapshot_file",
+        help="with '--plan', use the saved api_query response instead of querying iam, the plan will be fully offline",
+    )
+    p.add_argument(
+        "--force",
+        action="store_true",
+        dest="force",
+        help="execute all migration files, even if they have been applied and not changed",
+    )
+    p.add_argument(
+        "--ledger",
+        action="store",
+        dest="ledger_path",
+        default=DEFAULT_LEDGER_PATH,
+        help="the local file to record the applied migration files, default is %s" % DEFAULT_LEDGER_PATH,
+    )
+    p.add_argument(
+        "--ledger-mirror",
+        action="store",
+        dest="ledger_mirror_path",
+        help="mirror the ledger to this file too, i.e: a file in a persistent volume",
+    )
+    p.add_argument(
+        "--journal",
+        action="store",
+        dest="journal_path",
+        default=DEFAULT_JOURNAL_PATH,
+        help=(
+            "the file to record the completed operations, the failed migration will resume from the first "
+            "incomplete operation; set it to empty to disable, default is %s" % DEFAULT_JOURNAL_PATH
+        ),
+    )
+    p.add_argument(
+        "--async",
+        action="store_true",
+        dest="use_async",
+        help="execute the migration with an asyncio client, the independent operations are executed concurrently",
+    )
+    p.add_argument(
+        "--concurrency",
+        action="store",
+        dest="concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="the max number of in-flight iam api calls in '--async' mode, default is %d" % DEFAULT_CONCURRENCY,
+    )
+    p.add_argument(
+        "--connect-timeout",
+        action="store",
+        dest="connect_timeout",
+        type=float,
+        default=DEFAULT_CONNECT_TIMEOUT,
+        help="the connect timeout(seconds) of the iam api calls, default is %s" % DEFAULT_CONNECT_TIMEOUT,
+    )
+    p.add_argument(
+        "--read-timeout",
+        action="store",
+        dest="read_timeout",
+        type=float,
+        default=DEFAULT_READ_TIMEOUT,
+        help="the read timeout(seconds) of the iam api calls, default is %s" % DEFAULT_READ_TIMEOUT,
+    )
+    p.add_argument(
+        "--max-retries",
+        action="store",
+        dest="max_retries",
+        type=int,
+        default=DEFAULT_MAX_RETRIES,
+        help=(
+            "the max retries of an idempotent iam api call(GET/PUT/DELETE) on connection errors, timeouts, "
+            "429 and 5xx responses, default is %d" % DEFAULT_MAX_RETRIES
+        ),
+    )
+    p.add_argument(
+        "--retry-budget",
+        action="store",
+        dest="retry_budget",
+        type=int,
+        default=DEFAULT_RETRY_BUDGET,
+        help="the total retries of all iam api calls in the migration, default is %d" % DEFAULT_RETRY_BUDGET,
+    )
+    p.add_argument(
+        "--deadline",
+        action="store",
+        dest="deadline",
+        type=float,
+        default=DEFAULT_DEADLINE,
+        help="the deadline(seconds) of the whole migration, 0 means no deadline, default is %s" % DEFAULT_DEADLINE,
+    )
+    p.add_argument(
+        "--no-optimize",
+        action="store_false",
+        dest="optimize",
+        help="execute every operation as it is, do not merge the redundant writes of all migration files",
+    )
+    p.add_argument(
+        "--stream-threshold",
+        action="store",
+        dest="stream_threshold",
+        type=int,
+        default=DEFAULT_STREAM_THRESHOLD,
+        help="the migration files not smaller than this(bytes) are parsed incrementally, 0 means all files, "
+        "default: %(default)s",
+    )
+    p.add_argument(
+        "--metrics-ndjson",
+        action="store",
+        dest="metrics_ndjson",
+        help="append the latency record of every iam api call to this file as newline-delimited json",
+    )
+    p.add_argument(
+        "--rate-limit",
+        action="store",
+        dest="rate_limit",
+        type=float,
+        default=DEFAULT_RATE_LIMIT,
+        help=(
+            "the max iam api calls per second, i.e: the quota of the app code in the gateway; "
+            "default: %(default)s(no limit)"
+        ),
+    )
+    p.add_argument(
+        "--rate-burst",
+        action="store",
+        dest="rate_burst",
+        type=float,
+        default=None,
+        help="the max burst of iam api calls allowed by the rate limit, default is the same as --rate-limit",
+    )
+    p.add_argument(
+        "--transport",
+        action="store",
+        dest="transport",
+        choices=(HTTPClientTransport.name, RequestsTransport.name),
+        default=DEFAULT_TRANSPORT,
+        help="the http transport of the iam api calls, default is requests if it is installed, "
+        "httpclient uses the standard library only, default: %(default)s",
+    )
+    p.add_argument(
+        "--pool-size",
+        action="store",
+        dest="pool_size",
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help="the max number of keep-alive connections to iam, default is %d" % DEFAULT_POOL_SIZE,
+    )
+    p.add_argument(
+        "--prune",
+        action="store_true",
+        dest="prune",
+        help=(
+            "after the migration, delete the actions, instance selections and resource types in iam "
+            "which are not declared in the migration files; list them only with --plan"
+        ),
+    )
+    p.add_argument(
+        "--hash-tree",
+        action="store",
+        dest="hash_tree_file",
+        help=(
+            "export the content hashes of the models declared in the migration files to the file, "
+            "and of the models in iam and the changed ones if '-t' or --snapshot is given; "
+            "should not be named as *.json in the directory of the migration files"
+        ),
+    )
+    p.add_argument(
+        "--watch-interval",
+        action="store",
+        dest="watch_interval",
+        type=float,
+        default=DEFAULT_WATCH_INTERVAL,
+        help="the interval(seconds) to check the migration files with --watch, default: %(default)s",
+    )
+    p.add_argument(
+        "--resync-interval",
+        action="store",
+        dest="resync_interval",
+        type=float,
+        default=DEFAULT_RESYNC_INTERVAL,
+        help="the interval(seconds) to query the models again with --watch, 0 means never, default: %(default)s",
+    )
+    p.add_argument(
+        "--readiness-file",
+        action="store",
+        dest="readiness_path",
+        default=DEFAULT_READINESS_PATH,
+        help=(
+            "cache the readiness of iam in the file, the consecutive invocations in --readiness-ttl seconds "
+            "will not ping iam again, should not be named as *.json; default: %(default)s"
+        ),
+    )
+    p.add_argument(
+        "--readiness-ttl",
+        action="store",
+        dest="readiness_ttl",
+        type=float,
+        default=DEFAULT_READINESS_TTL,
+        help="the seconds the readiness of iam is cached, default: %(default)s",
+    )
+    p.add_argument(
+        "--readiness-timeout",
+        action="store",
+        dest="readiness_timeout",
+        type=float,
+        default=DEFAULT_READINESS_TIMEOUT,
+        help="the max seconds to wait for iam to be ready, default: %(default)s",
+    )
+    p.add_argument(
+        "--set",
+        action="append",
+        dest="variables",
+        metavar="NAME=VALUE",
+        help=(
+            "the value of the placeholder ${NAME} or ${NAME:-default} in the migration files, "
+            "the environment variable NAME is used if not set; can be set multiple times"
+        ),
+    )
+    args = p.parse_args()
+    variables = {}
+    for variable in args.variables or []:
+        if "=" not in variable:
+            p.error("the argument --set should be NAME=VALUE: %s" % variable)
+        name, value = variable.split("=", 1)
+        variables[name] = value
+    args.variables = variables
+    if args.watch_dir and (args.validate or args.plan or args.hash_tree_file or args.use_async):
+        p.error("the argument --watch could not be used with --validate, --plan, --hash-tree or --async")
+    if args.snapshot_file and not (args.plan or args.hash_tree_file):
+        p.error("the argument --snapshot should be used with --plan or --hash-tree")
+    # the offline validation, plan and hash tree do not need to access iam
+    offline_hash_tree = args.hash_tree_file and (args.snapshot_file or not args.bk_iam_host)
+    if not (args.validate or offline_hash_tree or (args.plan and args.snapshot_file)):
+        for arg, name in ((args.bk_iam_host, "-t"), (args.app_code, "-a"), (args.app_secret, "-s")):
+            if not arg:
+                p.error("the following arguments are required: %s" % name)
+
+    if args.use_apigateway:
+        print(
+            "use apigateway:",
+            args.use_apigateway,
+            ", please make sure '-t %s' is a valid bk_apigateway_url" % args.bk_iam_host,
+        )
+
+    readiness = ReadinessProbe(
+        normalize_iam_host(args.bk_iam_host), args.readiness_path, args.readiness_ttl, args.readiness_timeout
+    )
+    if args.watch_dir:
+        # the pod is stopped by SIGTERM
+        signal.signal(signal.SIGTERM, lambda signum, frame: exit(0))
+        watcher = MigrationWatcher(
+            Client(
+                args.app_code,
+                args.app_secret,
+                normalize_iam_host(args.bk_iam_host),
+                metrics=CallMetrics(args.metrics_ndjson),
+                transport=new_transport(args.transport, max(args.pool_size, args.workers)),
+                batch_chunker=BatchChunker.for_batch_size(
+                    args.batch_size, max_bytes=args.batch_max_bytes, target_latency=args.batch_target_latency
+                ),
+                gzip=args.gzip,
+                rate_limiter=RateLimiter(args.rate_limit, args.rate_burst),
+                concurrency_limiter=AdaptiveConcurrency(args.workers),
+                use_apigateway=args.use_apigateway,
+                readiness=readiness,
+            ),
+            args.watch_dir,
+            poll_interval=args.watch_interval,
+            resync_interval=args.resync_interval,
+            retry_policy_factory=lambda: RetryPolicy(
+                connect_timeout=args.connect_timeout,
+                read_timeout=args.read_timeout,
+                max_retries=args.max_retries,
+                retry_budget=args.retry_budget,
+                deadline=args.deadline,
+            ),
+            batch_size=args.batch_size,
+            workers=args.workers,
+            journal_path=args.journal_path,
+            stream_threshold=args.stream_threshold,
+            optimize=args.optimize,
+            prune=args.prune,
+            placeholders=Placeholders(args.variables),
+        )
+        watcher.run()
+        exit(0)
+
+    if not (args.validate or args.plan or args.hash_tree_file):
+        settings = vars(args).copy()
+        for name in (
+            "validate",
+            "plan",
+            "snapshot_file",
+            "hash_tree_file",
+            "watch_dir",
+            "watch_interval",
+            "resync_interval",
+        ):
+            settings.pop(name)
+        result = migrate_system(**settings)
+        if result["message"]:
+            print(result["message"])
+        exit(0 if result["ok"] else 1)
+
+    data_files = list_data_files(args.json_data_files, args.json_data_dir)
+    if not data_files:
+        print("no migration file to execute")
+        exit(1)
+
+    placeholders = Placeholders(args.variables)
+    ledger = None
+    if not (args.validate or args.hash_tree_file):
+        ledger = MigrationLedger(args.ledger_path, args.ledger_mirror_path, placeholders).load()
+    data_list, _, unresolved_refs, declared = prepare_data_list(
+        data_files,
+        args.stream_threshold,
+        ledger=ledger,
+        force=args.force,
+        optimize=args.optimize and not (args.validate or args.hash_tree_file),
+        offline=args.validate,
+        placeholders=placeholders,
+    )
+    if data_list is None:
+        exit(1)
+    if args.validate:
+        print("validate migration files success!")
+        exit(0)
+    if not (data_list or args.prune):
+        print("all migration files have been applied, nothing to do")
+        exit(0)
+
+    bk_iam_host = normalize_iam_host(args.bk_iam_host)
+    snapshot = None
+    if args.snapshot_file:
+        snapshot = load_snapshot(args.snapshot_file)
+        if not snapshot:
+            exit(1)
+
+    if args.hash_tree_file:
+        client = None
+        if snapshot is not None or args.bk_iam_host:
+            client = PlanClient(
+                args.app_code,
+                args.app_secret,
+                bk_iam_host,
+                snapshot=snapshot,
+                transport=new_transport(args.transport),
+                use_apigateway=args.use_apigateway,
+            )
+        trees = export_hash_trees(data_list, client)
+        with open(args.hash_tree_file, "w") as f:
+            json.dump(trees, f, indent=2, sort_keys=True)
+        for system_id, tree in trees.items():
+            if "changed" in tree:
+                changed = sum(len(ids) for ids in tree["changed"].values())
+                print("export hash tree of [%s], %d models changed" % (system_id, changed))
+            else:
+                print("export hash tree of [%s]" % system_id)
+        exit(0)
+    client = PlanClient(
+        args.app_code,
+        args.app_secret,
+        bk_iam_host,
+        snapshot=snapshot,
+        retry_policy=RetryPolicy(
+            connect_timeout=args.connect_timeout,
+            read_timeout=args.read_timeout,
+            max_retries=args.max_retries,
+            retry_budget=args.retry_budget,
+            deadline=args.deadline,
+        ),
+        transport=new_transport(args.transport),
+        batch_chunker=BatchChunker.for_batch_size(
+            args.batch_size, max_bytes=args.batch_max_bytes, target_latency=args.batch_target_latency
+        ),
+        use_apigateway=args.use_apigateway,
+        readiness=readiness,
+    )
+    # the models will be queried from iam if no snapshot
+    if snapshot is None and not client.wait_ready():
+        print("iam service is not available: %s" % bk_iam_host)
+        exit(1)
+
+    errors = check_refs_with_models(client, unresolved_refs)
+    if errors:
+        print_validation_errors(errors)
+        exit(1)
+
+    for data_file, data in data_list:
+        print("plan migrate [%s]" % data_file)
+        client.data_file = data_file
+        if not do_migrate(data, client=client, batch_size=args.batch_size):
+            print("plan migrate [%s] fail" % data_file)
+            exit(1)
+    # the stale models are listed, and the batch deletes are added to the plan
+    if args.prune:
+        for system_id in sorted(declared):
+            prune_models(client, system_id, declared)
+    client.print_plan()
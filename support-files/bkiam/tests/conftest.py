@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+BKIAM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BKIAM_DIR)
+sys.path.insert(0, os.path.join(BKIAM_DIR, "benchmark"))
+
+import do_migrate  # noqa: E402
+from bench_migrate import FakeIAMState  # noqa: E402
+
+SYSTEM_ID = "bk-repo-test"
+
+
+class AsyncMemoryTransport(do_migrate.MemoryTransport):
+    """
+    MemoryTransport的asyncio版本, 用于AsyncClient
+    """
+
+    async def request(self, method, url, headers=None, body=None, timeout=None):
+        return super(AsyncMemoryTransport, self).request(method, url, headers=headers, body=body, timeout=timeout)
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_iam():
+    """
+    与benchmark共用的模拟权限中心, 作为MemoryTransport的handler, 模型保存在 fake_iam.systems[SYSTEM_ID] 中
+    """
+    return FakeIAMState()
+
+
+@pytest.fixture
+def new_client(fake_iam):
+    """
+    创建使用MemoryTransport访问fake_iam(或指定的handler)的Client, 不缓存权限中心的可用状态
+    """
+
+    def new_client(client_class=do_migrate.Client, handler=None, **kwargs):
+        kwargs.setdefault("transport", do_migrate.MemoryTransport(handler=handler or fake_iam))
+        kwargs.setdefault("readiness", do_migrate.ReadinessProbe("http://iam.test"))
+        return client_class("app", "secret", "http://iam.test", **kwargs)
+
+    return new_client
+
+
+@pytest.fixture
+def new_async_client(fake_iam):
+    """
+    创建使用AsyncMemoryTransport访问fake_iam(或指定的handler)的AsyncClient
+    """
+
+    def new_async_client(handler=None, **kwargs):
+        kwargs.setdefault("readiness", do_migrate.ReadinessProbe("http://iam.test"))
+        client = do_migrate.AsyncClient("app", "secret", "http://iam.test", **kwargs)
+        client.transport = AsyncMemoryTransport(handler=handler or fake_iam)
+        return client
+
+    return new_async_client
+
+
+def iam_models(fake_iam, kind="actions", system_id=SYSTEM_ID):
+    """
+    fake_iam中指定系统的模型, id => data
+    """
+    return fake_iam.systems[system_id][kind]
+
+
+def migration_data(operations, system_id=SYSTEM_ID):
+    """
+    包含upsert_system及指定操作的迁移数据
+    """
+    system = {"operation": "upsert_system", "data": {"id": system_id, "name": "test", "clients": system_id}}
+    return {"system_id": system_id, "operations": [system] + list(operations)}
+
+
+def action(action_id, **data):
+    return {"operation": "upsert_action", "data": dict(data, id=action_id, name=action_id)}
+
+
+def write_json(path, data):
+    with open(str(path), "w") as f:
+        json.dump(data, f)
+    return str(path)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import asyncio
+import inspect
+import time
+
+import do_migrate
+from conftest import action, iam_models, migration_data
+
+
+def test_async_client_shares_the_client_setup():
+    rate_limiter = do_migrate.RateLimiter(10)
+    client = do_migrate.AsyncClient("app", "secret", "http://iam.test", concurrency=3, rate_limiter=rate_limiter)
+
+    assert client.concurrency == 3
+    assert client.concurrency_limiter.max_concurrency == 3
+    assert client.rate_limiter is rate_limiter
+    assert client.model_system_id is None
+    assert isinstance(client.transport, do_migrate.AsyncHTTPTransport)
+
+
+def test_async_migrate(fake_iam, new_async_client):
+    client = new_async_client()
+    data = migration_data([action("a%d" % i) for i in range(3)])
+
+    assert asyncio.run(do_migrate.async_do_migrate(data, client))
+    assert sorted(iam_models(fake_iam)) == ["a0", "a1", "a2"]
+
+
+def test_async_rejected_batch_is_split(fake_iam, new_async_client):
+    def handler(method, path, data):
+        if method == "POST" and isinstance(data, list) and len(data) > 2:
+            return 413, {"code": 413, "message": "request entity too large"}
+        return fake_iam(method, path, data)
+
+    client = new_async_client(handler, batch_chunker=do_migrate.BatchChunker(initial_items=8))
+    assert asyncio.run(do_migrate.async_do_migrate(migration_data([]), client))
+    data_list = [{"id": "a%d" % i, "name": "a%d" % i} for i in range(7)]
+
+    ok, _ = asyncio.run(client.do_batch_operation("add_action", "bk-repo-test", data_list))
+
+    assert ok
+    assert sorted(iam_models(fake_iam)) == sorted(d["id"] for d in data_list)
+    sent = [len(data) for method, _, data in client.transport.requests if method == "POST" and len(data) <= 2]
+    assert sum(sent) == len(data_list)
+    assert client.model_ids("action") == set(iam_models(fake_iam))
+
+
+def test_async_non_json_response_is_an_error():
+    class HTMLTransport(object):
+        async def request(self, method, url, headers=None, body=None, timeout=None):
+            return 200, b"<html>bad gateway</html>", {"content-type": "text/html"}
+
+    ok, data = asyncio.run(do_migrate.async_http_request(HTMLTransport(), "GET", "http://iam.test/ping"))
+
+    assert not ok
+    assert data["error"].startswith("invalid json response")
+    assert data["status_code"] == 200
+
+
+def test_adaptive_concurrency_wakes_the_waiting_tasks():
+    limiter = do_migrate.AdaptiveConcurrency(2)
+    peak = []
+
+    async def call():
+        await limiter.async_acquire()
+        peak.append(limiter.in_flight)
+        await asyncio.sleep(0.01)
+        await limiter.async_release({"status": 200})
+
+    async def main():
+        await asyncio.gather(*[call() for _ in range(20)])
+
+    start = time.time()
+    asyncio.run(main())
+
+    assert max(peak) == 2
+    assert limiter.in_flight == 0
+    # 10 rounds of 0.01s, the waiting tasks are woken by the releases
+    assert time.time() - start < 0.5
+
+
+def _api_args(func):
+    return {name: "%s-value" % name for name in inspect.signature(func).parameters if name != "data"}
+
+
+def test_clients_share_the_api_table(new_client, new_async_client):
+    sync_client = new_client()
+    async_client = new_async_client()
+
+    async def call_async_apis():
+        for name in do_migrate.IAM_APIS:
+            func = getattr(async_client, "api_%s" % name)
+            await func(**dict(_api_args(func), **({} if name == "query" else {"data": {"id": "x"}})))
+
+    for name in do_migrate.IAM_APIS:
+        func = getattr(sync_client, "api_%s" % name)
+        func(**dict(_api_args(func), **({} if name == "query" else {"data": {"id": "x"}})))
+    asyncio.run(call_async_apis())
+
+    assert len(sync_client.transport.requests) == len(do_migrate.IAM_APIS)
+    assert async_client.transport.requests == sync_client.transport.requests
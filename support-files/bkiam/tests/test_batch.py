@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import do_migrate
+from conftest import SYSTEM_ID, action, iam_models, migration_data
+
+
+def _writes(transport):
+    return [(method, path.split("?", 1)[0]) for method, path, _ in transport.requests if method != "GET"]
+
+
+def test_consecutive_adds_are_batched(fake_iam, new_client):
+    client = new_client()
+    data = migration_data([action("a%d" % i) for i in range(14)])
+
+    assert do_migrate.do_migrate(data, client=client, batch_size=5)
+
+    actions_path = "/api/v1/model/systems/%s/actions" % SYSTEM_ID
+    assert _writes(client.transport).count(("POST", actions_path)) == 3
+    assert sorted(iam_models(fake_iam)) == sorted("a%d" % i for i in range(14))
+    assert set(client.model_ids("action")) == set(iam_models(fake_iam))
+
+
+def test_batch_size_one_sends_every_add(new_client):
+    client = new_client()
+    data = migration_data([action("a%d" % i) for i in range(4)])
+
+    assert do_migrate.do_migrate(data, client=client, batch_size=1)
+
+    assert _writes(client.transport).count(("POST", "/api/v1/model/systems/%s/actions" % SYSTEM_ID)) == 4
+
+
+def test_updates_are_sent_one_by_one_and_deletes_batched(fake_iam, new_client):
+    client = new_client()
+    assert do_migrate.do_migrate(migration_data([action("a%d" % i) for i in range(4)]), client=client)
+
+    client = new_client()
+    operations = [action("a0", description="changed"), action("a1", description="changed")]
+    operations += [{"operation": "delete_action", "data": {"id": "a%d" % i}} for i in (2, 3)]
+    assert do_migrate.do_migrate(migration_data(operations), client=client, batch_size=10)
+
+    writes = _writes(client.transport)
+    assert writes.count(("PUT", "/api/v1/model/systems/%s/actions/a0" % SYSTEM_ID)) == 1
+    assert writes.count(("PUT", "/api/v1/model/systems/%s/actions/a1" % SYSTEM_ID)) == 1
+    assert writes.count(("DELETE", "/api/v1/model/systems/%s/actions" % SYSTEM_ID)) == 1
+    assert sorted(iam_models(fake_iam)) == ["a0", "a1"]
+    assert iam_models(fake_iam)["a0"]["description"] == "changed"
+
+
+def test_failed_batch_stops_the_migration(fake_iam, new_client):
+    def handler(method, path, data):
+        if method == "POST" and path.endswith("/actions"):
+            return 200, {"code": 1902409, "message": "conflict", "data": None}
+        return fake_iam(method, path, data)
+
+    client = new_client(handler=handler)
+    data = migration_data([action("a0"), action("a1"), {"operation": "delete_action", "data": {"id": "a0"}}])
+
+    assert not do_migrate.do_migrate(data, client=client, batch_size=10)
+    assert not any(method == "DELETE" for method, _ in _writes(client.transport))
+
+
+def _too_large(fake_iam, max_items):
+    """
+    超过max_items条的批量添加返回413
+    """
+
+    def handler(method, path, data):
+        if method == "POST" and isinstance(data, list) and len(data) > max_items:
+            return 413, {"code": 413, "message": "request entity too large"}
+        return fake_iam(method, path, data)
+
+    return handler
+
+
+def test_chunker_growth_is_capped():
+    chunker = do_migrate.BatchChunker(initial_items=4, target_latency=2.0, max_items=10)
+    for _ in range(5):
+        chunker.observe(True, {"status": 200, "network": 0.1}, 100)
+
+    assert chunker.limit == 10
+    assert chunker.next_chunk([1] * 30, 0) == 10
+
+
+def test_chunker_follows_the_batch_size():
+    assert do_migrate.BatchChunker.for_batch_size(5).limit == 5
+    assert do_migrate.BatchChunker.for_batch_size(1).max_items == do_migrate.DEFAULT_BATCH_MAX_ITEMS
+
+
+def test_chunker_splits_by_bytes():
+    chunker = do_migrate.BatchChunker(max_bytes=10, initial_items=5)
+
+    assert chunker.next_chunk([4, 4, 4, 20, 1], 0) == 2
+    # a large item is sent alone
+    assert chunker.next_chunk([4, 4, 4, 20, 1], 3) == 4
+
+
+def test_rejected_batch_is_split(fake_iam, new_client):
+    client = new_client(handler=_too_large(fake_iam, 3))
+    data = migration_data([action("a%d" % i) for i in range(8)])
+
+    assert do_migrate.do_migrate(data, client=client, batch_size=8)
+
+    assert sorted(iam_models(fake_iam)) == sorted("a%d" % i for i in range(8))
+    actions_path = "/api/v1/model/systems/%s/actions" % SYSTEM_ID
+    sent = [len(data) for method, path, data in client.transport.requests if (method, path) == ("POST", actions_path)]
+    assert sent[0] == 8
+    assert sum(n for n in sent if n <= 3) == 8
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+import do_migrate
+from conftest import BKIAM_DIR, SYSTEM_ID, action, migration_data, write_json
+
+MODELS = {
+    "action": {"a0": {"id": "a0", "name": "a0", "description": "d0"}, "a1": {"id": "a1", "name": "a1"}},
+    "resource_type": {"r0": {"id": "r0", "name": "r0"}},
+}
+
+
+def _models(**changes):
+    """
+    MODELS的副本, changes: {kind__id: data}, data为None时删除该模型
+    """
+    models = {kind: dict(entities) for kind, entities in MODELS.items()}
+    for key, data in changes.items():
+        kind, model_id = key.split("__")
+        if data is None:
+            models[kind].pop(model_id)
+        else:
+            models[kind][model_id] = data
+    return models
+
+
+# =================== build / diff ===================
+
+
+def test_hash_tree_ignores_the_key_order_and_the_empty_values():
+    tree = do_migrate.build_hash_tree(MODELS)
+    reordered = _models(action__a0={"description": "d0", "name": "a0", "id": "a0", "parent": [], "version": None})
+
+    assert do_migrate.build_hash_tree(reordered) == tree
+    assert sorted(tree["kinds"]) == ["action", "resource_type"]
+    assert sorted(tree["kinds"]["action"]["entities"]) == ["a0", "a1"]
+
+
+def test_hash_tree_changes_only_the_digests_of_the_changed_kind():
+    tree = do_migrate.build_hash_tree(MODELS)
+    changed = do_migrate.build_hash_tree(_models(action__a1={"id": "a1", "name": "renamed"}))
+
+    assert changed["digest"] != tree["digest"]
+    assert changed["kinds"]["action"]["digest"] != tree["kinds"]["action"]["digest"]
+    assert changed["kinds"]["action"]["entities"]["a0"] == tree["kinds"]["action"]["entities"]["a0"]
+    assert changed["kinds"]["resource_type"] == tree["kinds"]["resource_type"]
+
+
+def test_hash_tree_of_the_declared_fields():
+    live = _models(action__a0={"id": "a0", "name": "a0", "description": "d0", "auth_type": "rbac"})
+
+    assert do_migrate.build_hash_tree(live) != do_migrate.build_hash_tree(MODELS)
+    fields = {"action": {"a0": ["id", "name", "description"]}}
+    assert do_migrate.build_hash_tree(live, fields) == do_migrate.build_hash_tree(MODELS)
+
+
+def test_diff_hash_trees():
+    tree = do_migrate.build_hash_tree(MODELS)
+    assert do_migrate.diff_hash_trees(tree, tree) == {}
+
+    new = do_migrate.build_hash_tree(
+        _models(action__a0=None, action__a2={"id": "a2", "name": "a2"}, resource_type__r0={"id": "r0", "name": "x"})
+    )
+
+    # the removed, added and changed models
+    assert do_migrate.diff_hash_trees(tree, new) == {"action": ["a0", "a2"], "resource_type": ["r0"]}
+    assert do_migrate.diff_hash_trees(new, tree) == {"action": ["a0", "a2"], "resource_type": ["r0"]}
+
+
+def test_diff_skips_the_kinds_with_the_same_digest():
+    tree = do_migrate.build_hash_tree(MODELS)
+    new = do_migrate.build_hash_tree(_models(action__a1={"id": "a1", "name": "renamed"}))
+    # the entities of a kind are compared only if the digest of the kind differs
+    new["kinds"]["resource_type"]["entities"] = {}
+
+    assert do_migrate.diff_hash_trees(tree, new) == {"action": ["a1"]}
+
+
+# =================== export ===================
+
+
+def _data_list():
+    return [
+        ("0001_test.json", migration_data([action("a0", description="d0"), action("a1")])),
+        ("0002_test.json", migration_data([action("a1", description="changed")])),
+    ]
+
+
+def test_export_declared_and_live_hash_trees(fake_iam, new_client):
+    assert do_migrate.do_migrate(migration_data([action("a0", description="d0"), action("a1")]), client=new_client())
+
+    trees = do_migrate.export_hash_trees(_data_list(), new_client())
+
+    tree = trees[SYSTEM_ID]
+    assert sorted(tree) == ["changed", "declared", "live"]
+    # the later file changes a1
+    assert tree["changed"] == {"action": ["a1"]}
+    assert tree["declared"]["kinds"]["action"]["entities"]["a0"] == tree["live"]["kinds"]["action"]["entities"]["a0"]
+
+
+def test_export_declared_hash_tree_offline():
+    trees = do_migrate.export_hash_trees(_data_list())
+
+    assert sorted(trees[SYSTEM_ID]) == ["declared"]
+    assert sorted(trees[SYSTEM_ID]["declared"]["kinds"]["action"]["entities"]) == ["a0", "a1"]
+
+
+def _run(tmp_path, *args):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir(exist_ok=True)
+    for data_file, data in _data_list():
+        write_json(data_dir / data_file, data)
+    tree_file = str(tmp_path / "tree")
+    output = subprocess.check_output(
+        [sys.executable, os.path.join(BKIAM_DIR, "do_migrate.py"), "-d", str(data_dir), "--hash-tree", tree_file]
+        + list(args),
+        cwd=str(tmp_path),
+        universal_newlines=True,
+    )
+    with open(tree_file) as f:
+        return output, json.load(f)
+
+
+def test_hash_tree_command(tmp_path):
+    output, trees = _run(tmp_path)
+
+    assert "export hash tree of [%s]" % SYSTEM_ID in output
+    assert trees == json.loads(json.dumps(do_migrate.export_hash_trees(_data_list())))
+
+
+def test_hash_tree_command_with_snapshot(tmp_path):
+    snapshot = {
+        "base_info": {"id": SYSTEM_ID, "name": "test", "clients": SYSTEM_ID},
+        "actions": [{"id": "a0", "name": "a0", "description": "d0"}, {"id": "a1", "name": "a1", "description": "x"}],
+    }
+    snapshot_file = write_json(tmp_path / "snapshot", {"code": 0, "message": "ok", "data": snapshot})
+
+    output, trees = _run(tmp_path, "--snapshot", snapshot_file)
+
+    assert "export hash tree of [%s], 1 models changed" % SYSTEM_ID in output
+    # the system and a0 are the same as declared
+    assert trees[SYSTEM_ID]["changed"] == {"action": ["a1"]}
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import threading
+import time
+
+import pytest
+
+import do_migrate
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    可控的时钟, do_migrate中的time.time()返回clock[0]
+    """
+    clock = [1000.0]
+    monkeypatch.setattr(do_migrate.time, "time", lambda: clock[0])
+    return clock
+
+
+# =================== rate limiter ===================
+
+
+def test_rate_limiter_paces_the_requests_after_the_burst(clock):
+    limiter = do_migrate.RateLimiter(rate=10, burst=2)
+
+    assert [limiter.reserve() for _ in range(2)] == [0, 0]
+    # the tokens are reserved in order, every request waits 1/rate longer than the previous one
+    assert [limiter.reserve() for _ in range(3)] == pytest.approx([0.1, 0.2, 0.3])
+
+    # the tokens are refilled by the elapsed time, at most the burst
+    clock[0] += 10
+    assert [limiter.reserve() for _ in range(3)] == pytest.approx([0, 0, 0.1])
+
+
+def test_rate_limiter_is_disabled_without_rate(clock):
+    limiter = do_migrate.RateLimiter(rate=0)
+
+    assert all(limiter.reserve() == 0 for _ in range(100))
+
+
+def test_rate_limiter_acquire_waits(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(do_migrate.time, "sleep", sleeps.append)
+    limiter = do_migrate.RateLimiter(rate=20, burst=1)
+
+    for _ in range(3):
+        limiter.acquire()
+
+    assert len(sleeps) == 2
+    assert sleeps[1] == pytest.approx(0.1, abs=0.01)
+
+
+# =================== adaptive concurrency ===================
+
+
+def _call(limiter, status, retry_after=None):
+    limiter.acquire()
+    limiter.release({"status": status, "retry_after": retry_after})
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_concurrency_halves_at_most_once_per_second(clock, status):
+    limiter = do_migrate.AdaptiveConcurrency(16)
+
+    _call(limiter, status)
+    assert limiter.limit == 8
+    # the other requests sent before the decrease are throttled too, the limit is not decreased again
+    _call(limiter, status)
+    clock[0] += 0.5
+    _call(limiter, status)
+    assert limiter.limit == 8
+
+    clock[0] += 1
+    _call(limiter, status)
+    assert limiter.limit == 4
+
+
+def test_concurrency_does_not_halve_on_other_errors(clock):
+    limiter = do_migrate.AdaptiveConcurrency(16)
+
+    _call(limiter, 500)
+    _call(limiter, 413)
+
+    assert limiter.limit == 16
+
+
+def test_concurrency_recovers_additively(clock):
+    limiter = do_migrate.AdaptiveConcurrency(8)
+    _call(limiter, 429)
+    assert limiter.limit == 4
+
+    # +1/limit for every success, i.e. +1 for every round of limit requests
+    for _ in range(4):
+        _call(limiter, 200)
+    assert int(limiter.limit) == 4
+    assert limiter.limit == pytest.approx(5, abs=0.2)
+
+    for _ in range(100):
+        _call(limiter, 200)
+    assert limiter.limit == 8
+
+
+def test_retry_after_pauses_all_requests(clock):
+    limiter = do_migrate.AdaptiveConcurrency(4)
+    _call(limiter, 429, retry_after=2)
+
+    assert limiter.paused_until == 1002
+    assert limiter._try_acquire() == pytest.approx(2)
+    clock[0] += 2
+    assert limiter._try_acquire() == 0
+
+
+def test_acquire_waits_for_the_retry_after():
+    limiter = do_migrate.AdaptiveConcurrency(4)
+    _call(limiter, 503, retry_after=0.2)
+
+    start = time.time()
+    _call(limiter, 200)
+
+    assert time.time() - start >= 0.19
+
+
+def test_acquire_waits_for_a_release():
+    limiter = do_migrate.AdaptiveConcurrency(1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def acquire():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert not acquired.wait(0.1)
+
+    limiter.release({"status": 200})
+    assert acquired.wait(1)
+    thread.join()
+    assert limiter.in_flight == 1
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import json
+
+import do_migrate
+from conftest import SYSTEM_ID, action, migration_data
+
+
+def _action(action_id, description="d"):
+    related = [{"system_id": SYSTEM_ID, "id": "repo", "related_instance_selections": [{"id": "repo_list"}]}]
+    # every action has its own copy of the same nested blocks, like the models loaded from json
+    data = dict(action(action_id, related_resource_types=related)["data"], description=description)
+    return json.loads(json.dumps(data))
+
+
+# =================== intern ===================
+
+
+def test_identical_nested_blocks_are_shared():
+    store = do_migrate.ModelStore()
+    store.save("action", "a0", _action("a0"))
+    store.save("action", "a1", _action("a1"))
+    a0, a1 = store.get("action", "a0"), store.get("action", "a1")
+
+    assert a0["related_resource_types"] is a1["related_resource_types"]
+    assert a0["description"] is a1["description"]
+    # the models themselves are unique by id
+    assert a0 is not a1
+    assert a0 == _action("a0")
+
+
+def test_different_nested_blocks_are_not_shared():
+    store = do_migrate.ModelStore()
+    other = _action("a1")
+    other["related_resource_types"][0]["id"] = "project"
+    store.save("action", "a0", _action("a0"))
+    store.save("action", "a1", other)
+
+    assert store.get("action", "a0")["related_resource_types"][0]["id"] == "repo"
+    assert store.get("action", "a1")["related_resource_types"][0]["id"] == "project"
+    # the unchanged deeper block is still shared
+    assert (
+        store.get("action", "a0")["related_resource_types"][0]["related_instance_selections"]
+        is store.get("action", "a1")["related_resource_types"][0]["related_instance_selections"]
+    )
+
+
+# =================== read only after save ===================
+
+
+def test_saved_data_does_not_alias_the_caller_data():
+    store = do_migrate.ModelStore()
+    data = _action("a0")
+    store.save("action", "a0", data)
+
+    data["description"] = "changed"
+    data["related_resource_types"][0]["id"] = "changed"
+
+    assert store.get("action", "a0") == _action("a0")
+
+
+def test_update_replaces_the_model():
+    store = do_migrate.ModelStore()
+    store.save("action", "a0", _action("a0"))
+    store.save("action", "a1", _action("a1"))
+    before = store.get("action", "a0")
+    digest = store.digest("action", "a0")
+
+    store.save("action", "a0", {"description": "changed"}, merge=True)
+
+    # the saved data is never changed in place, it may be shared with the other models
+    assert before == _action("a0")
+    assert store.get("action", "a1") == _action("a1")
+    assert store.get("action", "a0") == _action("a0", description="changed")
+    assert store.digest("action", "a0") != digest
+    assert store.digest("action", "a0") == do_migrate.content_hash(_action("a0", description="changed"))
+
+
+# =================== id sets ===================
+
+
+def test_setup_models_with_the_queried_id_sets_keeps_the_models(fake_iam, new_client):
+    data = migration_data([action("a0", description="d"), action("a1")])
+    assert do_migrate.do_migrate(data, client=new_client())
+    client = new_client()
+
+    id_sets = client.query_all_models(SYSTEM_ID)
+    assert id_sets == ({SYSTEM_ID}, set(), {"a0", "a1"}, set())
+    client.setup_models(*id_sets)
+
+    assert client.action_id_set == {"a0", "a1"}
+    # the queried models are kept, the unchanged model is skipped
+    assert client.upsert_action(SYSTEM_ID, action("a0", description="d")["data"]) == (True, do_migrate.SKIP_MESSAGE)
+
+
+def test_setup_models_adds_and_removes_the_ids(fake_iam, new_client):
+    client = new_client()
+    client.save_model("action", "a0", {"id": "a0"})
+    client.save_model("action", "a1", {"id": "a1"})
+
+    client.setup_models({SYSTEM_ID}, {"r0"}, {"a1", "a2"}, set())
+
+    assert client.system_id_set == {SYSTEM_ID}
+    assert client.resource_id_set == {"r0"}
+    assert client.action_id_set == {"a1", "a2"}
+    assert not client.instance_selection_id_set
+    assert client.models.get("action", "a1") == {"id": "a1"}
+    # no data of the added ids, the upsert is not skipped
+    assert client.models.get("action", "a2") is None
+    assert not client.is_model_unchanged("action", "a2", {"id": "a2"})
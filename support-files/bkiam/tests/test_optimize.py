@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import do_migrate
+from conftest import action, iam_models, migration_data, write_json
+
+
+def _load(data_file, stream):
+    return data_file, do_migrate.load_migration_data(data_file, stream_threshold=0 if stream else None)
+
+
+def test_writes_of_the_same_model_are_merged(tmp_path):
+    data_file = write_json(tmp_path / "0001_test.json", migration_data([action("a0"), action("a0", description="d")]))
+
+    data_list, merged, superseded = do_migrate.optimize_data_list([_load(data_file, stream=False)])
+
+    operations = data_list[0][1]["operations"]
+    assert (merged, superseded) == (1, 0)
+    assert operations[1]["data"]["description"] == "d"
+    assert operations[2]["superseded_by"] == "0001_test.json#1"
+
+
+def test_streamed_file_is_a_merge_barrier(tmp_path, fake_iam, new_client):
+    first = write_json(tmp_path / "0001_first.json", migration_data([action("a0")]))
+    streamed = write_json(
+        tmp_path / "0002_streamed.json", migration_data([action("a1"), action("a0", description="s")])
+    )
+    last = write_json(
+        tmp_path / "0003_last.json",
+        migration_data([action("a0", description="l"), action("a1", description="l"), action("a1", description="m")]),
+    )
+
+    data_list, merged, _ = do_migrate.optimize_data_list(
+        [_load(first, stream=False), _load(streamed, stream=True), _load(last, stream=False)]
+    )
+
+    # only the writes after the streamed file are merged
+    assert merged == 1
+    assert "superseded_by" not in data_list[0][1]["operations"][1]
+    assert isinstance(data_list[1][1]["operations"], do_migrate.StreamedOperations)
+    assert data_list[2][1]["operations"][3]["superseded_by"] == "0003_last.json#2"
+
+    for _, data in data_list:
+        assert do_migrate.do_migrate(data, client=new_client())
+    assert iam_models(fake_iam)["a0"]["description"] == "l"
+    assert iam_models(fake_iam)["a1"]["description"] == "m"
+
+
+def test_writes_are_not_merged_into_the_completed_operations(tmp_path, fake_iam, new_client):
+    journal_path = str(tmp_path / "journal")
+    first = write_json(
+        tmp_path / "0001_a.json", migration_data([action("a0", description="v1"), action("broken")])
+    )
+    second = write_json(tmp_path / "0002_b.json", migration_data([action("a0", description="x")]))
+
+    def handler(method, path, data):
+        if method == "POST" and path.endswith("/actions") and data[0]["id"] == "broken":
+            return 200, {"code": 1902409, "message": "conflict", "data": None}
+        return fake_iam(method, path, data)
+
+    def migrate(handler):
+        data_list = do_migrate.prepare_data_list([first, second], journal_path=journal_path)[0]
+        return do_migrate.migrate_files(new_client(handler=handler), data_list, journal_path=journal_path)
+
+    assert not migrate(handler)
+    assert iam_models(fake_iam)["a0"]["description"] == "x"
+
+    # the later file is changed before the retry
+    write_json(second, migration_data([action("a0", description="y")]))
+    assert migrate(fake_iam)
+
+    assert iam_models(fake_iam)["a0"]["description"] == "y"
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import do_migrate
+from bench_migrate import FakeIAMState
+from conftest import SYSTEM_ID, action, iam_models, migration_data, write_json
+
+
+def _operations(description):
+    resource_types = [
+        {"operation": "upsert_resource_type", "data": {"id": "r%d" % i, "name": "r%d" % i, "description": description}}
+        for i in range(3)
+    ]
+    instance_selection = {
+        "operation": "upsert_instance_selection",
+        "data": {
+            "id": "is0",
+            "name": "is0",
+            "description": description,
+            "resource_type_chain": [{"system_id": SYSTEM_ID, "id": "r0"}],
+        },
+    }
+    related = [{"system_id": SYSTEM_ID, "id": "r0", "related_instance_selections": [{"id": "is0"}]}]
+    actions = [action("a%d" % i, description=description, related_resource_types=related) for i in range(4)]
+    return resource_types + [instance_selection] + actions
+
+
+def _migrate(capsys, new_client, operations, workers):
+    fake_iam = FakeIAMState()
+    assert do_migrate.do_migrate(migration_data(_operations("initial")), client=new_client(handler=fake_iam))
+    capsys.readouterr()
+
+    ok = do_migrate.do_migrate(migration_data(operations), client=new_client(handler=fake_iam), workers=workers)
+    lines = [line for line in capsys.readouterr().out.splitlines() if line.startswith("execute operation")]
+    return ok, lines, fake_iam
+
+
+def test_parallel_output_is_the_same_as_sequential(capsys, new_client):
+    operations = _operations("changed")
+    ok, sequential, sequential_iam = _migrate(capsys, new_client, operations, workers=1)
+    assert ok
+    ok, parallel, parallel_iam = _migrate(capsys, new_client, operations, workers=4)
+    assert ok
+
+    assert parallel == sequential
+    assert "execute operation [upsert_resource_type] id=r1 success!" in parallel
+    assert "execute operation [upsert_instance_selection] id=is0 success!" in parallel
+    assert parallel_iam.systems == sequential_iam.systems
+
+
+def test_parallel_does_not_change_the_operation_data(capsys, new_client):
+    operations = _operations("changed")
+    _migrate(capsys, new_client, operations, workers=4)
+
+    assert all(op["data"].get("id") for op in operations)
+
+
+def test_parallel_stops_after_the_failed_level(capsys, new_client):
+    operations = _operations("changed")
+    operations[1] = {"operation": "upsert_resource_type", "data": {"name": "no id"}}
+
+    ok, lines, fake_iam = _migrate(capsys, new_client, operations, workers=4)
+
+    assert not ok
+    assert not any("upsert_action" in line for line in lines)
+    assert iam_models(fake_iam)["a0"]["description"] == "initial"
+
+
+def test_parallel_batches_the_adds_of_each_level(fake_iam, new_client):
+    client = new_client()
+    operations = _operations("initial") + [action("a%d" % i) for i in range(4, 9)]
+
+    assert do_migrate.do_migrate(migration_data(operations), client=client, workers=4, batch_size=4)
+
+    posts = [
+        (path.rsplit("/", 1)[-1], [d["id"] for d in data])
+        for method, path, data in client.transport.requests
+        if method == "POST" and isinstance(data, list)
+    ]
+    # the resource types, the instance selection and the actions are in different levels
+    assert posts == [
+        ("resource-types", ["r0", "r1", "r2"]),
+        ("instance-selections", ["is0"]),
+        ("actions", ["a0", "a1", "a2", "a3"]),
+        ("actions", ["a4", "a5", "a6", "a7"]),
+        ("actions", ["a8"]),
+    ]
+    assert sorted(iam_models(fake_iam)) == ["a%d" % i for i in range(9)]
+
+
+def test_parallel_batch_resumes_from_the_journal(tmp_path, fake_iam, new_client, capsys):
+    journal_path = str(tmp_path / "journal")
+    data = migration_data([action("a%d" % i) for i in range(4)])
+    data_file = write_json(tmp_path / "0001_test.json", data)
+
+    def handler(method, path, data):
+        if method == "POST" and path.endswith("/actions") and "a2" in [d["id"] for d in data]:
+            return 200, {"code": 1902409, "message": "conflict", "data": None}
+        return fake_iam(method, path, data)
+
+    journal = do_migrate.OperationJournal(journal_path, data_file)
+    assert not do_migrate.do_migrate(data, client=new_client(handler=handler), workers=4, batch_size=2, journal=journal)
+    assert "execute batch operation [add_action] id=a0,a1 success!" in capsys.readouterr().out
+
+    journal = do_migrate.OperationJournal(journal_path, data_file)
+    client = new_client()
+    assert do_migrate.do_migrate(data, client=client, workers=4, batch_size=2, journal=journal)
+
+    posts = [[d["id"] for d in data] for method, _, data in client.transport.requests if method == "POST"]
+    assert posts == [["a2", "a3"]]
+    assert sorted(iam_models(fake_iam)) == ["a0", "a1", "a2", "a3"]
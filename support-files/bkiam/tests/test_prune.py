@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import do_migrate
+from bench_migrate import FakeIAMServer, FakeIAMState
+from conftest import BKIAM_DIR, SYSTEM_ID, action, iam_models, migration_data, write_json
+
+
+def _add_models(fake_iam, kind, ids):
+    if SYSTEM_ID not in fake_iam.systems:
+        fake_iam.new_system({"id": SYSTEM_ID, "name": "test", "clients": SYSTEM_ID})
+    iam_models(fake_iam, kind).update((_id, {"id": _id, "name": _id}) for _id in ids)
+
+
+def _add_stale_models(fake_iam):
+    _add_models(fake_iam, "actions", ["a%d" % i for i in range(5)])
+    _add_models(fake_iam, "instance_selections", ["is0", "is1"])
+    _add_models(fake_iam, "resource_types", ["r0", "r1", "r2"])
+
+
+def _deletes(transport):
+    """
+    发送的DELETE请求, [(模型类型, [id])]
+    """
+    return [
+        (path.split("?", 1)[0].rsplit("/", 1)[-1], [d["id"] for d in data])
+        for method, path, data in transport.requests
+        if method == "DELETE"
+    ]
+
+
+def test_stale_ids_exclude_the_models_declared_in_the_skipped_files(tmp_path, fake_iam, new_client):
+    _add_models(fake_iam, "actions", ["a0", "a1", "stale"])
+    first = migration_data([action("a0")])
+    first_file = write_json(tmp_path / "0001_first.json", first)
+    second_file = write_json(tmp_path / "0002_second.json", migration_data([action("a1")]))
+    ledger = do_migrate.MigrationLedger(str(tmp_path / "ledger")).load()
+    ledger.mark_applied(first_file, first)
+
+    data_list, skipped, _, declared = do_migrate.prepare_data_list([first_file, second_file], ledger=ledger)
+    assert skipped == [first_file]
+    assert [data_file for data_file, _ in data_list] == [second_file]
+
+    stale = do_migrate.stale_model_ids(new_client(), SYSTEM_ID, declared)
+
+    assert stale == [("action", ["stale"]), ("instance_selection", []), ("resource_type", [])]
+
+
+@pytest.mark.parametrize(
+    "batch_chunker, expected",
+    [
+        (
+            do_migrate.BatchChunker(),
+            [
+                ("actions", ["a0", "a1", "a2", "a3", "a4"]),
+                ("instance-selections", ["is0", "is1"]),
+                ("resource-types", ["r0", "r1", "r2"]),
+            ],
+        ),
+        (
+            do_migrate.BatchChunker(initial_items=2, max_items=2),
+            [
+                ("actions", ["a0", "a1"]),
+                ("actions", ["a2", "a3"]),
+                ("actions", ["a4"]),
+                ("instance-selections", ["is0", "is1"]),
+                ("resource-types", ["r0", "r1"]),
+                ("resource-types", ["r2"]),
+            ],
+        ),
+    ],
+)
+def test_prune_deletes_the_referencing_models_first_in_batches(fake_iam, new_client, batch_chunker, expected):
+    _add_stale_models(fake_iam)
+    client = new_client(batch_chunker=batch_chunker)
+
+    assert do_migrate.prune_models(client, SYSTEM_ID, {})
+
+    assert _deletes(client.transport) == expected
+    assert not any(fake_iam.systems[SYSTEM_ID][kind] for kind in ("actions", "instance_selections", "resource_types"))
+
+
+def test_prune_deletes_nothing_if_the_query_fails(fake_iam, new_client):
+    _add_stale_models(fake_iam)
+
+    def handler(method, path, data):
+        if path.endswith("/query"):
+            return 500, {"code": 1, "message": "internal error"}
+        return fake_iam(method, path, data)
+
+    client = new_client(handler=handler, retry_policy=do_migrate.RetryPolicy(max_retries=0))
+    do_migrate.prune_models(client, SYSTEM_ID, {})
+
+    assert not _deletes(client.transport)
+    assert len(iam_models(fake_iam)) == 5
+
+
+def test_plan_prune_lists_the_deletes_without_sending_them(fake_iam, new_client):
+    _add_stale_models(fake_iam)
+    client = new_client(client_class=do_migrate.PlanClient)
+
+    assert do_migrate.prune_models(client, SYSTEM_ID, {})
+
+    assert not _deletes(client.transport)
+    assert [operation for _, _, operation, _ in client.plan["delete"]] == [
+        "delete_action id=a0,a1,a2,a3,a4",
+        "delete_instance_selection id=is0,is1",
+        "delete_resource_type id=r0,r1,r2",
+    ]
+
+
+class MethodRecordingState(FakeIAMState):
+    def __init__(self):
+        super(MethodRecordingState, self).__init__()
+        self.methods = []
+
+    def __call__(self, method, path, body):
+        self.methods.append(method)
+        return super(MethodRecordingState, self).__call__(method, path, body)
+
+
+def test_plan_prune_command_sends_no_delete(tmp_path):
+    state = MethodRecordingState()
+    _add_stale_models(state)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    write_json(data_dir / "0001_test.json", migration_data([action("a0")]))
+    server = FakeIAMServer(state).start()
+    try:
+        output = subprocess.check_output(
+            [sys.executable, os.path.join(BKIAM_DIR, "do_migrate.py"), "-t", server.host, "-a", "app", "-s", "secret"]
+            + ["-d", str(data_dir), "--plan", "--prune"],
+            cwd=str(tmp_path),
+            universal_newlines=True,
+        )
+    finally:
+        server.stop()
+
+    assert "DELETE" not in state.methods
+    assert "prune [%s]: stale action id=a1" % SYSTEM_ID in output
+    assert "DELETE /api/v1/model/systems/%s/resource-types" % SYSTEM_ID in output
+    assert sorted(iam_models(state)) == ["a0", "a1", "a2", "a3", "a4"]
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import json
+
+import pytest
+
+import do_migrate
+from conftest import SYSTEM_ID
+
+HOST = "http://iam.test"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    可控的时钟, do_migrate中的time.sleep只推进时钟; sleeps为等待的时长
+    """
+
+    class Clock(object):
+        def __init__(self):
+            self.now = 1000.0
+            self.sleeps = []
+
+        def sleep(self, seconds):
+            self.sleeps.append(seconds)
+            self.now += seconds
+
+    clock = Clock()
+    monkeypatch.setattr(do_migrate.time, "time", lambda: clock.now)
+    monkeypatch.setattr(do_migrate.time, "sleep", clock.sleep)
+    return clock
+
+
+class Ping(object):
+    """
+    记录调用的ping, 按results依次返回结果, 之后一直返回最后一个
+    """
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.timeouts = []
+
+    def __call__(self, timeout):
+        self.timeouts.append(timeout)
+        ok = self.results.pop(0) if len(self.results) > 1 else self.results[0]
+        return ok, {} if ok else {"error": "connection refused"}
+
+
+def test_cached_readiness_skips_the_ping(tmp_path, clock):
+    path = str(tmp_path / "readiness")
+    do_migrate.ReadinessProbe(HOST, path, ttl=60).mark_ready()
+
+    # another process reads the state file
+    ping = Ping(True)
+    assert do_migrate.ReadinessProbe(HOST, path, ttl=60).wait(ping)
+    assert not ping.timeouts
+    # the other hosts are not ready
+    assert not do_migrate.ReadinessProbe("http://other.test", path, ttl=60).is_ready()
+
+    clock.now += 60
+    assert do_migrate.ReadinessProbe(HOST, path, ttl=60).wait(ping)
+    assert len(ping.timeouts) == 1
+
+
+def test_api_call_refreshes_the_readiness(tmp_path, clock, fake_iam, new_client):
+    path = str(tmp_path / "readiness")
+    probe = do_migrate.ReadinessProbe(HOST, path, ttl=60)
+    client = new_client(readiness=probe)
+
+    client.api_query(SYSTEM_ID)
+    assert probe.ready_at == clock.now
+    with open(path) as f:
+        assert json.load(f) == {HOST: clock.now}
+
+    # refreshed once half of the ttl passed
+    clock.now += 20
+    client.api_query(SYSTEM_ID)
+    assert probe.ready_at == clock.now - 20
+    clock.now += 20
+    client.api_query(SYSTEM_ID)
+    assert probe.ready_at == clock.now
+
+    # no ping is sent by the client
+    clock.now += 50
+    assert client.wait_ready()
+    assert not [path for _, path, _ in client.transport.requests if path == "/ping"]
+
+
+def test_wait_gives_up_after_the_deadline(clock):
+    probe = do_migrate.ReadinessProbe(HOST, timeout=10, backoff=1, max_backoff=3)
+    ping = Ping(False)
+    start = clock.now
+
+    assert not probe.wait(ping)
+
+    assert probe.ready_at is None
+    assert len(clock.sleeps) >= 3
+    # exponential backoff with jitter, capped by max_backoff
+    for attempt, delay in enumerate(clock.sleeps):
+        assert 0.5 * min(3, 2 ** attempt) <= delay <= min(3, 2 ** attempt)
+    assert clock.now - start < 10
+    assert all(timeout <= do_migrate.PING_TIMEOUT for timeout in ping.timeouts)
+
+
+def test_wait_returns_once_ready(clock):
+    probe = do_migrate.ReadinessProbe(HOST, timeout=60, backoff=1)
+    ping = Ping(False, False, True)
+
+    assert probe.wait(ping)
+
+    assert len(ping.timeouts) == 3
+    assert len(clock.sleeps) == 2
+    assert probe.is_ready()
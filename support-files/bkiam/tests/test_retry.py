@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import time
+
+import pytest
+
+import do_migrate
+from conftest import SYSTEM_ID
+
+# an api of every method
+METHOD_APIS = {"GET": "query", "PUT": "update_action", "DELETE": "batch_delete_actions", "POST": "batch_add_actions"}
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    重试前等待的时长, 不实际等待
+    """
+    sleeps = []
+    monkeypatch.setattr(do_migrate.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def _failing(status, headers=None, times=None):
+    """
+    前times次(默认全部)请求返回status的handler
+    """
+    calls = []
+
+    def handler(method, path, data):
+        calls.append(method)
+        if times is None or len(calls) <= times:
+            return status, {"code": 1, "message": "error"}, headers or {}
+        return 200, {"code": 0, "message": "ok", "data": {}}
+
+    return handler
+
+
+def _call(client, method):
+    name = METHOD_APIS[method]
+    data = None if method == "GET" else [{"id": "a0"}]
+    return client._call_api(name, data, system_id=SYSTEM_ID, action_id="a0")
+
+
+@pytest.mark.parametrize("method", ["GET", "PUT", "DELETE"])
+def test_idempotent_requests_retry_on_5xx(new_client, sleeps, method):
+    client = new_client(handler=_failing(503, times=2))
+
+    ok, _, _ = _call(client, method)
+
+    assert ok
+    assert [m for m, _, _ in client.transport.requests] == [method] * 3
+    assert len(sleeps) == 2 and sleeps[1] > 0
+
+
+def test_post_does_not_retry_on_5xx(new_client, sleeps):
+    client = new_client(handler=_failing(500, times=1))
+
+    ok, _, _ = _call(client, "POST")
+
+    # the request may have been processed, sending it again could fail with a conflict or create duplicates
+    assert not ok
+    assert len(client.transport.requests) == 1
+    assert not sleeps
+
+
+def test_post_retries_on_429(new_client, sleeps):
+    client = new_client(handler=_failing(429, times=1))
+
+    ok, _, _ = _call(client, "POST")
+
+    # 429 is answered by the gateway or iam before the request is processed, so it is safe to send again
+    assert ok
+    assert len(client.transport.requests) == 2
+
+
+def test_retry_after_is_respected(new_client, sleeps):
+    policy = do_migrate.RetryPolicy(backoff=0.001)
+    client = new_client(handler=_failing(429, {"Retry-After": "0.05"}, times=1), retry_policy=policy)
+
+    assert _call(client, "PUT")[0]
+
+    assert sleeps == [0.05]
+    # the backoff is used if it is longer
+    error = {"status_code": 503, "retry_after": 0.05}
+    assert do_migrate.RetryPolicy(backoff=1).retry_delay("GET", 0, False, error) >= 0.5
+
+
+def test_retry_budget_is_shared_by_all_requests(new_client, sleeps):
+    policy = do_migrate.RetryPolicy(max_retries=5, retry_budget=3)
+    client = new_client(handler=_failing(503), retry_policy=policy)
+
+    assert not _call(client, "GET")[0]
+    assert len(client.transport.requests) == 4
+    assert not _call(client, "PUT")[0]
+
+    # no retry once the budget is exhausted
+    assert len(client.transport.requests) == 5
+    assert policy.retries == 3
+
+
+def test_timeout_is_bounded_by_the_deadline(new_client):
+    policy = do_migrate.RetryPolicy(connect_timeout=5, read_timeout=30, deadline=1)
+    assert all(t <= 1 for t in policy.timeout())
+    assert do_migrate.RetryPolicy(connect_timeout=5, read_timeout=30).timeout() == (5, 30)
+
+    policy = do_migrate.RetryPolicy(deadline=0.01)
+    time.sleep(0.02)
+
+    assert policy.timeout() is None
+    client = new_client(retry_policy=policy)
+    ok, message, _ = _call(client, "GET")
+    assert not ok and message == do_migrate.DEADLINE_EXCEEDED_ERROR["error"]
+    assert not client.transport.requests
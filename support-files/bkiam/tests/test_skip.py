@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import pytest
+
+import do_migrate
+from conftest import SYSTEM_ID, action, iam_models, migration_data
+
+RELATED = [{"system_id": SYSTEM_ID, "id": "r0"}]
+
+
+@pytest.fixture
+def loaded_client(fake_iam, new_client):
+    """
+    已执行过迁移的权限中心, 及加载了其模型的Client
+    """
+    data = migration_data(
+        [
+            {"operation": "upsert_resource_type", "data": {"id": "r0", "name": "r0"}},
+            action("a0", description="initial", related_resource_types=RELATED),
+            {"operation": "upsert_action_groups", "data": [{"name": "g0", "actions": [{"id": "a0"}]}]},
+        ]
+    )
+    assert do_migrate.do_migrate(data, client=new_client())
+
+    client = new_client()
+    client.load_models(SYSTEM_ID)
+    return client
+
+
+def _writes(client):
+    return [(method, path) for method, path, _ in client.transport.requests if method in ("POST", "PUT", "DELETE")]
+
+
+def test_unchanged_payload_is_skipped(loaded_client):
+    data = dict(action("a0", description="initial", related_resource_types=RELATED)["data"])
+    # the fields are compared regardless of the key order
+    data = dict(reversed(list(data.items())))
+
+    assert loaded_client.upsert_action(SYSTEM_ID, data) == (True, do_migrate.SKIP_MESSAGE)
+    groups = [{"name": "g0", "actions": [{"id": "a0"}]}]
+    assert loaded_client.upsert_action_groups(SYSTEM_ID, groups) == (True, do_migrate.SKIP_MESSAGE)
+    assert not _writes(loaded_client)
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {"description": "changed"},
+        {"description": ""},
+        {"related_resource_types": []},
+    ],
+    ids=["changed", "cleared-string", "cleared-list"],
+)
+def test_changed_or_cleared_field_is_written(fake_iam, loaded_client, fields):
+    data = dict(action("a0", description="initial", related_resource_types=RELATED)["data"], **fields)
+
+    ok, message = loaded_client.upsert_action(SYSTEM_ID, data)
+
+    assert ok and message != do_migrate.SKIP_MESSAGE
+    assert _writes(loaded_client) == [("PUT", "/api/v1/model/systems/%s/actions/a0" % SYSTEM_ID)]
+    for field, value in fields.items():
+        assert iam_models(fake_iam)["a0"][field] == value
+
+
+def test_config_absent_from_the_query_is_written(loaded_client):
+    data = [{"id": "a0"}]
+
+    ok, message = loaded_client.upsert_common_actions(SYSTEM_ID, data)
+
+    assert ok and message != do_migrate.SKIP_MESSAGE
+    assert _writes(loaded_client) == [("PUT", "/api/v1/model/systems/%s/configs/common_actions" % SYSTEM_ID)]
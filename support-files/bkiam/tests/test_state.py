@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import json
+import multiprocessing
+import os
+
+import do_migrate
+from conftest import SYSTEM_ID, action, migration_data, write_json
+
+
+# =================== ledger ===================
+
+
+def test_ledger_skips_the_applied_files(tmp_path):
+    data = migration_data([action("a0")])
+    data_file = write_json(tmp_path / "0001_test.json", data)
+    ledger_path = str(tmp_path / "ledger")
+
+    ledger = do_migrate.MigrationLedger(ledger_path).load()
+    assert not ledger.is_applied(data_file, data)
+    ledger.mark_applied(data_file, data)
+
+    assert do_migrate.MigrationLedger(ledger_path).load().is_applied(data_file, data)
+
+
+def test_ledger_applies_the_reverted_file_again(tmp_path):
+    ledger_path = str(tmp_path / "ledger")
+    old = migration_data([action("a0", description="old")])
+    new = migration_data([action("a0", description="new")])
+    data_file = write_json(tmp_path / "0001_test.json", old)
+    do_migrate.MigrationLedger(ledger_path).load().mark_applied(data_file, old)
+    write_json(data_file, new)
+    do_migrate.MigrationLedger(ledger_path).load().mark_applied(data_file, new)
+
+    # rollback to the content applied before
+    write_json(data_file, old)
+    ledger = do_migrate.MigrationLedger(ledger_path).load()
+
+    assert not ledger.is_applied(data_file, old)
+    assert len(ledger.records[SYSTEM_ID]) == 1
+
+
+def test_ledger_upgrades_the_records_by_hash(tmp_path):
+    data = migration_data([action("a0")])
+    data_file = write_json(tmp_path / "0001_test.json", data)
+    ledger_path = write_json(
+        tmp_path / "ledger",
+        {
+            SYSTEM_ID: {
+                "0" * 64: {"file": "0001_test.json", "applied_at": 1},
+                do_migrate.file_hash(data_file): {"file": "0001_test.json", "applied_at": 2},
+            }
+        },
+    )
+
+    ledger = do_migrate.MigrationLedger(ledger_path).load()
+
+    assert ledger.is_applied(data_file, data)
+    assert list(ledger.records[SYSTEM_ID]) == ["0001_test.json"]
+
+
+def test_ledger_keeps_the_records_saved_by_others(tmp_path):
+    ledger_path = str(tmp_path / "ledger")
+    first = migration_data([action("a0")], system_id="first")
+    second = migration_data([action("a0")], system_id="second")
+    first_file = write_json(tmp_path / "0001_first.json", first)
+    second_file = write_json(tmp_path / "0001_second.json", second)
+
+    first_ledger = do_migrate.MigrationLedger(ledger_path).load()
+    second_ledger = do_migrate.MigrationLedger(ledger_path).load()
+    first_ledger.mark_applied(first_file, first)
+    second_ledger.mark_applied(second_file, second)
+
+    with open(ledger_path) as f:
+        assert sorted(json.load(f)) == ["first", "second"]
+
+
+def test_ledger_mirror(tmp_path):
+    data = migration_data([action("a0")])
+    data_file = write_json(tmp_path / "0001_test.json", data)
+    mirror_path = str(tmp_path / "mirror")
+    do_migrate.MigrationLedger(str(tmp_path / "ledger"), mirror_path).load().mark_applied(data_file, data)
+
+    # the local ledger is lost after the pod restarted
+    ledger = do_migrate.MigrationLedger(str(tmp_path / "new-ledger"), mirror_path).load()
+
+    assert ledger.is_applied(data_file, data)
+
+
+def _mark_applied(ledger_path, data_dir, system_id):
+    for i in range(10):
+        data = migration_data([action("a%d" % i)], system_id=system_id)
+        data_file = write_json(os.path.join(data_dir, "%04d_%s.json" % (i, system_id)), data)
+        do_migrate.MigrationLedger(ledger_path).load().mark_applied(data_file, data)
+
+
+def test_ledger_shared_by_the_processes(tmp_path):
+    ledger_path = str(tmp_path / "ledger")
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=_mark_applied, args=(ledger_path, str(tmp_path), "system%d" % i)) for i in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in processes)
+    with open(ledger_path) as f:
+        records = json.load(f)
+    assert {system_id: len(files) for system_id, files in records.items()} == {"system%d" % i: 10 for i in range(4)}
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")]
+
+
+# =================== journal ===================
+
+
+def test_journal_resumes_the_failed_migration(tmp_path, fake_iam, new_client):
+    data_file = write_json(tmp_path / "0001_test.json", migration_data([action("a0"), action("a1")]))
+    data_list = [(data_file, do_migrate.load_data(data_file))]
+    journal_path = str(tmp_path / "journal")
+
+    def handler(method, path, data):
+        if method == "POST" and path.endswith("/actions") and data[0]["id"] == "a1":
+            return 200, {"code": 1902409, "message": "conflict", "data": None}
+        return fake_iam(method, path, data)
+
+    client = new_client(handler=handler)
+    assert not do_migrate.migrate_files(client, data_list, journal_path=journal_path)
+    assert do_migrate.OperationJournal(journal_path, data_file).completed.keys() == {0, 1}
+
+    client = new_client()
+    assert do_migrate.migrate_files(client, data_list, journal_path=journal_path)
+
+    posted = [data[0]["id"] for method, path, data in client.transport.requests if path.endswith("/actions")]
+    assert posted == ["a1"]
+    assert not do_migrate.OperationJournal(journal_path, data_file).completed
+
+
+def test_journal_clear_keeps_the_other_files(tmp_path):
+    journal_path = str(tmp_path / "journal")
+    first = write_json(tmp_path / "0001_first.json", migration_data([action("a0")]))
+    second = write_json(tmp_path / "0002_second.json", migration_data([action("a1")]))
+    do_migrate.OperationJournal(journal_path, first).record(0, "upsert_system", "ok")
+    do_migrate.OperationJournal(journal_path, second).record(0, "upsert_system", "ok")
+
+    do_migrate.OperationJournal(journal_path, first).clear()
+
+    assert not do_migrate.OperationJournal(journal_path, first).completed
+    assert do_migrate.OperationJournal(journal_path, second).is_completed(0)
+
+
+def test_journal_is_bound_to_the_placeholder_values(tmp_path):
+    journal_path = str(tmp_path / "journal")
+    data_file = write_json(tmp_path / "0001_test.json", migration_data([action("a0", description="${DESC}")]))
+    old = do_migrate.Placeholders({"DESC": "old"})
+    do_migrate.OperationJournal(journal_path, data_file, old).record(1, "upsert_action", "ok")
+
+    assert do_migrate.OperationJournal(journal_path, data_file, old).is_completed(1)
+    # rendered with another value, the operations should be executed again
+    assert not do_migrate.OperationJournal(journal_path, data_file, do_migrate.Placeholders({"DESC": "new"})).completed
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import io
+import json
+import os
+
+import pytest
+
+import do_migrate
+from conftest import action, iam_models, migration_data, write_json
+
+TRICKY_VALUES = [
+    {"s": 'quote " and brackets ]}[{', "escaped": "back\\slash\\", "u": "蓝鲸"},
+    [[1, [2, [3]]], {"a": {"b": {}}}, []],
+    12345.678e-3,
+    "}]",
+    None,
+]
+
+
+def _read_values(text, chunk_size):
+    reader = do_migrate._JSONStreamReader(io.StringIO(text), chunk_size)
+    reader.expect("[")
+    values = []
+    end = reader.peek() == "]" and reader.expect("]")
+    while not end:
+        values.append(reader.value())
+        end = reader.expect(",]") == "]"
+    return values
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64])
+def test_values_split_across_the_chunks(chunk_size):
+    text = json.dumps(TRICKY_VALUES)
+
+    assert _read_values(text, chunk_size) == TRICKY_VALUES
+
+
+def test_large_value_is_decoded_once():
+    reader = do_migrate._JSONStreamReader(io.StringIO(json.dumps({"items": list(range(5000))})), chunk_size=16)
+    calls = []
+    raw_decode = reader.decoder.raw_decode
+    reader.decoder.raw_decode = lambda s, idx=0: calls.append(idx) or raw_decode(s, idx)
+
+    assert reader.value() == {"items": list(range(5000))}
+    assert len(calls) == 1
+
+
+def test_truncated_value_is_an_error():
+    with pytest.raises(ValueError):
+        _read_values('[{"a": [1, 2', chunk_size=4)
+
+
+def test_streamed_file_is_parsed_once(tmp_path, monkeypatch, fake_iam, new_client):
+    data_file = write_json(tmp_path / "0001_test.json", migration_data([action("a%d" % i) for i in range(5)]))
+    calls = []
+    iter_json_data = do_migrate.iter_json_data
+    monkeypatch.setattr(do_migrate, "iter_json_data", lambda *args: calls.append(args) or iter_json_data(*args))
+
+    data_list, skipped, _, _ = do_migrate.prepare_data_list([data_file], stream_threshold=0, optimize=False)
+    data = data_list[0][1]
+    assert isinstance(data["operations"], do_migrate.StreamedOperations)
+    assert len(data["operations"]) == 6
+    assert do_migrate.do_migrate(data, client=new_client())
+
+    assert len(calls) == 1
+    assert sorted(iam_models(fake_iam)) == ["a%d" % i for i in range(5)]
+
+
+def test_streamed_operations_render_the_placeholders(tmp_path):
+    data_file = write_json(tmp_path / "0001_test.json", migration_data([action("a0", description="${DESC}")]))
+    placeholders = do_migrate.Placeholders({"DESC": "rendered"})
+
+    data = do_migrate.load_migration_data(data_file, stream_threshold=0, placeholders=placeholders)
+
+    assert list(data["operations"])[1]["data"]["description"] == "rendered"
+    # the operations can be iterated again
+    assert len(list(data["operations"])) == 2
+
+
+def test_spool_is_removed_after_closed(tmp_path):
+    data_file = write_json(tmp_path / "0001_test.json", migration_data([action("a0")]))
+    operations = do_migrate.load_migration_data(data_file, stream_threshold=0)["operations"]
+    spool_path = operations.spool_path
+
+    operations.close()
+
+    assert not os.path.exists(spool_path)
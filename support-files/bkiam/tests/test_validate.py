@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import do_migrate
+from conftest import SYSTEM_ID, action, iam_models, migration_data
+
+
+def _resource_type(resource_type_id):
+    return {"operation": "upsert_resource_type", "data": {"id": resource_type_id, "name": resource_type_id}}
+
+
+def _instance_selection(instance_selection_id, resource_type_id="r0"):
+    return {
+        "operation": "upsert_instance_selection",
+        "data": {
+            "id": instance_selection_id,
+            "name": instance_selection_id,
+            "resource_type_chain": [{"system_id": SYSTEM_ID, "id": resource_type_id}],
+        },
+    }
+
+
+def _related(resource_type_id, *instance_selection_ids):
+    return [
+        {
+            "system_id": SYSTEM_ID,
+            "id": resource_type_id,
+            "related_instance_selections": [{"system_id": SYSTEM_ID, "id": i} for i in instance_selection_ids],
+        }
+    ]
+
+
+def _validate(client, *files):
+    """
+    与执行前的校验一致: 先离线校验所有迁移文件, 再用查询到的模型检查未声明的引用
+    """
+    data_list = [("%04d_test.json" % (i + 1), migration_data(operations)) for i, operations in enumerate(files)]
+    errors, unresolved_refs = do_migrate.validate_data_list(data_list)
+    return errors + do_migrate.check_refs_with_models(client, unresolved_refs)
+
+
+def test_valid_references_pass(new_client):
+    operations = [
+        _resource_type("r0"),
+        _instance_selection("is0"),
+        action("a0", related_resource_types=_related("r0", "is0")),
+        {"operation": "upsert_action_groups", "data": [{"name": "g0", "actions": [{"id": "a0"}]}]},
+    ]
+
+    assert _validate(new_client(), operations) == []
+
+
+def test_missing_id(new_client):
+    operations = [{"operation": "upsert_action", "data": {"name": "no id"}}]
+
+    assert _validate(new_client(), operations) == [
+        "[0001_test.json] operations[1] upsert_action: the field `id` required"
+    ]
+
+
+def test_unknown_related_resource_type(new_client):
+    operations = [action("a0", related_resource_types=_related("r9"))]
+
+    assert _validate(new_client(), operations) == [
+        "[0001_test.json] operations[1] upsert_action id=a0: "
+        "related_resource_types references unknown resource type `r9`"
+    ]
+
+
+def test_unknown_related_instance_selection(new_client):
+    operations = [_resource_type("r0"), action("a0", related_resource_types=_related("r0", "is9"))]
+
+    assert _validate(new_client(), operations) == [
+        "[0001_test.json] operations[2] upsert_action id=a0: "
+        "related_instance_selections references unknown instance selection `is9`"
+    ]
+
+
+def test_unknown_action_in_the_configs(new_client):
+    operations = [
+        action("a0"),
+        {"operation": "upsert_action_groups", "data": [{"name": "g0", "actions": [{"id": "a0"}, {"id": "a9"}]}]},
+        _resource_type("r0"),
+        {
+            "operation": "upsert_resource_creator_actions",
+            "data": {"config": [{"id": "r0", "actions": [{"id": "a8", "required": False}]}]},
+        },
+    ]
+
+    assert _validate(new_client(), operations) == [
+        "[0001_test.json] operations[2] upsert_action_groups: [0].actions references unknown action `a9`",
+        "[0001_test.json] operations[4] upsert_resource_creator_actions: "
+        "config[0].actions references unknown action `a8`",
+    ]
+
+
+def test_reference_satisfied_only_by_the_queried_model(fake_iam, new_client):
+    operations = [action("a0", related_resource_types=_related("r0"))]
+    assert len(_validate(new_client(), operations)) == 1
+
+    fake_iam.new_system({"id": SYSTEM_ID, "name": "test", "clients": SYSTEM_ID})
+    iam_models(fake_iam, "resource_types")["r0"] = {"id": "r0", "name": "r0"}
+
+    assert _validate(new_client(), operations) == []
+
+
+def test_all_errors_are_reported_in_one_pass(new_client):
+    first = [
+        {"operation": "upsert_action", "data": {"name": "no id"}},
+        {"operation": "no_such_operation", "data": {"id": "x"}},
+        action("a0", related_resource_types=_related("r9")),
+    ]
+    second = [
+        {"operation": "upsert_resource_type", "data": {}},
+        action("a1", related_resource_types=_related("r9", "is9")),
+    ]
+
+    errors = _validate(new_client(), first, second)
+
+    assert [error.split(":", 1)[0] for error in errors] == [
+        "[0001_test.json] operations[1] upsert_action",
+        "[0001_test.json] operations[2] no_such_operation",
+        "[0002_test.json] operations[1] upsert_resource_type",
+        "[0001_test.json] operations[3] upsert_action id=a0",
+        "[0002_test.json] operations[2] upsert_action id=a1",
+        "[0002_test.json] operations[2] upsert_action id=a1",
+    ]
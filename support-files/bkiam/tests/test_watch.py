@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+TencentBlueKing is pleased to support the open source community by making
+蓝鲸智云-权限中心Python SDK(iam-python-sdk) available.
+Copyright (C) 2017-2021 Tencent. All rights reserved.
+Licensed under the MIT License (the "License"); you may not use this file except in compliance with the License.
+You may obtain a copy of the License at http://opensource.org/licenses/MIT
+Unless required by applicable law or agreed to in writing, software distributed under the License is distributed on
+an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the License for the
+specific language governing permissions and limitations under the License.
+"""
+
+import do_migrate
+from conftest import action, iam_models, migration_data, write_json
+
+
+class FakeInotify(object):
+    """
+    每次wait都视为目录有变化, 执行完rounds轮后停止watch
+    """
+
+    available = True
+
+    def __init__(self, rounds, on_wait=None):
+        self.rounds = rounds
+        self.on_wait = on_wait
+
+    def __call__(self, directory):
+        return self
+
+    def wait(self, timeout):
+        if timeout == 0:
+            return False
+        if not self.rounds:
+            raise KeyboardInterrupt
+        self.rounds -= 1
+        if self.on_wait:
+            self.on_wait()
+        return True
+
+    def close(self):
+        pass
+
+
+def _new_watcher(tmp_path, new_client, handler):
+    data_dir = tmp_path / "migrations"
+    data_dir.mkdir()
+    data_file = write_json(data_dir / "0001_test.json", migration_data([action("a0")]))
+    client = new_client(handler=handler)
+    watcher = do_migrate.MigrationWatcher(
+        client, str(data_dir), resync_interval=0, journal_path=str(tmp_path / "journal")
+    )
+    return watcher, data_file
+
+
+def test_failed_file_is_applied_in_the_next_round(tmp_path, monkeypatch, capsys, fake_iam, new_client):
+    broken = [True]
+
+    def handler(method, path, data):
+        if broken[0] and method == "POST" and path.endswith("/actions"):
+            return 500, {"code": 500, "message": "internal error"}
+        return fake_iam(method, path, data)
+
+    watcher, data_file = _new_watcher(tmp_path, new_client, handler)
+    watcher.retry_policy_factory = lambda: do_migrate.RetryPolicy(max_retries=0)
+    monkeypatch.setattr(do_migrate, "WATCH_DEBOUNCE", 0)
+    monkeypatch.setattr(do_migrate, "_Inotify", FakeInotify(1, on_wait=lambda: broken.__setitem__(0, False)))
+
+    watcher.run()
+
+    output = capsys.readouterr().out
+    assert "resync disabled" in output
+    assert "migration file [%s] failed in the last round, apply again" % data_file in output
+    assert list(iam_models(fake_iam)) == ["a0"]
+    assert not watcher.pending
+
+
+def test_unchanged_files_are_not_applied_again(tmp_path, monkeypatch, fake_iam, new_client):
+    watcher, _ = _new_watcher(tmp_path, new_client, fake_iam)
+    monkeypatch.setattr(do_migrate, "WATCH_DEBOUNCE", 0)
+    monkeypatch.setattr(do_migrate, "_Inotify", FakeInotify(2))
+
+    watcher.run()
+
+    requests = watcher.client.transport.requests
+    assert len([r for r in requests if r[0] == "POST" and r[1].endswith("/actions")]) == 1
+    assert not watcher.pending